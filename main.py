@@ -2,6 +2,8 @@
 # 依赖: pywin32, keyboard, PyQt5
 # pip install pywin32 keyboard PyQt5
 # pyinstaller --onefile --windowed --icon=icon.ico --add-data "icon.ico;." main.py
+# 基准测试: python main.py --bench <名称>
+# 重放录制的会话: python main.py --replay <wm_session_*.wmrec> [倍速，0 为尽快]
 
 
 
@@ -9,14 +11,32 @@ import sys
 import threading
 import time
 import json
-from functools import partial
+import re
+import itertools
+import signal
+import mmap
+import struct
+import ctypes
+import hashlib
+import queue
+from ctypes import wintypes
+from array import array
+from collections import namedtuple, deque, OrderedDict
+from difflib import SequenceMatcher
+from functools import partial, wraps
+from types import MappingProxyType
+from contextlib import contextmanager
 
 import keyboard  # global hotkeys
 from PyQt5 import QtWidgets, QtGui, QtCore
-import win32gui
-import win32con
-import win32api
-import win32process
+if sys.platform == 'win32':
+    import win32gui
+    import win32con
+    import win32api
+    import win32process
+else:
+    # 非 Windows 平台使用 X11 后端（见 select_backend）
+    win32gui = win32con = win32api = win32process = None
 
 import os, sys
 
@@ -26,12 +46,393 @@ def resource_path(relative_path):
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.join(os.path.abspath("."), relative_path)
 
+
+PERSIST_FILE = 'wm_config.json'
+
+
+def config_path(name):
+    """配置目录（与 wm_config.json 同目录）下的文件路径"""
+    return os.path.join(os.path.dirname(os.path.abspath(PERSIST_FILE)), name)
+
+
+# ---------------------------
+# Flight recorder: always-on ring buffer of timestamped spans
+# ---------------------------
+
+class FlightRecorder:
+    """
+    固定大小的环形缓冲区，每条记录为 (名称, 开始, 耗时, 线程, hwnd, 结果)。
+    各字段预先分配为数组，记录一条只是几次赋值，不创建对象。
+    用 dump_chrome_trace() 导出后可在 chrome://tracing 或 Perfetto 中打开。
+    """
+
+    def __init__(self, capacity=8192):
+        # capacity 取 2 的幂，方便用位与代替取模
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.capacity = size
+        self._mask = size - 1
+        self._counter = itertools.count()  # next() 在 GIL 下是原子的，多线程写入无需加锁
+        self._names = [None] * size
+        self._results = [None] * size
+        self._starts = array('q', bytes(8 * size))
+        self._durs = array('q', bytes(8 * size))
+        self._hwnds = array('q', bytes(8 * size))
+        self._tids = [0] * size
+        self._written = 0
+        self._epoch_ns = time.perf_counter_ns()
+        self._wall_epoch = time.time()
+
+    def record(self, name, start_ns, end_ns, hwnd=0, result=None):
+        i = next(self._counter)
+        slot = i & self._mask
+        self._names[slot] = name
+        self._starts[slot] = start_ns
+        self._durs[slot] = end_ns - start_ns
+        self._hwnds[slot] = hwnd or 0
+        self._results[slot] = result
+        self._tids[slot] = threading.get_ident()
+        self._written = i + 1
+
+    def instant(self, name, hwnd=0, result=None):
+        """零耗时事件，例如辅助函数里捕获的错误"""
+        now = time.perf_counter_ns()
+        self.record(name, now, now, hwnd, result)
+
+    def span(self, name):
+        """装饰器: 每次调用记录一条耗时；前两个参数中第一个 int 作为 hwnd"""
+        def deco(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                t0 = time.perf_counter_ns()
+                result = None
+                try:
+                    result = func(*args, **kwargs)
+                    return result
+                finally:
+                    hwnd = 0
+                    for a in args[:2]:
+                        if type(a) is int:
+                            hwnd = a
+                            break
+                    if type(result) is list:
+                        result = len(result)
+                    self.record(name, t0, time.perf_counter_ns(), hwnd,
+                                result if type(result) in (bool, int) else None)
+            return wrapper
+        return deco
+
+    def events(self):
+        """已记录的事件，最早的在前"""
+        total = self._written
+        first = max(0, total - self.capacity)
+        out = []
+        for i in range(first, total):
+            slot = i & self._mask
+            name = self._names[slot]
+            if name is None:
+                continue
+            out.append((name, self._starts[slot], self._durs[slot], self._tids[slot],
+                        self._hwnds[slot], self._results[slot]))
+        return out
+
+    def to_chrome_trace(self):
+        pid = os.getpid()
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+        trace = []
+        seen_tids = set()
+        for name, start, dur, tid, hwnd, result in self.events():
+            ev = {
+                'name': name,
+                'cat': name.split(':', 1)[0],
+                'ph': 'X' if dur else 'i',
+                'ts': (start - self._epoch_ns) / 1000.0,
+                'pid': pid,
+                'tid': tid,
+                'args': {},
+            }
+            if dur:
+                ev['dur'] = dur / 1000.0
+            else:
+                ev['s'] = 't'
+            if hwnd:
+                ev['args']['hwnd'] = hwnd
+            if result is not None:
+                ev['args']['result'] = result if type(result) in (bool, int) else str(result)
+            trace.append(ev)
+            seen_tids.add(tid)
+        for tid in seen_tids:
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                          'args': {'name': thread_names.get(tid, f'thread-{tid}')}})
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms',
+                'otherData': {'wall_clock_epoch': self._wall_epoch}}
+
+    def dump_chrome_trace(self, path=None):
+        """写出 Chrome Trace Event JSON，返回文件路径"""
+        if path is None:
+            path = config_path(time.strftime('wm_trace_%Y%m%d_%H%M%S.json'))
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome_trace(), f)
+        return path
+
+
+recorder = FlightRecorder()
+
+
+def log_error(where, e, hwnd=0):
+    """打印错误并写入运行记录"""
+    print(where, "error:", e)
+    recorder.instant(f"error:{where}", hwnd, str(e))
+
+
+# ---------------------------
+# Sampling profiler: on-demand stack sampler + allocation tracker
+# ---------------------------
+
+class SamplingProfiler:
+    """
+    托盘按需开启的统计采样分析器。未开启时没有任何线程或钩子（零开销）。
+    开启后一个后台线程每 interval 秒用 sys._current_frames() 抓取所有线程
+    （键盘钩子、检查线程、窗口事件线程、Qt 主线程……）的调用栈，累计为 collapsed stack
+    （flamegraph.pl / speedscope 可直接打开）。采样本身的耗时会被测量，
+    超过 max_overhead（默认 2% 的墙钟时间）时自动拉长采样间隔，因此开销有上限。
+    可选同时开启 tracemalloc 记录内存分配（会让分配密集的代码明显变慢，只在需要时开启）。
+    """
+
+    def __init__(self, interval=0.005, max_overhead=0.02):
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self._thread = None
+        self._stop = threading.Event()
+        self.stacks = {}
+        self.samples = 0
+        self.sample_ns = 0
+        self.started = 0.0
+        self.track_allocations = False
+        self._baseline = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, track_allocations=False):
+        if self.running:
+            return
+        self.stacks = {}
+        self.samples = 0
+        self.sample_ns = 0
+        self.started = time.time()
+        self.track_allocations = track_allocations
+        self._baseline = None
+        if track_allocations:
+            import tracemalloc
+            tracemalloc.start(16)
+            self._baseline = tracemalloc.take_snapshot()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="wm-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        interval = self.interval
+        stacks = self.stacks
+        while not self._stop.wait(interval):
+            t0 = time.perf_counter_ns()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                parts.append(names.get(tid, f"thread-{tid}"))
+                key = ";".join(reversed(parts))
+                stacks[key] = stacks.get(key, 0) + 1
+            cost = time.perf_counter_ns() - t0
+            self.samples += 1
+            self.sample_ns += cost
+            # 保证 采样耗时 / 采样间隔 不超过 max_overhead
+            interval = max(self.interval, cost / 1e9 / self.max_overhead)
+
+    def stop(self):
+        """停止并写出结果，返回 (collapsed 文件, 报告文件)"""
+        if not self.running:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        collapsed = config_path(f'wm_profile_{stamp}.collapsed')
+        report = config_path(f'wm_profile_{stamp}.txt')
+        with open(collapsed, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items(), key=lambda kv: -kv[1]):
+                f.write(f"{stack} {count}\n")
+        with open(report, 'w', encoding='utf-8') as f:
+            f.write(self.report())
+        if self.track_allocations:
+            import tracemalloc
+            tracemalloc.stop()
+        return collapsed, report
+
+    def report(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        total = sum(self.stacks.values()) or 1
+        own, inclusive = {}, {}
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if frames:
+                own[frames[-1]] = own.get(frames[-1], 0) + count
+            for fr in set(frames):
+                inclusive[fr] = inclusive.get(fr, 0) + count
+        lines = [f"采样时长 {elapsed:.1f} s，采样 {self.samples} 次，"
+                 f"采样耗时合计 {self.sample_ns / 1e6:.1f} ms（开销 {self.sample_ns / 1e9 / elapsed:.2%}）", ""]
+        for title, table in (("自身耗时最多（按线程栈顶）", own), ("包含耗时最多", inclusive)):
+            lines.append(title + ":")
+            for fr, count in sorted(table.items(), key=lambda kv: -kv[1])[:25]:
+                lines.append(f"  {count / total:6.1%}  {fr}")
+            lines.append("")
+        if self.track_allocations:
+            import tracemalloc
+            ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+                      tracemalloc.Filter(False, "<frozen importlib._bootstrap>"))
+            snapshot = tracemalloc.take_snapshot().filter_traces(ignore)
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append(f"内存分配（tracemalloc）: 当前 {current / 1024:.0f} KiB，峰值 {peak / 1024:.0f} KiB")
+            lines.append("采样期间增长最多的分配位置:")
+            for stat in snapshot.compare_to(self._baseline.filter_traces(ignore), 'traceback')[:25]:
+                if stat.size_diff <= 0:
+                    break
+                lines.append(f"  {stat.size_diff / 1024:+8.1f} KiB  {stat.count_diff:+6d} 个"
+                             f"（现有 {stat.size / 1024:.1f} KiB）")
+                for fl in stat.traceback.format(limit=4, most_recent_first=True):
+                    lines.append("      " + fl.strip())
+        return "\n".join(lines) + "\n"
+
+
+profiler = SamplingProfiler()
+
+
+# ---------------------------
+# Window-state constants shared by all backends (Win32 values; other backends emulate them)
+# ---------------------------
+WS_EX_TOPMOST = 0x00000008
+WS_EX_TRANSPARENT = 0x00000020
+WS_EX_LAYERED = 0x00080000
+SW_SHOWNORMAL = 1
+SW_SHOWMINIMIZED = 2
+SW_SHOWMAXIMIZED = 3
+SW_MINIMIZE = 6
+SW_SHOWMINNOACTIVE = 7
+HWND_TOPMOST = -1
+HWND_NOTOPMOST = -2
+SWP_NOSIZE = 0x0001
+SWP_NOMOVE = 0x0002
+
 # ---------------------------
 # Utility: Win32 helpers
 # ---------------------------
 
+class WindowTable:
+    """
+    enum_window_table() 的结果: 按列存放（hwnds / pids 为 array），而不是 (hwnd, title) 元组列表。
+    titles 只有在枚举时要求读取标题才有，否则为 None。
+    """
+    __slots__ = ('hwnds', 'pids', 'titles')
+
+    def __init__(self, titles=False):
+        self.hwnds = array('Q')
+        self.pids = array('q')  # X11 没有 _NET_WM_PID 的窗口用负数
+        self.titles = [] if titles else None
+
+    def __len__(self):
+        return len(self.hwnds)
+
+    def pairs(self):
+        """兼容 enum_windows() 的 [(hwnd, title)]"""
+        return list(zip(self.hwnds, self.titles if self.titles is not None else map(hwnd_to_title, self.hwnds)))
+
+    @classmethod
+    def collect(cls, candidates, pid_if_listed, title_of=None):
+        """逐窗口筛选的通用实现（X11 / 模拟后端）；同时刷新 pid -> 窗口 索引"""
+        table = cls(titles=title_of is not None)
+        for hwnd in candidates:
+            pid = pid_if_listed(hwnd)
+            if pid:
+                table.hwnds.append(hwnd)
+                table.pids.append(pid)
+                if title_of is not None:
+                    table.titles.append(title_of(hwnd))
+        process_index.rebuild(zip(table.hwnds, table.pids))
+        return table
+
+
+@recorder.span('win32:enum_window_table')
+def enum_window_table(titles=False):
+    """
+    与 enum_windows 相同的筛选，批量版本: 先用一个只做 append 的回调把全部 hwnd 收进数组，
+    再依次用 可见 → 扩展样式 → 标题长度 → pid → 标题非空白 过滤（每一步只处理上一步留下的窗口）。
+    两种模式筛出的窗口相同，titles=True 只是额外保留读到的标题。
+    """
+    table = _collect_window_table(titles)
+    # 顺便刷新 pid -> 窗口 索引，免得再枚举一次
+    process_index.rebuild(zip(table.hwnds, table.pids))
+    return table
+
+
+def _collect_window_table(titles):
+    """enum_window_table 的枚举部分（不刷新进程索引），基准测试直接对比它和旧实现"""
+    hwnds = array('Q')
+    append = hwnds.append
+    _user32.EnumWindows(WNDENUMPROC(lambda hwnd, _: append(hwnd) or True), 0)
+
+    visible, get_long, text_len = _user32.IsWindowVisible, _user32.GetWindowLongW, _user32.GetWindowTextLengthW
+    tool, app = win32con.WS_EX_TOOLWINDOW, win32con.WS_EX_APPWINDOW
+    candidates = []
+    for hwnd in hwnds:
+        if not visible(hwnd):
+            continue
+        ex_style = get_long(hwnd, win32con.GWL_EXSTYLE)
+        if (ex_style & tool) and not (ex_style & app):
+            continue
+        if text_len(hwnd):
+            candidates.append(hwnd)
+
+    table = WindowTable(titles)
+    own = os.getpid()
+    pid = wintypes.DWORD()
+    pid_ref = ctypes.byref(pid)
+    thread_pid = _user32.GetWindowThreadProcessId
+    buf = ctypes.create_unicode_buffer(256)
+    for hwnd in candidates:
+        thread_pid(hwnd, pid_ref)
+        if pid.value == own:
+            continue
+        # 标题长度非零不代表有可见字符，全是空白的标题两种模式都要排除
+        n = text_len(hwnd) + 1
+        if n > len(buf):
+            buf = ctypes.create_unicode_buffer(n)
+        _user32.GetWindowTextW(hwnd, buf, len(buf))
+        title = buf.value
+        if not title.strip():
+            continue
+        if titles:
+            table.titles.append(title)
+        table.hwnds.append(hwnd)
+        table.pids.append(pid.value)
+    return table
+
+
+@recorder.span('win32:enum_windows')
 def enum_windows():
     """Return list of (hwnd, title) for visible top-level windows with non-empty titles, excluding tray, tool windows and own process windows."""
+    return enum_window_table(titles=True).pairs()
+
+
+def enum_windows_per_window():
+    """逐窗口回调、每个窗口四次 pywin32 调用的旧实现（原样保留，不刷新进程索引）；仅供 --bench enum 对比"""
     import win32process  # 需确保导入该模块
     windows = []
     # 获取当前进程ID
@@ -61,6 +462,63 @@ def enum_windows():
     win32gui.EnumWindows(callback, None)
     return windows
 
+
+def bench_enum_windows(counts=(200, 1000, 5000), rounds=5):
+    """
+    冷枚举基准（仅 Windows）: 额外创建 N 个顶层窗口（九成隐藏，一成为屏幕外的可见工具窗口），
+    比较逐窗口回调的旧实现与批量列式实现（不读标题 / 读标题）的耗时中位数。
+    两边都只计枚举和筛选，不含进程索引的刷新。
+    """
+    if _user32 is None:
+        print("enum 基准需要在 Windows 上运行")
+        return
+    WS_POPUP, WS_VISIBLE = 0x80000000, 0x10000000
+    for n in counts:
+        created = []
+        for i in range(n):
+            visible = i % 10 == 0
+            hwnd = _user32.CreateWindowExW(win32con.WS_EX_TOOLWINDOW if visible else 0, "STATIC",
+                                           f"bench window {i}", WS_POPUP | (WS_VISIBLE if visible else 0),
+                                           -32000, -32000, 10, 10, None, None, None, None)
+            if hwnd:
+                created.append(hwnd)
+        try:
+            results = []
+            for label, enum in (('逐窗口回调', enum_windows_per_window),
+                                ('批量', partial(_collect_window_table, False)),
+                                ('批量+标题', partial(_collect_window_table, True))):
+                times = []
+                for _ in range(rounds):
+                    t0 = time.perf_counter()
+                    listed = enum()
+                    times.append(time.perf_counter() - t0)
+                times.sort()
+                results.append(f"{label} {times[len(times) // 2] * 1000:.2f} ms（{len(listed)} 个）")
+            print(f"enum +{len(created)} 个窗口: " + ", ".join(results))
+        finally:
+            for hwnd in created:
+                _user32.DestroyWindow(hwnd)
+
+
+def window_pid_if_listed(hwnd):
+    """与 enum_windows 相同的筛选规则，单个窗口版本；符合时返回 pid，否则返回 0"""
+    try:
+        if not win32gui.IsWindowVisible(hwnd):
+            return 0
+        _, pid = win32process.GetWindowThreadProcessId(hwnd)
+        if pid == os.getpid():
+            return 0
+        title = win32gui.GetWindowText(hwnd)
+        if not title or not title.strip():
+            return 0
+        ex_style = win32gui.GetWindowLong(hwnd, win32con.GWL_EXSTYLE)
+        if (ex_style & win32con.WS_EX_TOOLWINDOW) and not (ex_style & win32con.WS_EX_APPWINDOW):
+            return 0
+        return pid
+    except Exception:
+        return 0
+
+@recorder.span('win32:is_window')
 def is_window(hwnd):
     try:
         return win32gui.IsWindow(hwnd)
@@ -68,6 +526,7 @@ def is_window(hwnd):
         return False
 
 
+@recorder.span('win32:set_topmost')
 def set_topmost(hwnd, on=True):
     if not is_window(hwnd): return False
     try:
@@ -79,24 +538,31 @@ def set_topmost(hwnd, on=True):
                                   win32con.SWP_NOMOVE | win32con.SWP_NOSIZE)
         return True
     except Exception as e:
-        print("set_topmost error:", e)
+        log_error("set_topmost", e, hwnd)
         return False
 
 
+@recorder.span('win32:minimize_window')
 def minimize_window(hwnd):
     try:
         win32gui.ShowWindow(hwnd, win32con.SW_MINIMIZE)
+        return True
     except Exception as e:
-        print("minimize error", e)
+        log_error("minimize", e, hwnd)
+        return False
 
 
+@recorder.span('win32:restore_window')
 def restore_window(hwnd):
     try:
         win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
+        return True
     except Exception as e:
-        print("restore error", e)
+        log_error("restore", e, hwnd)
+        return False
 
 
+@recorder.span('win32:focus_window')
 def focus_window(hwnd):
     try:
         if not is_window(hwnd): return False
@@ -118,10 +584,11 @@ def focus_window(hwnd):
                     pass
         return True
     except Exception as e:
-        print("focus_window error", e)
+        log_error("focus_window", e, hwnd)
         return False
 
 
+@recorder.span('win32:get_window_rect')
 def get_window_rect(hwnd):
     try:
         return win32gui.GetWindowRect(hwnd)
@@ -129,6 +596,7 @@ def get_window_rect(hwnd):
         return None
 
 
+@recorder.span('win32:set_window_opacity')
 def set_window_opacity(hwnd, alpha):
     """
     alpha: 0-255
@@ -140,10 +608,11 @@ def set_window_opacity(hwnd, alpha):
         win32gui.SetLayeredWindowAttributes(hwnd, 0, int(alpha), win32con.LWA_ALPHA)
         return True
     except Exception as e:
-        print("set_window_opacity error", e)
+        log_error("set_window_opacity", e, hwnd)
         return False
 
 
+@recorder.span('win32:set_window_clickthrough')
 def set_window_clickthrough(hwnd, on=True):
     """
     Make window click-through by setting WS_EX_TRANSPARENT. Note this affects input to the window.
@@ -160,10 +629,11 @@ def set_window_clickthrough(hwnd, on=True):
                               win32con.SWP_NOMOVE | win32con.SWP_NOSIZE | win32con.SWP_FRAMECHANGED)
         return True
     except Exception as e:
-        print("set_window_clickthrough error", e)
+        log_error("set_window_clickthrough", e, hwnd)
         return False
 
 
+@recorder.span('win32:get_foreground_hwnd')
 def get_foreground_hwnd():
     try:
         return win32gui.GetForegroundWindow()
@@ -171,6 +641,148 @@ def get_foreground_hwnd():
         return None
 
 
+@recorder.span('win32:get_window_pid')
+def get_window_pid(hwnd):
+    try:
+        return win32process.GetWindowThreadProcessId(hwnd)[1]
+    except Exception:
+        return 0
+
+
+def get_exstyle(hwnd):
+    try:
+        return win32gui.GetWindowLong(hwnd, win32con.GWL_EXSTYLE)
+    except Exception:
+        return 0
+
+
+@recorder.span('win32:set_exstyle_bits')
+def set_exstyle_bits(hwnd, mask, value):
+    """只修改 mask 覆盖的扩展样式位，其余位保持不变"""
+    try:
+        ex = win32gui.GetWindowLong(hwnd, win32con.GWL_EXSTYLE)
+        win32gui.SetWindowLong(hwnd, win32con.GWL_EXSTYLE, (ex & ~mask) | (value & mask))
+        win32gui.SetWindowPos(hwnd, None, 0, 0, 0, 0,
+                              win32con.SWP_NOMOVE | win32con.SWP_NOSIZE | win32con.SWP_NOZORDER |
+                              win32con.SWP_FRAMECHANGED)
+        return True
+    except Exception as e:
+        log_error("set_exstyle_bits", e, hwnd)
+        return False
+
+
+def get_window_alpha(hwnd):
+    """窗口当前的分层透明度；不是分层窗口或未设置 alpha 时返回 -1"""
+    try:
+        if not get_exstyle(hwnd) & WS_EX_LAYERED:
+            return -1
+        _, alpha, flags = win32gui.GetLayeredWindowAttributes(hwnd)
+        return alpha if flags & win32con.LWA_ALPHA else -1
+    except Exception:
+        return -1
+
+
+@recorder.span('win32:set_layered_states')
+def set_layered_states(states):
+    """
+    一次设置多个窗口的扩展样式和分层透明度: states 为 [(hwnd, exstyle, alpha)]，alpha < 0 表示不设置。
+    每个窗口只有一次 SetWindowLong 和一次 SetLayeredWindowAttributes，不发 SWP_FRAMECHANGED，整批在一帧内完成。
+    """
+    set_long, set_attributes = win32gui.SetWindowLong, win32gui.SetLayeredWindowAttributes
+    for hwnd, ex_style, alpha in states:
+        try:
+            set_long(hwnd, win32con.GWL_EXSTYLE, ex_style)
+            if alpha >= 0 and ex_style & WS_EX_LAYERED:
+                set_attributes(hwnd, 0, int(alpha), win32con.LWA_ALPHA)
+        except Exception as e:
+            log_error("set_layered_states", e, hwnd)
+
+
+def is_topmost(hwnd):
+    return bool(get_exstyle(hwnd) & WS_EX_TOPMOST)
+
+
+def get_window_class(hwnd):
+    try:
+        return win32gui.GetClassName(hwnd)
+    except Exception:
+        return ""
+
+
+def get_window_placement(hwnd):
+    """(flags, showCmd, ptMin, ptMax, rcNormal) 或 None"""
+    try:
+        return win32gui.GetWindowPlacement(hwnd)
+    except Exception:
+        return None
+
+
+@recorder.span('win32:set_window_placement')
+def set_window_placement(hwnd, show_cmd, normal_rect):
+    try:
+        placement = win32gui.GetWindowPlacement(hwnd)
+        win32gui.SetWindowPlacement(hwnd, (placement[0], show_cmd, placement[2], placement[3],
+                                           tuple(normal_rect)))
+        return True
+    except Exception as e:
+        log_error("set_window_placement", e, hwnd)
+        return False
+
+
+@contextmanager
+def window_batch():
+    """一组窗口操作的批处理范围；Win32 调用本身是同步的，这里无需额外处理"""
+    yield
+
+
+@recorder.span('win32:defer_window_positions')
+def defer_window_positions(moves):
+    """
+    moves: [(hwnd, insert_after, x, y, cx, cy, flags)]，insert_after 为 None 时不改变 Z 序。
+    一次 BeginDeferWindowPos / EndDeferWindowPos 提交，系统只重排和重绘一次。
+    """
+    if not moves:
+        return True
+    try:
+        hdwp = win32gui.BeginDeferWindowPos(len(moves))
+        for hwnd, after, x, y, cx, cy, flags in moves:
+            flags |= win32con.SWP_NOACTIVATE
+            if after is None:
+                flags |= win32con.SWP_NOZORDER
+            hdwp = win32gui.DeferWindowPos(hdwp, hwnd, after or 0, x, y, cx, cy, flags)
+        win32gui.EndDeferWindowPos(hdwp)
+        return True
+    except Exception as e:
+        # 批量中任一窗口失败（如提权窗口）整批作废，逐个重试
+        log_error("defer_window_positions", e)
+        ok = True
+        for hwnd, after, x, y, cx, cy, flags in moves:
+            try:
+                flags |= win32con.SWP_NOACTIVATE
+                if after is None:
+                    flags |= win32con.SWP_NOZORDER
+                win32gui.SetWindowPos(hwnd, after or 0, x, y, cx, cy, flags)
+            except Exception:
+                ok = False
+        return ok
+
+
+def probe_modifiers():
+    """当前实际按下的修饰键（GetAsyncKeyState），用于纠正钩子漏掉的抬起事件"""
+    try:
+        mods = set()
+        for name, vk in (('ctrl', win32con.VK_CONTROL), ('alt', win32con.VK_MENU),
+                         ('shift', win32con.VK_SHIFT)):
+            if win32api.GetAsyncKeyState(vk) & 0x8000:
+                mods.add(name)
+        if (win32api.GetAsyncKeyState(win32con.VK_LWIN) | win32api.GetAsyncKeyState(win32con.VK_RWIN)) & 0x8000:
+            mods.add('windows')
+        return mods
+    except Exception:
+        return None
+
+
+@recorder.span('win32:hwnd_to_title')
 def hwnd_to_title(hwnd):
     try:
         return win32gui.GetWindowText(hwnd)
@@ -179,84 +791,3630 @@ def hwnd_to_title(hwnd):
 
 
 # ---------------------------
-# Data model: groups, hotkeys
+# Window events & process index
 # ---------------------------
-DEFAULT_HOTKEYS = {
-    'topmost': 't',
-    'show_only': 'm',
-    'transparent': 'p',
-    'open_group_manager': 'g',
-}
 
-PERSIST_FILE = 'wm_config.json'
+if sys.platform == 'win32':
+    _user32 = ctypes.WinDLL('user32', use_last_error=True)
+    _kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    WINEVENTPROC = ctypes.WINFUNCTYPE(None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+                                      wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD)
+    _user32.SetWinEventHook.restype = wintypes.HANDLE
+    _user32.SetWinEventHook.argtypes = [wintypes.DWORD, wintypes.DWORD, wintypes.HMODULE, WINEVENTPROC,
+                                        wintypes.DWORD, wintypes.DWORD, wintypes.DWORD]
+    _user32.UnhookWinEvent.argtypes = [wintypes.HANDLE]
+    _user32.GetAncestor.restype = wintypes.HWND
+    _user32.GetAncestor.argtypes = [wintypes.HWND, wintypes.UINT]
+    _kernel32.OpenProcess.restype = wintypes.HANDLE
+    _kernel32.QueryFullProcessImageNameW.argtypes = [wintypes.HANDLE, wintypes.DWORD,
+                                                     wintypes.LPWSTR, ctypes.POINTER(wintypes.DWORD)]
+    _shell32 = ctypes.WinDLL('shell32', use_last_error=True)
+    _gdi32 = ctypes.WinDLL('gdi32', use_last_error=True)
+    _shell32.ExtractIconExW.argtypes = [wintypes.LPCWSTR, ctypes.c_int, ctypes.POINTER(wintypes.HICON),
+                                        ctypes.POINTER(wintypes.HICON), wintypes.UINT]
+    _user32.GetDC.restype = wintypes.HDC
+    _user32.ReleaseDC.argtypes = [wintypes.HWND, wintypes.HDC]
+    _user32.GetIconInfo.argtypes = [wintypes.HICON, ctypes.c_void_p]
+    _user32.DestroyIcon.argtypes = [wintypes.HICON]
+    _gdi32.GetObjectW.argtypes = [wintypes.HANDLE, ctypes.c_int, ctypes.c_void_p]
+    _gdi32.DeleteObject.argtypes = [wintypes.HGDIOBJ]
+    _gdi32.GetDIBits.argtypes = [wintypes.HDC, wintypes.HBITMAP, wintypes.UINT, wintypes.UINT,
+                                 ctypes.c_void_p, ctypes.c_void_p, wintypes.UINT]
+    # 批量枚举（enum_window_table）: 句柄按整数传递，省去 HWND 对象的转换
+    WNDENUMPROC = ctypes.WINFUNCTYPE(wintypes.BOOL, ctypes.c_size_t, wintypes.LPARAM)
+    _user32.EnumWindows.argtypes = [WNDENUMPROC, wintypes.LPARAM]
+    _user32.IsWindowVisible.argtypes = [ctypes.c_size_t]
+    _user32.GetWindowLongW.restype = ctypes.c_long
+    _user32.GetWindowLongW.argtypes = [ctypes.c_size_t, ctypes.c_int]
+    _user32.GetWindowTextLengthW.argtypes = [ctypes.c_size_t]
+    _user32.GetWindowTextW.argtypes = [ctypes.c_size_t, wintypes.LPWSTR, ctypes.c_int]
+    _user32.GetWindowThreadProcessId.restype = wintypes.DWORD
+    _user32.GetWindowThreadProcessId.argtypes = [ctypes.c_size_t, ctypes.POINTER(wintypes.DWORD)]
+else:
+    _user32 = _kernel32 = _shell32 = _gdi32 = WINEVENTPROC = WNDENUMPROC = None
+
+EVENT_SYSTEM_FOREGROUND = 0x0003
+EVENT_OBJECT_CREATE = 0x8000
+EVENT_OBJECT_DESTROY = 0x8001
+EVENT_OBJECT_SHOW = 0x8002
+EVENT_OBJECT_HIDE = 0x8003
+EVENT_OBJECT_LOCATIONCHANGE = 0x800B
+EVENT_OBJECT_NAMECHANGE = 0x800C
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+OBJID_WINDOW = 0
+GA_ROOT = 2
+WM_APP = 0x8000
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+
+def is_toplevel(hwnd):
+    try:
+        return _user32.GetAncestor(hwnd, GA_ROOT) == hwnd
+    except Exception:
+        return False
 
 
-class Model:
+def enum_pick_candidates():
+    """enum_windows 的窗口按 Z 序（自顶向下）附带矩形，跳过最小化窗口；供拾取模式建索引"""
+    out = []
+    for hwnd in enum_window_table().hwnds:
+        if win32gui.IsIconic(hwnd):
+            continue
+        rect = get_window_rect(hwnd)
+        if rect:
+            out.append((hwnd, rect))
+    return out
+
+
+@recorder.span('win32:query_exe_path')
+def query_exe_path(pid):
+    """进程可执行文件完整路径（受限查询权限即可，适用于大多数提权进程）"""
+    handle = _kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        return ""
+    try:
+        size = wintypes.DWORD(1024)
+        buf = ctypes.create_unicode_buffer(size.value)
+        if _kernel32.QueryFullProcessImageNameW(handle, 0, buf, ctypes.byref(size)):
+            return buf.value
+        return ""
+    finally:
+        _kernel32.CloseHandle(handle)
+
+
+class _ICONINFO(ctypes.Structure):
+    _fields_ = [('fIcon', wintypes.BOOL), ('xHotspot', wintypes.DWORD), ('yHotspot', wintypes.DWORD),
+                ('hbmMask', wintypes.HBITMAP), ('hbmColor', wintypes.HBITMAP)]
+
+
+class _BITMAP(ctypes.Structure):
+    _fields_ = [('bmType', wintypes.LONG), ('bmWidth', wintypes.LONG), ('bmHeight', wintypes.LONG),
+                ('bmWidthBytes', wintypes.LONG), ('bmPlanes', wintypes.WORD), ('bmBitsPixel', wintypes.WORD),
+                ('bmBits', ctypes.c_void_p)]
+
+
+class _BITMAPINFOHEADER(ctypes.Structure):
+    _fields_ = [('biSize', wintypes.DWORD), ('biWidth', wintypes.LONG), ('biHeight', wintypes.LONG),
+                ('biPlanes', wintypes.WORD), ('biBitCount', wintypes.WORD), ('biCompression', wintypes.DWORD),
+                ('biSizeImage', wintypes.DWORD), ('biXPelsPerMeter', wintypes.LONG),
+                ('biYPelsPerMeter', wintypes.LONG), ('biClrUsed', wintypes.DWORD),
+                ('biClrImportant', wintypes.DWORD)]
+
+
+def _bitmap_bgra(hdc, hbm, w, h):
+    bmi = _BITMAPINFOHEADER(ctypes.sizeof(_BITMAPINFOHEADER), w, -h, 1, 32, 0, 0, 0, 0, 0, 0)  # 自顶向下
+    buf = ctypes.create_string_buffer(w * h * 4)
+    if not _gdi32.GetDIBits(hdc, hbm, 0, h, buf, ctypes.byref(bmi), 0):
+        return None
+    return bytearray(buf.raw)
+
+
+def extract_exe_icon(path, size=32):
+    """取 exe 的第一个图标，返回 (宽, 高, BGRA 像素)；在图标线程中调用"""
+    large, small = wintypes.HICON(), wintypes.HICON()
+    if not path or _shell32.ExtractIconExW(path, 0, ctypes.byref(large), ctypes.byref(small), 1) <= 0:
+        return None
+    hicon = large.value if (size > 16 and large.value) or not small.value else small.value
+    info = _ICONINFO()
+    hdc = None
+    try:
+        if not hicon or not _user32.GetIconInfo(hicon, ctypes.byref(info)) or not info.hbmColor:
+            return None
+        bm = _BITMAP()
+        _gdi32.GetObjectW(info.hbmColor, ctypes.sizeof(bm), ctypes.byref(bm))
+        w, h = bm.bmWidth, bm.bmHeight
+        if w <= 0 or h <= 0:
+            return None
+        hdc = _user32.GetDC(None)
+        pixels = _bitmap_bgra(hdc, info.hbmColor, w, h)
+        if pixels is None:
+            return None
+        if not any(pixels[3::4]):
+            # 老式图标没有 alpha 通道: 用 AND 掩码（白色 = 透明）补上
+            mask = _bitmap_bgra(hdc, info.hbmMask, w, h) if info.hbmMask else None
+            for k in range(3, len(pixels), 4):
+                pixels[k] = 0 if mask and mask[k - 3] else 255
+        return w, h, bytes(pixels)
+    finally:
+        if hdc:
+            _user32.ReleaseDC(None, hdc)
+        for hbm in (info.hbmColor, info.hbmMask):
+            if hbm:
+                _gdi32.DeleteObject(hbm)
+        for hi in (large.value, small.value):
+            if hi:
+                _user32.DestroyIcon(hi)
+
+
+class WinEventListener:
+    """
+    SetWinEventHook subscriptions on a dedicated thread with its own message loop.
+    Callbacks receive (hwnd, event) for window-level events only (OBJID_WINDOW,
+    CHILDID_SELF) and run on the listener thread, so they must stay cheap.
+    Hooks are installed per event id, only once somebody subscribes to it, and removed
+    again when its last subscriber unsubscribes.
+    """
+
     def __init__(self):
-        # groups: map int->list of hwnds
-        self.groups = {}  # example: {1: [hwnd, ...], 2: [...]}
-        self.hotkeys = DEFAULT_HOTKEYS.copy()
-        # group names support
-        self.group_names = {i: f"组 {i}" for i in range(10)}
-        self.load()
+        self._subs = {}  # event -> [callback]
+        self._hooks = {}  # event -> hook handle
+        self._proc = None
+        self._tid = 0
+        self._ready = threading.Event()
+        self._thread = None
+
+    def subscribe(self, event, callback):
+        # 整体替换列表: 回调线程正在遍历的旧列表不受影响
+        self._subs[event] = self._subs.get(event, []) + [callback]
+        if self._tid and event not in self._hooks:
+            # 钩子必须在消息循环线程上安装
+            _user32.PostThreadMessageW(self._tid, WM_APP, 0, 0)
+
+    def unsubscribe(self, event, callback):
+        subs = [cb for cb in self._subs.get(event, ()) if cb != callback]
+        if subs:
+            self._subs[event] = subs
+            return
+        self._subs.pop(event, None)
+        if self._tid and event in self._hooks:
+            # 最后一个订阅者: 卸载系统级钩子，不再为这个事件进入 Python
+            _user32.PostThreadMessageW(self._tid, WM_APP, 0, 0)
 
-    def load(self):
+    def start(self):
+        if _user32 is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="win-events", daemon=True)
+        self._thread.start()
+        self._ready.wait(2.0)
+
+    def _sync_hooks(self):
+        for event in [e for e in self._hooks if e not in self._subs]:
+            _user32.UnhookWinEvent(self._hooks.pop(event))
+        for event in list(self._subs):
+            if event in self._hooks:
+                continue
+            handle = _user32.SetWinEventHook(event, event, None, self._proc, 0, 0,
+                                             WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS)
+            if handle:
+                self._hooks[event] = handle
+            else:
+                print("SetWinEventHook 失败:", hex(event), ctypes.get_last_error())
+
+    def _run(self):
+        self._tid = _kernel32.GetCurrentThreadId()
+        self._proc = WINEVENTPROC(self._callback)
+        self._sync_hooks()
+        self._ready.set()
+        msg = wintypes.MSG()
+        while _user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+            if msg.message == WM_APP:
+                self._sync_hooks()
+                continue
+            _user32.TranslateMessage(ctypes.byref(msg))
+            _user32.DispatchMessageW(ctypes.byref(msg))
+
+    def _callback(self, hook, event, hwnd, id_object, id_child, thread, time_ms):
+        if id_object != OBJID_WINDOW or id_child != 0 or not hwnd:
+            return
+        for cb in self._subs.get(event, ()):
+            try:
+                cb(hwnd, event)
+            except Exception as e:
+                log_error("win event callback", e, hwnd)
+
+
+class ProcessIndex:
+    """
+    pid -> hwnds index of listed top-level windows, with cached executable path per pid.
+    Seeded by every enum_windows() call and kept current between enumerations by
+    window create/show/rename/hide/destroy events, so "all windows of this app" is a
+    dict lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pid_hwnds = {}  # pid -> set(hwnd)
+        self.hwnd_pid = {}  # hwnd -> pid
+        self._exe = {}  # pid -> full exe path
+
+    def rebuild(self, pairs):
+        pid_hwnds = {}
+        hwnd_pid = {}
+        for hwnd, pid in pairs:
+            hwnd_pid[hwnd] = pid
+            pid_hwnds.setdefault(pid, set()).add(hwnd)
+        with self._lock:
+            self.pid_hwnds = pid_hwnds
+            self.hwnd_pid = hwnd_pid
+            for pid in list(self._exe):
+                if pid not in pid_hwnds:
+                    del self._exe[pid]
+
+    def add(self, hwnd, pid):
+        with self._lock:
+            old = self.hwnd_pid.get(hwnd)
+            if old == pid:
+                return
+            if old is not None:
+                self._discard(hwnd, old)
+            self.hwnd_pid[hwnd] = pid
+            self.pid_hwnds.setdefault(pid, set()).add(hwnd)
+
+    def remove(self, hwnd):
+        with self._lock:
+            pid = self.hwnd_pid.pop(hwnd, None)
+            if pid is not None:
+                self._discard(hwnd, pid)
+
+    def _discard(self, hwnd, pid):
+        hwnds = self.pid_hwnds.get(pid)
+        if hwnds is not None:
+            hwnds.discard(hwnd)
+            if not hwnds:
+                # 进程已没有窗口（多半已退出），pid 可能被复用，丢弃缓存
+                del self.pid_hwnds[pid]
+                self._exe.pop(pid, None)
+
+    def pid_of(self, hwnd):
+        return self.hwnd_pid.get(hwnd)
+
+    def hwnds_for_pid(self, pid):
+        with self._lock:
+            return list(self.pid_hwnds.get(pid, ()))
+
+    def exe_path(self, pid):
+        path = self._exe.get(pid)
+        if path is None:
+            path = query_exe_path(pid) if pid else ""
+            with self._lock:
+                if pid in self.pid_hwnds:
+                    self._exe[pid] = path
+        return path
+
+    def exe_name(self, pid):
+        return os.path.basename(self.exe_path(pid))
+
+    def on_window_event(self, hwnd, event):
+        """WinEventListener 回调: 增量维护索引"""
+        if event in (EVENT_OBJECT_DESTROY, EVENT_OBJECT_HIDE):
+            if hwnd in self.hwnd_pid:
+                self.remove(hwnd)
+            return
+        if not is_toplevel(hwnd):
+            return
+        pid = window_pid_if_listed(hwnd)
+        if pid:
+            self.add(hwnd, pid)
+        elif hwnd in self.hwnd_pid:
+            self.remove(hwnd)
+
+    def attach(self, listener):
+        for event in (EVENT_OBJECT_CREATE, EVENT_OBJECT_SHOW, EVENT_OBJECT_NAMECHANGE,
+                      EVENT_OBJECT_HIDE, EVENT_OBJECT_DESTROY):
+            listener.subscribe(event, self.on_window_event)
+
+    def stats(self):
+        return {'processes': len(self.pid_hwnds), 'windows': len(self.hwnd_pid), 'exe_cached': len(self._exe)}
+
+
+class FocusHistory:
+    """
+    最近使用（MRU）的窗口顺序，由前台切换事件驱动，不轮询。
+    recent: 全局 MRU（OrderedDict，最近的在末尾）；
+    rings:  每个分组一个环（OrderedDict，最近的在最前），分组成员变化时按全局 MRU 重建。
+    在分组内循环切换只是环的一次 move_to_end，不需要枚举窗口。
+    """
+
+    def __init__(self, capacity=512):
+        self.capacity = capacity
+        self.recent = OrderedDict()
+        self.rings = {}
+        self.member_of = {}  # hwnd -> [分组 id]
+        self._version = None
+        self._lock = threading.Lock()  # 事件线程写入，热键线程读取
+
+    def sync_groups(self, snapshot):
+        """分组有改动（Model 发布了新版本快照）时重建各分组的环"""
+        if snapshot.version == self._version:
+            return
+        with self._lock:
+            self._version = snapshot.version
+            rank = {h: i for i, h in enumerate(self.recent)}
+            rings, member_of = {}, {}
+            for gid in snapshot.groups:
+                members = sorted(snapshot.group_hwnds(gid), key=lambda h: -rank.get(h, -1))
+                rings[gid] = OrderedDict.fromkeys(members)
+                for h in members:
+                    member_of.setdefault(h, []).append(gid)
+            self.rings, self.member_of = rings, member_of
+
+    def touch(self, hwnd):
+        with self._lock:
+            recent = self.recent
+            recent[hwnd] = None
+            recent.move_to_end(hwnd)
+            if len(recent) > self.capacity:
+                recent.popitem(last=False)
+            for gid in self.member_of.get(hwnd, ()):
+                ring = self.rings.get(gid)
+                if ring is not None and hwnd in ring:
+                    ring.move_to_end(hwnd, last=False)
+
+    def forget(self, hwnd):
+        with self._lock:
+            self.recent.pop(hwnd, None)
+
+    def drop(self, gid, hwnd):
+        """窗口已关闭: 从分组环中去掉（分组本身的成员列表不动）"""
+        with self._lock:
+            ring = self.rings.get(gid)
+            if ring is not None:
+                ring.pop(hwnd, None)
+
+    def cycle(self, gid, current, step):
+        """
+        分组内切换: 当前前台不是该组最近使用的窗口时，先回到最近使用的那个；
+        否则向前（step > 0）或向后转动环一格。返回要激活的窗口，组为空时返回 0。
+        """
+        with self._lock:
+            ring = self.rings.get(gid)
+            if not ring:
+                return 0
+            front = next(iter(ring))
+            if current != front:
+                return front
+            if step > 0:
+                ring.move_to_end(front)
+                return next(iter(ring))
+            last = next(reversed(ring))
+            ring.move_to_end(last, last=False)
+            return last
+
+    def most_recent(self, hwnds):
+        wanted = set(hwnds)
+        with self._lock:
+            for h in reversed(self.recent):
+                if h in wanted:
+                    return h
+        return 0
+
+    def stats(self):
+        return {'recent': len(self.recent), 'rings': len(self.rings)}
+
+
+UNDO_BUDGET = 2000  # 撤销 / 重做历史最多保留的增量条数
+ABSENT = object()   # 增量中表示“键不存在”
+UNDO_MODEL_FIELDS = ('groups', 'group_names', 'group_parents', 'group_shortcuts', 'hotkeys')
+
+
+class ActionHistory:
+    """
+    撤销 / 重做历史。每个条目是 (说明, [增量, ...])，一次快捷键操作（含整组操作）只产生一个条目。
+    增量是可逆的小 tuple:
+      ('topmost', hwnd, 之前, 之后)
+      ('transparent', hwnd, 之前, 之后)        之前/之后 为 (alpha, clickthrough) 或 None
+      ('show_only', hwnd, targets, focus, 进入?)
+      ('layout', hwnd, 之前, 之后)             之前/之后 为 capture_window_layout 格式的布局
+      ('model', {字段: {键: (旧值, 新值)}})     旧值/新值 可为 ABSENT
+    记录只是一次 list.append；两个栈的增量总数超过 budget 时丢弃最旧的条目。
+    """
+
+    def __init__(self, budget=UNDO_BUDGET):
+        self.budget = budget
+        self.undo_stack = deque()
+        self.redo_stack = deque()
+        self.size = 0
+        self.dropped = 0
+        self._local = threading.local()  # 当前线程的事务 / 暂停状态
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self, label):
+        """期间记录的增量合并为一个条目（嵌套时并入最外层）"""
+        local = self._local
+        if getattr(local, 'deltas', None) is not None:
+            yield
+            return
+        local.deltas = []
         try:
-            with open(PERSIST_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.groups = {int(k): v for k, v in data.get('groups', {}).items()}
-                self.hotkeys = data.get('hotkeys', DEFAULT_HOTKEYS.copy())
-                names = data.get('group_names', {})
-                for i, n in names.items():
-                    try:
-                        self.group_names[int(i)] = n
-                    except:
-                        pass
-        except FileNotFoundError:
+            yield
+        finally:
+            deltas, local.deltas = local.deltas, None
+            if deltas:
+                self._push(label, deltas)
+
+    @contextmanager
+    def suspended(self):
+        """撤销 / 重做本身、窗口规则等自动操作不记录"""
+        local = self._local
+        local.suspended = getattr(local, 'suspended', 0) + 1
+        try:
+            yield
+        finally:
+            local.suspended -= 1
+
+    def record(self, delta, label=None):
+        local = self._local
+        if getattr(local, 'suspended', 0):
+            return
+        deltas = getattr(local, 'deltas', None)
+        if deltas is not None:
+            deltas.append(delta)
+        else:
+            self._push(label or delta[0], [delta])
+
+    def record_model(self, old, new):
+        """Model 发布新快照: 只比较被替换的字段，逐键比较（未改动的值与旧快照是同一对象）"""
+        if getattr(self._local, 'suspended', 0):
+            return
+        changes = {}
+        for field in UNDO_MODEL_FIELDS:
+            a, b = getattr(old, field), getattr(new, field)
+            if a is b:
+                continue
+            keys = {}
+            for k, v in b.items():
+                was = a.get(k, ABSENT)
+                if was is not v and was != v:
+                    keys[k] = (was, v)
+            keys.update((k, (v, ABSENT)) for k, v in a.items() if k not in b)
+            if keys:
+                changes[field] = keys
+        if changes:
+            self.record(('model', changes), "分组修改")
+
+    def _push(self, label, deltas):
+        with self._lock:
+            # 新操作之后不能再重做
+            while self.redo_stack:
+                self.size -= len(self.redo_stack.pop()[1])
+            self._append(self.undo_stack, (label, deltas))
+
+    def _append(self, stack, entry):
+        stack.append(entry)
+        self.size += len(entry[1])
+        while self.size > self.budget and len(self.undo_stack) > 1:
+            self.size -= len(self.undo_stack.popleft()[1])
+            self.dropped += 1
+
+    def pop(self, redo=False):
+        """取出最近一个可撤销（redo=True 时为可重做）的条目；没有时返回 None"""
+        with self._lock:
+            stack = self.redo_stack if redo else self.undo_stack
+            if not stack:
+                return None
+            entry = stack.pop()
+            self.size -= len(entry[1])
+            return entry
+
+    def done(self, entry, redo=False):
+        """条目已撤销（或重做）: 放到另一个栈上"""
+        with self._lock:
+            self._append(self.undo_stack if redo else self.redo_stack, entry)
+
+    def stats(self):
+        return {'undo': len(self.undo_stack), 'redo': len(self.redo_stack),
+                'deltas': self.size, 'budget': self.budget, 'dropped': self.dropped}
+
+
+class WindowRecord:
+    """本程序改动过的一个窗口（置顶 / 半透明 / 被“仅显示”最小化 / 控制条）；状态全部清除后记录即删除"""
+    __slots__ = ('hwnd', 'pid', 'topmost', 'alpha', 'clickthrough', 'was_topmost', 'minimized', 'overlay')
+
+    def __init__(self, hwnd, pid):
+        self.hwnd = hwnd
+        self.pid = pid  # 创建记录时窗口所属进程，用来识别被复用的句柄
+        self.topmost = False  # 手动置顶
+        self.alpha = -1  # 半透明时的 alpha，-1 表示未半透明
+        self.clickthrough = False
+        self.was_topmost = False  # 设置半透明之前是否已手动置顶
+        self.minimized = False  # 被“仅显示”最小化
+        self.overlay = 0  # 控制条的 winId
+
+    def empty(self):
+        return not (self.topmost or self.alpha >= 0 or self.minimized or self.overlay)
+
+
+class WindowStateStore:
+    """
+    Controller 对各窗口所做改动的唯一记录: hwnd -> WindowRecord，另有 控制条 winId -> hwnd 的索引。
+    窗口销毁事件到达时自动删除记录；句柄被别的进程复用（销毁事件丢失）时，
+    在窗口重新显示或用户操作它时按 pid 识别出来并丢弃旧状态。
+    读取不加锁（单次 dict 查找），修改在锁内进行。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.records = {}
+        self.overlays = {}  # 控制条 winId -> 目标 hwnd
+        self.created = 0
+        self.pruned = 0
+        self.recycled = 0
+
+    @staticmethod
+    def _pid(hwnd):
+        return process_index.pid_of(hwnd) or get_window_pid(hwnd)
+
+    def checked(self, hwnd):
+        """用户操作前取记录: 句柄已属于别的进程时丢弃旧记录，返回 None"""
+        rec = self.records.get(hwnd)
+        if rec is not None and rec.pid and self._pid(hwnd) not in (0, None, rec.pid):
+            with self._lock:
+                self.recycled += 1
+                self._drop(hwnd)
+            return None
+        return rec
+
+    def _ensure(self, hwnd):
+        rec = self.checked(hwnd)
+        if rec is None:
+            rec = self.records[hwnd] = WindowRecord(hwnd, self._pid(hwnd))
+            self.created += 1
+        return rec
+
+    def _release(self, rec):
+        if rec.empty() and self.records.get(rec.hwnd) is rec:
+            del self.records[rec.hwnd]
+
+    def _drop(self, hwnd):
+        rec = self.records.pop(hwnd, None)
+        if rec is not None and rec.overlay:
+            self.overlays.pop(rec.overlay, None)
+        return rec
+
+    # ---- 查询 ----
+    def is_topmost(self, hwnd):
+        rec = self.records.get(hwnd)
+        return rec is not None and rec.topmost
+
+    def transparent(self, hwnd):
+        """半透明窗口的记录；未半透明时返回 None"""
+        rec = self.records.get(hwnd)
+        return rec if rec is not None and rec.alpha >= 0 else None
+
+    def transparent_hwnds(self):
+        return [h for h, rec in list(self.records.items()) if rec.alpha >= 0]
+
+    def topmost_hwnds(self):
+        return [h for h, rec in list(self.records.items()) if rec.topmost]
+
+    def minimized_hwnds(self):
+        return [h for h, rec in list(self.records.items()) if rec.minimized]
+
+    def overlay_target(self, winid, default=None):
+        return self.overlays.get(int(winid or 0), default)
+
+    # ---- 修改 ----
+    def set_topmost(self, hwnd, on):
+        with self._lock:
+            rec = self._ensure(hwnd)
+            rec.topmost = bool(on)
+            self._release(rec)
+
+    def set_transparent(self, hwnd, alpha, clickthrough, was_topmost=None):
+        with self._lock:
+            rec = self._ensure(hwnd)
+            rec.alpha = int(alpha)
+            rec.clickthrough = bool(clickthrough)
+            if was_topmost is not None:
+                rec.was_topmost = bool(was_topmost)
+
+    def clear_transparent(self, hwnd):
+        """取消半透明，返回 (alpha, clickthrough, was_topmost)；未半透明时返回 None"""
+        with self._lock:
+            rec = self.records.get(hwnd)
+            if rec is None or rec.alpha < 0:
+                return None
+            state = (rec.alpha, rec.clickthrough, rec.was_topmost)
+            rec.alpha, rec.clickthrough, rec.was_topmost = -1, False, False
+            self._release(rec)
+            return state
+
+    def set_minimized(self, hwnds):
+        """“仅显示”最小化的窗口（替换上一次的集合）"""
+        with self._lock:
+            self.clear_minimized()
+            for h in hwnds:
+                self._ensure(h).minimized = True
+
+    def clear_minimized(self):
+        """清除“仅显示”最小化标记，返回这些窗口"""
+        with self._lock:
+            hwnds = []
+            for rec in [r for r in self.records.values() if r.minimized]:
+                rec.minimized = False
+                hwnds.append(rec.hwnd)
+                self._release(rec)
+            return hwnds
+
+    def map_overlay(self, winid, hwnd):
+        with self._lock:
+            rec = self._ensure(hwnd)
+            if rec.overlay:
+                self.overlays.pop(rec.overlay, None)
+            rec.overlay = int(winid)
+            self.overlays[rec.overlay] = hwnd
+
+    def unmap_overlay(self, winid):
+        with self._lock:
+            hwnd = self.overlays.pop(int(winid), None)
+            rec = self.records.get(hwnd)
+            if rec is not None and rec.overlay == int(winid):
+                rec.overlay = 0
+                self._release(rec)
+
+    def forget(self, hwnd):
+        """窗口已关闭: 删除记录，返回被删除的记录（没有时 None）"""
+        with self._lock:
+            rec = self._drop(hwnd)
+            if rec is not None:
+                self.pruned += 1
+            return rec
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+            self.overlays.clear()
+
+    def on_window_event(self, hwnd, event):
+        """窗口事件（事件线程）: 重新显示的窗口若已属于别的进程，丢弃旧状态"""
+        rec = self.records.get(hwnd)
+        if rec is None:
+            return
+        pid = process_index.pid_of(hwnd)
+        if pid and rec.pid and pid != rec.pid:
+            with self._lock:
+                self.recycled += 1
+                self._drop(hwnd)
+
+    def stats(self):
+        records = list(self.records.values())
+        size = (sys.getsizeof(self.records) + sys.getsizeof(self.overlays)
+                + sum(sys.getsizeof(rec) for rec in records))
+        return {'windows': len(records),
+                'topmost': sum(rec.topmost for rec in records),
+                'transparent': sum(rec.alpha >= 0 for rec in records),
+                'minimized': sum(rec.minimized for rec in records),
+                'overlays': len(self.overlays),
+                'created': self.created, 'pruned': self.pruned, 'recycled': self.recycled,
+                'bytes': size}
+
+
+process_index = ProcessIndex()
+win_events = WinEventListener()
+
+
+# ---------------------------
+# Process control: background priority for focus mode
+# ---------------------------
+
+PROCESS_SET_QUOTA = 0x0100
+PROCESS_SET_INFORMATION = 0x0200
+IDLE_PRIORITY_CLASS = 0x0040
+BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+FOCUS_NICE = 10  # POSIX: 后台进程的 nice 值至少调到这么高
+
+if sys.platform == 'win32':
+    _kernel32.GetPriorityClass.argtypes = [wintypes.HANDLE]
+    _kernel32.SetPriorityClass.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+    _kernel32.SetProcessWorkingSetSize.argtypes = [wintypes.HANDLE, ctypes.c_size_t, ctypes.c_size_t]
+
+
+class Win32ProcessControl:
+    """优先级类（Get/SetPriorityClass）与工作集裁剪（SetProcessWorkingSetSize(-1, -1)）"""
+    name = 'win32'
+
+    def get_priority(self, pid):
+        handle = _kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return None
+        try:
+            return _kernel32.GetPriorityClass(handle) or None
+        finally:
+            _kernel32.CloseHandle(handle)
+
+    def set_priority(self, pid, value):
+        handle = _kernel32.OpenProcess(PROCESS_SET_INFORMATION, False, pid)
+        if not handle:
+            return False
+        try:
+            return bool(_kernel32.SetPriorityClass(handle, value))
+        finally:
+            _kernel32.CloseHandle(handle)
+
+    def background_priority(self, current):
+        """降到“低于正常”；已经是低 / 空闲优先级的进程不动"""
+        if current in (IDLE_PRIORITY_CLASS, BELOW_NORMAL_PRIORITY_CLASS):
+            return None
+        return BELOW_NORMAL_PRIORITY_CLASS
+
+    def trim_memory(self, pid):
+        handle = _kernel32.OpenProcess(PROCESS_SET_QUOTA | PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+        try:
+            return bool(_kernel32.SetProcessWorkingSetSize(handle, ctypes.c_size_t(-1).value,
+                                                           ctypes.c_size_t(-1).value))
+        finally:
+            _kernel32.CloseHandle(handle)
+
+
+class PosixProcessControl:
+    """
+    nice 值（setpriority）。Linux 上 PRIO_PROCESS 只作用于单个线程，所以逐个设置 /proc/<pid>/task 下的线程。
+    没有 CAP_SYS_NICE 时只能把 nice 调回 RLIMIT_NICE 允许的下限（20 - 软限制），
+    原值低于下限的进程无法还原，background_priority 对它们返回 None（不降级）。
+    """
+    name = 'posix'
+    CAP_SYS_NICE = 23
+    _min_nice = None
+
+    def min_nice(self):
+        """本进程能设置的最小 nice 值（即能还原到的最高优先级）"""
+        if self._min_nice is None:
+            self._min_nice = -20 if self._privileged() else self._rlimit_nice()
+        return self._min_nice
+
+    def _privileged(self):
+        if os.geteuid() == 0:
+            return True
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('CapEff:'):
+                        return bool(int(line.split()[1], 16) >> self.CAP_SYS_NICE & 1)
+        except (OSError, ValueError, IndexError):
             pass
-        except Exception as e:
-            print("load config error:", e)
+        return False
 
-    def save(self):
+    def _rlimit_nice(self):
+        import resource
+        if not hasattr(resource, 'RLIMIT_NICE'):
+            return 20  # 非 Linux: 普通用户只能调高 nice
+        soft = resource.getrlimit(resource.RLIMIT_NICE)[0]
+        if soft == resource.RLIM_INFINITY:
+            return -20
+        return 20 - min(soft, 40)
+
+    def _threads(self, pid):
         try:
-            data = {'groups': {str(k): v for k, v in self.groups.items()},
-                    'hotkeys': self.hotkeys,
-                    'group_names': {str(k): v for k, v in self.group_names.items()}}
-            with open(PERSIST_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print("save config error:", e)
+            return [int(t) for t in os.listdir(f'/proc/{pid}/task')]
+        except (OSError, ValueError):
+            return [pid]
 
-    def add_to_group(self, group_id, hwnd):
-        if not is_window(hwnd):
+    def get_priority(self, pid):
+        try:
+            return os.getpriority(os.PRIO_PROCESS, pid)
+        except OSError:
+            return None
+
+    def set_priority(self, pid, value):
+        ok = False
+        for tid in self._threads(pid):
+            try:
+                os.setpriority(os.PRIO_PROCESS, tid, value)
+                ok = True
+            except OSError as e:
+                log_error(f"setpriority {tid}", e)
+        return ok
+
+    def background_priority(self, current):
+        if current >= FOCUS_NICE or current < self.min_nice():
+            return None
+        return FOCUS_NICE
+
+    def trim_memory(self, pid):
+        # 回收其它进程的内存需要 process_madvise + ptrace 权限，这里不做
+        return False
+
+
+class ProcessThrottle:
+    """
+    专注模式: “仅显示”隐藏窗口时，降低这些窗口所属进程的调度优先级（可选裁剪工作集）。
+    按 pid 合并，每个进程只改一次；仍有窗口在显示的进程和本程序自身不动。
+    原值写入状态日志（J_PRIORITY），退出仅显示、窗口回到前台、进程的隐藏窗口全部关闭或本程序退出时还原；
+    还原前确认当前值仍是我们设置的值，用户或程序自己改过的不覆盖。
+    """
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.throttled = {}  # pid -> (原优先级, 设置的优先级)
+        self.windows = {}  # 被隐藏的 hwnd -> pid（仅限已降级的进程）
+        self.trimmed = 0
+        self.own_pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def throttle(self, hidden, keep=(), trim=False):
+        """hidden: 被隐藏的窗口；keep: 仍然显示的窗口。返回新降级的进程数"""
+        keep_pids = {process_index.pid_of(h) or get_window_pid(h) for h in keep}
+        by_pid = {}
+        for h in hidden:
+            pid = process_index.pid_of(h) or get_window_pid(h)
+            if pid and pid != self.own_pid and pid not in keep_pids:
+                by_pid.setdefault(pid, []).append(h)
+        control = process_control
+        count = 0
+        with self._lock:
+            for pid, hwnds in by_pid.items():
+                if pid not in self.throttled:
+                    orig = control.get_priority(pid)
+                    target = None if orig is None else control.background_priority(orig)
+                    if target is None:
+                        continue
+                    self.journal.record(J_PRIORITY, pid, pid, orig, target)
+                    if not control.set_priority(pid, target):
+                        self.journal.clear(J_PRIORITY, pid)
+                        continue
+                    self.throttled[pid] = (orig, target)
+                    count += 1
+                    if trim and control.trim_memory(pid):
+                        self.trimmed += 1
+                for h in hwnds:
+                    self.windows[h] = pid
+        return count
+
+    def _release(self, pid):
+        entry = self.throttled.pop(pid, None)
+        if entry is None:
+            return False
+        for h in [h for h, p in self.windows.items() if p == pid]:
+            del self.windows[h]
+        self.journal.clear(J_PRIORITY, pid)
+        orig, applied = entry
+        # 进程已退出时 get_priority 为 None，无需还原
+        if process_control.get_priority(pid) == applied:
+            return process_control.set_priority(pid, orig)
+        return False
+
+    def release(self, pid):
+        with self._lock:
+            return self._release(pid)
+
+    def restore_all(self):
+        with self._lock:
+            return sum(bool(self._release(pid)) for pid in list(self.throttled))
+
+    def on_foreground(self, hwnd):
+        """被降级进程的窗口回到前台: 立即还原该进程"""
+        if not self.throttled:
             return
-        self.groups.setdefault(group_id, [])
-        if hwnd not in self.groups[group_id]:
-            self.groups[group_id].append(hwnd)
-            self.save()
+        pid = self.windows.get(hwnd) or process_index.pid_of(hwnd)
+        if pid in self.throttled:
+            self.release(pid)
 
-    def remove_from_group(self, group_id, hwnd):
-        if group_id in self.groups and hwnd in self.groups[group_id]:
-            self.groups[group_id].remove(hwnd)
-            self.save()
+    def on_window_closed(self, hwnd):
+        """隐藏的窗口关闭；该进程已没有隐藏窗口时还原（进程退出时只清理记录）"""
+        if hwnd not in self.windows:
+            return
+        with self._lock:
+            pid = self.windows.pop(hwnd, None)
+            if pid is not None and pid not in self.windows.values():
+                self._release(pid)
+
+    def recover(self, leftover):
+        """上次异常退出遗留的 J_PRIORITY 记录: 仍是我们设置的值时还原"""
+        count = 0
+        for (pid, kind), (_, orig, new) in leftover.items():
+            if kind != J_PRIORITY:
+                continue
+            if process_control.get_priority(pid) == new and process_control.set_priority(pid, orig):
+                count += 1
+            self.journal.clear(J_PRIORITY, pid)
+        return count
 
-    def set_group(self, group_id, hwnd_list):
-        self.groups[group_id] = [h for h in hwnd_list if is_window(h)]
-        self.save()
+    def stats(self):
+        return {'throttled': len(self.throttled), 'hidden_windows': len(self.windows), 'trimmed': self.trimmed}
 
-    def set_group_name(self, group_id, name):
-        self.group_names[group_id] = name
-        self.save()
+
+process_control = Win32ProcessControl() if sys.platform == 'win32' else PosixProcessControl()
 
 
 # ---------------------------
-# Overlay: a small always-on-top PyQt window placed over target window
+# X11 / EWMH backend (Linux)
 # ---------------------------
 
-class OverlayWindow(QtWidgets.QWidget):
+# 后端需实现的窗口操作；select_backend() 用后端的同名方法替换模块级函数
+BACKEND_FUNCTIONS = (
+    'enum_windows', 'is_window', 'set_topmost', 'minimize_window', 'restore_window', 'focus_window',
+    'get_window_rect', 'set_window_opacity', 'set_window_clickthrough', 'get_foreground_hwnd',
+    'hwnd_to_title', 'get_window_pid', 'get_exstyle', 'set_exstyle_bits', 'get_window_alpha',
+    'is_topmost', 'get_window_class', 'get_window_placement', 'set_window_placement',
+    'defer_window_positions', 'window_pid_if_listed', 'is_toplevel', 'probe_modifiers',
+    'query_exe_path', 'window_batch', 'enum_pick_candidates', 'extract_exe_icon', 'enum_window_table',
+    'set_layered_states',
+)
+
+# 不出现在列表中的窗口类型（相当于 Win32 的工具窗口）
+X11_SKIP_TYPES = ('_NET_WM_WINDOW_TYPE_DOCK', '_NET_WM_WINDOW_TYPE_DESKTOP', '_NET_WM_WINDOW_TYPE_TOOLBAR',
+                  '_NET_WM_WINDOW_TYPE_MENU', '_NET_WM_WINDOW_TYPE_SPLASH', '_NET_WM_WINDOW_TYPE_NOTIFICATION',
+                  '_NET_WM_WINDOW_TYPE_DROPDOWN_MENU', '_NET_WM_WINDOW_TYPE_POPUP_MENU',
+                  '_NET_WM_WINDOW_TYPE_TOOLTIP')
+X11_PROP_LONGS = 256  # 批量读取属性时每个属性最多取的 32 位单元数，更长的再单独补取
+
+
+class X11Backend:
     """
-    Small overlay window that sits on top of target hwnd.
-    Contains a small button; clicking expands a toolbar with slider and checkbox.
+    基于 X11 + EWMH（python-xlib）的窗口操作，与 Win32 辅助函数一一对应:
+    置顶用 _NET_WM_STATE_ABOVE，透明度用 _NET_WM_WINDOW_OPACITY，鼠标穿透用空的 SHAPE 输入区域，
+    最小化用 WM_CHANGE_STATE，激活/还原用 _NET_ACTIVE_WINDOW。Win32 扩展样式位在这里模拟，
+    使 Controller 和日志代码不必区分后端。
+
+    不需要答复的请求只进缓冲区；window_batch() 之外每个操作各自 flush，之内整组请求一次写出、
+    结束时只做一次 sync 往返（嵌套深度按线程记录）。原子和窗口的静态属性（pid、类名、类型）常驻缓存；
+    标题和 _NET_CLIENT_LIST 在事件线程保持其最新时使用缓存。枚举先发出所有窗口的属性请求再读答复，
+    冷启动时整次枚举一次往返，而不是每个窗口若干次。
+    """
+    name = 'x11'
+
+    def __init__(self, display_name=None):
+        from Xlib import X, Xatom, display as xdisplay
+        from Xlib.protocol import event as xevent
+        self.X, self.Xatom, self._xevent = X, Xatom, xevent
+        self.display = xdisplay.Display(display_name)
+        self.display_name = display_name
+        self.root = self.display.screen().root
+        self.display.set_error_handler(self._on_x_error)
+        self.has_shape = self.display.has_extension('SHAPE')
+        self._atoms = {}
+        self._static = {}  # wid -> {'pid', 'class', 'skip'}
+        self._titles = {}  # wid -> title (valid while events are live)
+        self._clickthrough = set()
+        self._clients = None  # _NET_CLIENT_LIST 缓存（frozenset），由事件线程在该属性变化时刷新
+        self._batch = threading.local()  # 每个线程各自的 window_batch 嵌套深度
+        self._lock = threading.RLock()
+        self.live_events = False
+        self._own_pid = os.getpid()
+
+    # ---- plumbing ----
+    def _on_x_error(self, err, request):
+        recorder.instant("error:x11", getattr(err, 'resource_id', 0) or 0, type(err).__name__)
+
+    def atom(self, name):
+        a = self._atoms.get(name)
+        if a is None:
+            a = self._atoms[name] = self.display.intern_atom(name)
+        return a
+
+    def _win(self, wid):
+        return self.display.create_resource_object('window', wid)
+
+    def _prop(self, wid, name, type_=None):
+        try:
+            p = self._win(wid).get_full_property(self.atom(name), type_ or self.X.AnyPropertyType)
+            return p.value if p is not None else None
+        except Exception:
+            return None
+
+    def _commit(self):
+        if not getattr(self._batch, 'depth', 0):
+            self.display.flush()
+
+    @contextmanager
+    def window_batch(self):
+        batch = self._batch
+        batch.depth = getattr(batch, 'depth', 0) + 1
+        try:
+            yield
+        finally:
+            batch.depth -= 1
+            if batch.depth == 0:
+                with self._lock:
+                    self.display.sync()  # 整批请求只需一次往返
+
+    def _client_message(self, wid, type_name, data):
+        ev = self._xevent.ClientMessage(window=self._win(wid), client_type=self.atom(type_name),
+                                        data=(32, (list(data) + [0, 0, 0, 0, 0])[:5]))
+        self.root.send_event(ev, event_mask=self.X.SubstructureRedirectMask | self.X.SubstructureNotifyMask)
+
+    def invalidate(self, wid, prop_name=None):
+        """由事件线程调用: 窗口属性变化或窗口销毁"""
+        if prop_name is None:
+            self._static.pop(wid, None)
+            self._titles.pop(wid, None)
+            self._clickthrough.discard(wid)
+        elif prop_name in ('_NET_WM_NAME', 'WM_NAME'):
+            self._titles.pop(wid, None)
+
+    # ---- enumeration ----
+    def client_list(self, refresh=False):
+        """顶层窗口列表；事件线程运行时使用缓存（它在 _NET_CLIENT_LIST 变化时以 refresh=True 刷新）"""
+        if self._clients is not None and self.live_events and not refresh:
+            return list(self._clients)
+        ids = self._prop(self.root.id, '_NET_CLIENT_LIST')
+        if ids is not None:
+            self._clients = frozenset(ids)
+            return list(ids)
+        self._clients = None  # 没有这个属性就没有变化通知，不能缓存
+        # 没有 EWMH 窗口管理器（如裸 Xvfb）: 退回到根窗口的已映射子窗口
+        out = []
+        for w in self.root.query_tree().children:
+            try:
+                if w.get_attributes().map_state == self.X.IsViewable:
+                    out.append(w.id)
+            except Exception:
+                pass
+        return out
+
+    def _static_info(self, wid):
+        info = self._static.get(wid)
+        if info is None:
+            pid = self._prop(wid, '_NET_WM_PID')
+            cls = None
+            try:
+                cls = self._win(wid).get_wm_class()
+            except Exception:
+                pass
+            types = self._prop(wid, '_NET_WM_WINDOW_TYPE') or ()
+            skip_types = {self.atom(t) for t in X11_SKIP_TYPES}
+            info = self._static[wid] = {
+                'pid': int(pid[0]) if pid else 0,
+                'class': cls[1] if cls else '',
+                'skip': any(t in skip_types for t in types),
+            }
+        return info
+
+    def hwnd_to_title(self, wid):
+        title = self._titles.get(wid) if self.live_events else None
+        if title is None:
+            raw = self._prop(wid, '_NET_WM_NAME', self.atom('UTF8_STRING'))
+            if raw is None:
+                raw = self._prop(wid, 'WM_NAME')
+            if isinstance(raw, bytes):
+                raw = raw.decode('utf-8', 'replace')
+            title = raw or ''
+            self._titles[wid] = title
+        return title
+
+    def _state_atoms(self, wid):
+        return set(self._prop(wid, '_NET_WM_STATE') or ())
+
+    def _prefetch(self, wids):
+        """
+        一批窗口的 _NET_WM_STATE、标题以及尚未缓存的 pid / 类名 / 类型: 先发出全部请求再依次读答复，
+        整批一次往返。填充静态信息和标题缓存，返回 wid -> 状态原子集合
+        """
+        from Xlib.protocol import request
+        any_type = self.X.AnyPropertyType
+        wanted = []
+        for wid in wids:
+            names = ['_NET_WM_STATE']
+            if not (self.live_events and wid in self._titles):
+                names.append('_NET_WM_NAME')
+            if wid not in self._static:
+                names += ['_NET_WM_PID', 'WM_CLASS', '_NET_WM_WINDOW_TYPE']
+            wanted += [(wid, name) for name in names]
+        with self._lock:
+            reqs = [(wid, name, request.GetProperty(display=self.display.display, defer=True, delete=False,
+                                                    window=wid, property=self.atom(name), type=any_type,
+                                                    long_offset=0, long_length=X11_PROP_LONGS))
+                    for wid, name in wanted]
+        values = {}
+        for wid, name, req in reqs:
+            try:
+                req.reply()
+            except Exception:
+                continue  # 窗口已销毁
+            if not req.property_type:
+                value = None
+            elif req.bytes_after:
+                value = self._prop(wid, name)  # 超长的属性单独补取完整值
+            else:
+                value = req.value[1]
+            values[(wid, name)] = value
+
+        skip_types = {self.atom(t) for t in X11_SKIP_TYPES}
+        states = {}
+        for wid in wids:
+            states[wid] = set(values.get((wid, '_NET_WM_STATE')) or ())
+            if wid not in self._static:
+                pid = values.get((wid, '_NET_WM_PID'))
+                cls = values.get((wid, 'WM_CLASS')) or b''
+                if isinstance(cls, bytes):
+                    cls = cls.decode('latin-1')
+                parts = cls.split('\0')
+                self._static[wid] = {
+                    'pid': int(pid[0]) if pid else 0,
+                    'class': parts[1] if len(parts) > 1 else '',
+                    'skip': any(t in skip_types for t in values.get((wid, '_NET_WM_WINDOW_TYPE')) or ()),
+                }
+            raw = values.get((wid, '_NET_WM_NAME'), ...)
+            if raw is None:
+                self._titles.pop(wid, None)
+                self.hwnd_to_title(wid)  # 只有 WM_NAME 的窗口（少见）单独读取
+            elif raw is not ...:
+                self._titles[wid] = raw.decode('utf-8', 'replace') if isinstance(raw, bytes) else raw
+        return states
+
+    def _listed_pid(self, wid, states, title):
+        info = self._static_info(wid)
+        if info['skip'] or info['pid'] == self._own_pid:
+            return 0
+        if self.atom('_NET_WM_STATE_SKIP_TASKBAR') in states:
+            return 0
+        if not title.strip():
+            return 0
+        return info['pid'] or -wid  # 没有 _NET_WM_PID 时每个窗口单独算一个“程序”
+
+    def window_pid_if_listed(self, wid):
+        return self._listed_pid(wid, self._state_atoms(wid), self.hwnd_to_title(wid))
+
+    def enum_windows(self):
+        return self.enum_window_table(titles=True).pairs()
+
+    def enum_window_table(self, titles=False):
+        wids = self.client_list()
+        states = self._prefetch(wids)
+        title = self._titles.get
+        return WindowTable.collect(wids, lambda wid: self._listed_pid(wid, states[wid], title(wid, '')),
+                                   (lambda wid: title(wid, '')) if titles else None)
+
+    def enum_pick_candidates(self):
+        # _NET_CLIENT_LIST_STACKING / query_tree 都是自底向上，这里反过来
+        ids = self._prop(self.root.id, '_NET_CLIENT_LIST_STACKING')
+        order = list(ids) if ids is not None else self.client_list()
+        hidden = self.atom('_NET_WM_STATE_HIDDEN')
+        out = []
+        for wid in reversed(order):
+            if not self.window_pid_if_listed(wid) or hidden in self._state_atoms(wid):
+                continue
+            rect = self.get_window_rect(wid)
+            if rect:
+                out.append((wid, rect))
+        return out
+
+    def is_window(self, wid):
+        if not wid:
+            return False
+        if wid in process_index.hwnd_pid and self.live_events:
+            return True
+        try:
+            self._win(wid).get_geometry()
+            return True
+        except Exception:
+            return False
+
+    def is_toplevel(self, wid):
+        if self._clients is None or not self.live_events:
+            return wid in self.client_list()
+        return wid in self._clients
+
+    def get_window_pid(self, wid):
+        return self._static_info(wid)['pid']
+
+    def get_window_class(self, wid):
+        return self._static_info(wid)['class']
+
+    def query_exe_path(self, pid):
+        try:
+            return os.readlink(f'/proc/{pid}/exe')
+        except OSError:
+            return ""
+
+    def extract_exe_icon(self, path, size=32):
+        # X11 下程序图标来自图标主题（IconCache 在 UI 线程按程序名查找），这里不解析可执行文件
+        return None
+
+    def get_foreground_hwnd(self):
+        active = self._prop(self.root.id, '_NET_ACTIVE_WINDOW')
+        return int(active[0]) if active else None
+
+    def probe_modifiers(self):
+        return None
+
+    # ---- state ----
+    def get_exstyle(self, wid):
+        ex = 0
+        if self.atom('_NET_WM_STATE_ABOVE') in self._state_atoms(wid):
+            ex |= WS_EX_TOPMOST
+        if self._prop(wid, '_NET_WM_WINDOW_OPACITY') is not None:
+            ex |= WS_EX_LAYERED
+        if wid in self._clickthrough:
+            ex |= WS_EX_TRANSPARENT
+        return ex
+
+    def is_topmost(self, wid):
+        return self.atom('_NET_WM_STATE_ABOVE') in self._state_atoms(wid)
+
+    def get_window_alpha(self, wid):
+        v = self._prop(wid, '_NET_WM_WINDOW_OPACITY')
+        return int(v[0]) * 255 // 0xFFFFFFFF if v else -1
+
+    def set_topmost(self, wid, on=True):
+        self._client_message(wid, '_NET_WM_STATE', [1 if on else 0, self.atom('_NET_WM_STATE_ABOVE'), 0, 1])
+        self._commit()
+        return True
+
+    def set_window_opacity(self, wid, alpha):
+        w = self._win(wid)
+        if int(alpha) >= 255:
+            w.delete_property(self.atom('_NET_WM_WINDOW_OPACITY'))
+        else:
+            w.change_property(self.atom('_NET_WM_WINDOW_OPACITY'), self.Xatom.CARDINAL, 32,
+                              [int(alpha) * 0xFFFFFFFF // 255])
+        self._commit()
+        return True
+
+    def set_window_clickthrough(self, wid, on=True):
+        if not self.has_shape:
+            return False
+        from Xlib.ext import shape
+        w = self._win(wid)
+        if on:
+            # 空输入区域: 鼠标事件穿透到下面的窗口
+            w.shape_rectangles(shape.SO.Set, shape.SK.Input, self.X.Unsorted, 0, 0, [])
+            self._clickthrough.add(wid)
+        else:
+            w.shape_mask(shape.SO.Set, shape.SK.Input, 0, 0, self.X.NONE)
+            self._clickthrough.discard(wid)
+        self._commit()
+        return True
+
+    def set_layered_states(self, states):
+        with self.window_batch():
+            for wid, ex_style, alpha in states:
+                self.set_window_clickthrough(wid, bool(ex_style & WS_EX_TRANSPARENT))
+                self.set_window_opacity(wid, alpha if ex_style & WS_EX_LAYERED and alpha >= 0 else 255)
+
+    def set_exstyle_bits(self, wid, mask, value):
+        if mask & WS_EX_TRANSPARENT:
+            self.set_window_clickthrough(wid, bool(value & WS_EX_TRANSPARENT))
+        if mask & WS_EX_LAYERED and not value & WS_EX_LAYERED:
+            self.set_window_opacity(wid, 255)
+        if mask & WS_EX_TOPMOST:
+            self.set_topmost(wid, bool(value & WS_EX_TOPMOST))
+        return True
+
+    def minimize_window(self, wid):
+        self._client_message(wid, 'WM_CHANGE_STATE', [3])  # IconicState
+        self._commit()
+        return True
+
+    def restore_window(self, wid):
+        self._win(wid).map()
+        self._client_message(wid, '_NET_ACTIVE_WINDOW', [2, self.X.CurrentTime])
+        self._commit()
+        return True
+
+    def focus_window(self, wid):
+        if not self.is_window(wid):
+            return False
+        return self.restore_window(wid)
+
+    # ---- geometry ----
+    def get_window_rect(self, wid):
+        try:
+            w = self._win(wid)
+            geo = w.get_geometry()
+            pos = self.root.translate_coords(w, 0, 0)
+            left, right, top, bottom = (self._prop(wid, '_NET_FRAME_EXTENTS') or (0, 0, 0, 0))[:4]
+            x, y = pos.x - left, pos.y - top
+            return (x, y, x + geo.width + left + right, y + geo.height + top + bottom)
+        except Exception:
+            return None
+
+    def get_window_placement(self, wid):
+        rect = self.get_window_rect(wid)
+        if rect is None:
+            return None
+        state = self._state_atoms(wid)
+        if self.atom('_NET_WM_STATE_HIDDEN') in state:
+            show = SW_SHOWMINIMIZED
+        elif {self.atom('_NET_WM_STATE_MAXIMIZED_VERT'), self.atom('_NET_WM_STATE_MAXIMIZED_HORZ')} <= state:
+            show = SW_SHOWMAXIMIZED
+        else:
+            show = SW_SHOWNORMAL
+        return (0, show, (0, 0), (0, 0), rect)
+
+    def set_window_placement(self, wid, show_cmd, normal_rect):
+        maxed = [self.atom('_NET_WM_STATE_MAXIMIZED_VERT'), self.atom('_NET_WM_STATE_MAXIMIZED_HORZ')]
+        if show_cmd in (SW_SHOWMINIMIZED, SW_MINIMIZE, SW_SHOWMINNOACTIVE):
+            self.minimize_window(wid)
+        elif show_cmd == SW_SHOWMAXIMIZED:
+            self._client_message(wid, '_NET_WM_STATE', [1] + maxed + [1])
+        else:
+            self._client_message(wid, '_NET_WM_STATE', [0] + maxed + [1])
+            self._win(wid).map()
+            self._move_resize(wid, *normal_rect)
+        self._commit()
+        return True
+
+    def _move_resize(self, wid, left, top, right, bottom):
+        # _NET_MOVERESIZE_WINDOW: gravity 默认 + x/y/w/h 有效位，来源为应用程序
+        flags = 0 | (1 << 8) | (1 << 9) | (1 << 10) | (1 << 11) | (1 << 12)
+        self._client_message(wid, '_NET_MOVERESIZE_WINDOW', [flags, left, top, right - left, bottom - top])
+
+    def defer_window_positions(self, moves):
+        with self.window_batch():
+            for wid, after, x, y, cx, cy, flags in moves:
+                if not flags & (SWP_NOMOVE | SWP_NOSIZE):
+                    self._move_resize(wid, x, y, x + cx, y + cy)
+                if after in (HWND_TOPMOST, HWND_NOTOPMOST):
+                    self.set_topmost(wid, after == HWND_TOPMOST)
+        return True
+
+    # ---- events ----
+    def event_listener(self):
+        return X11EventListener(self)
+
+    def process_control(self):
+        return PosixProcessControl()
+
+    def stats(self):
+        return {'atoms': len(self._atoms), 'static_cached': len(self._static), 'titles_cached': len(self._titles)}
+
+
+class X11EventListener:
+    """
+    与 WinEventListener 相同的 subscribe()/start() 接口，数据来自独立显示连接上的
+    PropertyNotify / DestroyNotify / ConfigureNotify: _NET_CLIENT_LIST 的变化转成 SHOW/DESTROY
+    （同时刷新后端的窗口列表缓存），_NET_ACTIVE_WINDOW 转成 FOREGROUND，标题变化转成 NAMECHANGE。
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._subs = {}
+        self._thread = None
+        self._clients = set()
+
+    def subscribe(self, event, callback):
+        self._subs[event] = self._subs.get(event, []) + [callback]
+
+    def unsubscribe(self, event, callback):
+        subs = [cb for cb in self._subs.get(event, ()) if cb != callback]
+        if subs:
+            self._subs[event] = subs
+        else:
+            self._subs.pop(event, None)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="x11-events", daemon=True)
+        self._thread.start()
+
+    def _emit(self, event, wid):
+        for cb in self._subs.get(event, ()):
+            try:
+                cb(wid, event)
+            except Exception as e:
+                log_error("x11 event callback", e, wid)
+
+    def _watch(self, d, wid):
+        try:
+            d.create_resource_object('window', wid).change_attributes(
+                event_mask=self.backend.X.PropertyChangeMask | self.backend.X.StructureNotifyMask)
+        except Exception:
+            pass
+
+    def _sync_clients(self, d):
+        new = set(self.backend.client_list(refresh=True))
+        for wid in new - self._clients:
+            self._watch(d, wid)
+            self._emit(EVENT_OBJECT_SHOW, wid)
+        for wid in self._clients - new:
+            self.backend.invalidate(wid)
+            self._emit(EVENT_OBJECT_DESTROY, wid)
+        self._clients = new
+
+    def _run(self):
+        from Xlib import X, display as xdisplay
+        b = self.backend
+        d = xdisplay.Display(b.display_name)
+        root = d.screen().root
+        root.change_attributes(event_mask=X.PropertyChangeMask)
+        d.flush()
+        self._sync_clients(d)
+        b.live_events = True
+        names = {d.intern_atom(n): n for n in ('_NET_WM_NAME', 'WM_NAME')}
+        client_list = d.intern_atom('_NET_CLIENT_LIST')
+        active = d.intern_atom('_NET_ACTIVE_WINDOW')
+        while True:
+            ev = d.next_event()
+            try:
+                if ev.type == X.PropertyNotify:
+                    if ev.window.id == root.id:
+                        if ev.atom == client_list:
+                            self._sync_clients(d)
+                        elif ev.atom == active:
+                            fg = b.get_foreground_hwnd()
+                            if fg:
+                                self._emit(EVENT_SYSTEM_FOREGROUND, fg)
+                    elif ev.atom in names:
+                        b.invalidate(ev.window.id, names[ev.atom])
+                        self._emit(EVENT_OBJECT_NAMECHANGE, ev.window.id)
+                elif ev.type == X.DestroyNotify:
+                    if ev.window.id in self._clients:
+                        self._clients.discard(ev.window.id)
+                        b.invalidate(ev.window.id)
+                        self._emit(EVENT_OBJECT_DESTROY, ev.window.id)
+                elif ev.type == X.ConfigureNotify:
+                    self._emit(EVENT_OBJECT_LOCATIONCHANGE, ev.window.id)
+            except Exception as e:
+                log_error("x11 events", e)
+
+
+def install_backend(backend):
+    """用 backend 的实现替换模块级窗口函数（每个调用仍记录到运行记录中）"""
+    global win_events, process_control
+    g = globals()
+    for name in BACKEND_FUNCTIONS:
+        impl = getattr(backend, name, None)
+        if impl is None:
+            continue
+        g[name] = impl if name == 'window_batch' else recorder.span(f'{backend.name}:{name}')(impl)
+    win_events = backend.event_listener()
+    process_control = backend.process_control()
+    return backend
+
+
+def select_backend():
+    """启动时选择窗口后端: Windows 用 Win32 辅助函数，其它平台用 X11"""
+    if sys.platform == 'win32':
+        return None
+    try:
+        return install_backend(X11Backend())
+    except ImportError:
+        print("缺少 python-xlib：pip install python-xlib")
+        raise
+    except Exception as e:
+        print("无法连接 X 服务器 (DISPLAY):", e)
+        raise
+
+
+def bench_x11_backend(counts=(100, 500, 2000)):
+    """
+    X11 后端基准（可在本地 Xvfb 上运行: Xvfb :99 & DISPLAY=:99 python main.py --bench x11）:
+    冷/热枚举耗时，以及逐个提交与批量提交的分组切换吞吐量。
+    """
+    from Xlib import X, Xatom
+    backend = X11Backend()
+    install_backend(backend)
+    d, root = backend.display, backend.root
+    for n in counts:
+        wins = []
+        for i in range(n):
+            w = root.create_window(i % 500, i % 300, 40, 30, 0, X.CopyFromParent, X.InputOutput,
+                                   X.CopyFromParent)
+            w.set_wm_name(f"bench window {i}")
+            w.set_wm_class("bench", "WMBench")
+            w.change_property(backend.atom('_NET_WM_PID'), Xatom.CARDINAL, 32, [1])
+            w.map()
+            wins.append(w.id)
+        d.sync()
+
+        backend._static.clear()
+        backend._titles.clear()
+        t0 = time.perf_counter()
+        listed = backend.enum_windows()
+        cold = time.perf_counter() - t0
+        backend.live_events = True
+        t0 = time.perf_counter()
+        backend.enum_windows()
+        warm = time.perf_counter() - t0
+        backend.live_events = False
+
+        t0 = time.perf_counter()
+        for wid in wins:
+            backend.set_topmost(wid, True)
+            backend.set_window_opacity(wid, 128)
+            d.sync()
+        single = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        with backend.window_batch():
+            for wid in wins:
+                backend.set_topmost(wid, False)
+                backend.set_window_opacity(wid, 255)
+        batched = time.perf_counter() - t0
+
+        print(f"x11 n={n}: listed={len(listed)} enum cold {cold * 1000:.1f} ms / cached {warm * 1000:.1f} ms; "
+              f"group toggle per-window sync {single * 1000:.1f} ms, batched {batched * 1000:.1f} ms "
+              f"({n / batched:.0f} windows/s)")
+        for wid in wins:
+            backend._win(wid).destroy()
+            backend.invalidate(wid)
+        d.sync()
+
+
+# ---------------------------
+# Session tape: record window / hotkey streams, simulated backend for replay
+# ---------------------------
+
+TAPE_MAGIC = b'WMR1'
+TAPE_RECORD = struct.Struct('<IBQiH')  # 距上一条的微秒数, 类型, hwnd, pid, 附加字段长度
+T_WINDOW = 1      # 窗口出现: exe, class, title, left, top, right, bottom
+T_DESTROY = 2
+T_TITLE = 3       # title
+T_FOREGROUND = 4
+T_MOVE = 5        # left, top, right, bottom
+T_HOTKEY = 6      # action, group 数字, slot 数字
+T_HIDE = 7
+T_GROUP = 8       # hwnd 加入分组（pid 字段为分组 id）: 分组名
+TAPE_KIND_NAMES = {T_WINDOW: 'window', T_DESTROY: 'destroy', T_TITLE: 'title', T_FOREGROUND: 'foreground',
+                   T_MOVE: 'move', T_HOTKEY: 'hotkey', T_HIDE: 'hide', T_GROUP: 'group'}
+
+
+def write_tape_record(f, dt_us, kind, hwnd, pid, fields=()):
+    payload = "\x1f".join(str(x) for x in fields).encode('utf-8')[:0xFFFF]
+    f.write(TAPE_RECORD.pack(min(dt_us, 0xFFFFFFFF), kind, hwnd & 0xFFFFFFFFFFFFFFFF, pid, len(payload)))
+    f.write(payload)
+
+
+def read_tape(path):
+    """逐条读出录制文件: (距开始的微秒数, 类型, hwnd, pid, [字段])"""
+    import gzip
+    with gzip.open(path, 'rb') as f:
+        if f.read(4) != TAPE_MAGIC:
+            raise ValueError(f"不是会话录制文件: {path}")
+        f.read(8)
+        t = 0
+        size = TAPE_RECORD.size
+        while True:
+            head = f.read(size)
+            if len(head) < size:
+                return
+            dt, kind, hwnd, pid, n = TAPE_RECORD.unpack(head)
+            t += dt
+            fields = f.read(n).decode('utf-8').split("\x1f") if n else []
+            yield t, kind, hwnd, pid, fields
+
+
+class SessionRecorder:
+    """
+    把窗口生命周期、标题变化、前台切换、窗口移动和热键触发连同时间写入 gzip 压缩的二进制文件
+    （每条 19 字节 + 字符串字段），供 replay_session 在模拟后端上重放。
+    只在录制期间订阅窗口事件: 窗口移动等是系统级钩子，未录制时不应为它们进入 Python。
+    """
+    EVENTS = (EVENT_OBJECT_SHOW, EVENT_OBJECT_HIDE, EVENT_OBJECT_DESTROY, EVENT_OBJECT_NAMECHANGE,
+              EVENT_SYSTEM_FOREGROUND, EVENT_OBJECT_LOCATIONCHANGE)
+
+    def __init__(self):
+        self.listener = None
+        self.active = False
+        self.path = None
+        self.count = 0
+        self._file = None
+        self._last_ns = 0
+        self._lock = threading.Lock()
+
+    def start(self, model, path=None):
+        import gzip
+        if self.active:
+            return self.path
+        self.path = path or config_path(time.strftime('wm_session_%Y%m%d_%H%M%S.wmrec'))
+        self._file = gzip.open(self.path, 'wb', compresslevel=6)
+        self._file.write(TAPE_MAGIC + struct.pack('<Q', time.time_ns()))
+        self._last_ns = time.perf_counter_ns()
+        self.count = 0
+        self.active = True
+        if self.listener is not None:
+            for event in self.EVENTS:
+                self.listener.subscribe(event, self.on_window_event)
+        # 先写下当前的窗口、前台和分组，重放时从同样的状态开始
+        for hwnd, pid in list(process_index.hwnd_pid.items()):
+            self._window(hwnd, pid)
+        fg = get_foreground_hwnd()
+        if fg:
+            self.record(T_FOREGROUND, fg)
+        snap = model.snapshot
+        for gid, hwnds in snap.groups.items():
+            for h in hwnds:
+                if h in process_index.hwnd_pid:
+                    self.record(T_GROUP, h, gid, (snap.group_names.get(gid, f"组 {gid}"),))
+        return self.path
+
+    def stop(self):
+        with self._lock:
+            if not self.active:
+                return None
+            self.active = False
+            self._file.close()
+            self._file = None
+        if self.listener is not None:
+            for event in self.EVENTS:
+                self.listener.unsubscribe(event, self.on_window_event)
+        return self.path
+
+    def record(self, kind, hwnd, pid=0, fields=()):
+        with self._lock:
+            if not self.active:
+                return
+            now = time.perf_counter_ns()
+            write_tape_record(self._file, (now - self._last_ns) // 1000, kind, int(hwnd), pid, fields)
+            self._last_ns = now
+            self.count += 1
+
+    def _window(self, hwnd, pid):
+        rect = get_window_rect(hwnd) or (0, 0, 0, 0)
+        self.record(T_WINDOW, hwnd, pid, (process_index.exe_path(pid) if pid > 0 else "",
+                                          get_window_class(hwnd), hwnd_to_title(hwnd)) + tuple(rect))
+
+    def on_window_event(self, hwnd, event):
+        if not self.active:
+            return
+        if event == EVENT_OBJECT_SHOW:
+            pid = window_pid_if_listed(hwnd)
+            if pid:
+                self._window(hwnd, pid)
+        elif hwnd not in process_index.hwnd_pid and event != EVENT_OBJECT_DESTROY:
+            return  # 只录列表中的窗口
+        elif event == EVENT_OBJECT_DESTROY:
+            self.record(T_DESTROY, hwnd)
+        elif event == EVENT_OBJECT_HIDE:
+            self.record(T_HIDE, hwnd)
+        elif event == EVENT_OBJECT_NAMECHANGE:
+            self.record(T_TITLE, hwnd, 0, (hwnd_to_title(hwnd),))
+        elif event == EVENT_SYSTEM_FOREGROUND:
+            self.record(T_FOREGROUND, hwnd)
+        elif event == EVENT_OBJECT_LOCATIONCHANGE:
+            self.record(T_MOVE, hwnd, 0, get_window_rect(hwnd) or (0, 0, 0, 0))
+
+    def attach(self, listener):
+        """记下事件源；开始录制时才订阅"""
+        self.listener = listener
+
+    def hotkey(self, match):
+        if self.active:
+            self.record(T_HOTKEY, 0, 0, (match.action, match.args.get('group', ''), match.args.get('slot', '')))
+
+
+session_tape = SessionRecorder()
+
+
+class SimWindow:
+    __slots__ = ('pid', 'exe', 'cls', 'title', 'rect', 'exstyle', 'alpha', 'show', 'visible')
+
+    def __init__(self, pid, exe, cls, title, rect):
+        self.pid, self.exe, self.cls, self.title, self.rect = pid, exe, cls, title, tuple(rect)
+        self.exstyle = 0
+        self.alpha = 255
+        self.show = SW_SHOWNORMAL
+        self.visible = True
+
+
+class SimProcessControl(PosixProcessControl):
+    """模拟后端的进程优先级: 只记在内存里（重放会话中的 pid 不对应真实进程）"""
+    name = 'sim'
+
+    def __init__(self):
+        self.priorities = {}
+
+    def min_nice(self):
+        return -20
+
+    def get_priority(self, pid):
+        return self.priorities.get(pid, 0)
+
+    def set_priority(self, pid, value):
+        self.priorities[pid] = value
+        return True
+
+
+class SimEventListener:
+    """同步派发的事件源: SimBackend 的窗口变化直接调用订阅者"""
+
+    def __init__(self):
+        self._subs = {}
+
+    def subscribe(self, event, callback):
+        self._subs[event] = self._subs.get(event, []) + [callback]
+
+    def unsubscribe(self, event, callback):
+        subs = [cb for cb in self._subs.get(event, ()) if cb != callback]
+        if subs:
+            self._subs[event] = subs
+        else:
+            self._subs.pop(event, None)
+
+    def start(self):
+        pass
+
+    def emit(self, event, hwnd):
+        for cb in self._subs.get(event, ()):
+            try:
+                cb(hwnd, event)
+            except Exception as e:
+                log_error("sim event callback", e, hwnd)
+
+
+class SimBackend:
+    """
+    内存中的模拟窗口系统，接口与 X11Backend 相同（install_backend 可直接安装）。
+    用于在没有桌面的 Linux 上重放录制的会话: 控制器对窗口的修改只改这里的状态，
+    focus_window 等会像真实系统一样发出前台切换事件。
+    """
+    name = 'sim'
+
+    def __init__(self):
+        self.windows = {}
+        self.z = []  # 自顶向下
+        self.foreground = 0
+        self.exe_by_pid = {}
+        self.listener = SimEventListener()
+        self.processes = SimProcessControl()
+
+    # ---- 由重放驱动的“外部”变化 ----
+    def open_window(self, hwnd, pid, exe, cls, title, rect):
+        self.windows[hwnd] = SimWindow(pid, exe, cls, title, rect)
+        self.exe_by_pid[pid] = exe
+        if hwnd in self.z:
+            self.z.remove(hwnd)
+        self.z.insert(0, hwnd)
+        self.listener.emit(EVENT_OBJECT_CREATE, hwnd)
+        self.listener.emit(EVENT_OBJECT_SHOW, hwnd)
+
+    def close_window(self, hwnd):
+        if self.windows.pop(hwnd, None) is not None:
+            self.z.remove(hwnd)
+        if self.foreground == hwnd:
+            self.foreground = 0
+        self.listener.emit(EVENT_OBJECT_DESTROY, hwnd)
+
+    def hide_window(self, hwnd):
+        w = self.windows.get(hwnd)
+        if w is not None:
+            w.visible = False
+            self.listener.emit(EVENT_OBJECT_HIDE, hwnd)
+
+    def retitle(self, hwnd, title):
+        w = self.windows.get(hwnd)
+        if w is not None:
+            w.title = title
+            self.listener.emit(EVENT_OBJECT_NAMECHANGE, hwnd)
+
+    def move(self, hwnd, rect):
+        w = self.windows.get(hwnd)
+        if w is not None:
+            w.rect = tuple(rect)
+            self.listener.emit(EVENT_OBJECT_LOCATIONCHANGE, hwnd)
+
+    def activate(self, hwnd):
+        if hwnd in self.windows:
+            self.foreground = hwnd
+            self.z.remove(hwnd)
+            self.z.insert(0, hwnd)
+            self.listener.emit(EVENT_SYSTEM_FOREGROUND, hwnd)
+
+    # ---- 后端接口 ----
+    def event_listener(self):
+        return self.listener
+
+    def process_control(self):
+        return self.processes
+
+    @contextmanager
+    def window_batch(self):
+        yield
+
+    def window_pid_if_listed(self, hwnd):
+        w = self.windows.get(hwnd)
+        if w is None or not w.visible or not w.title.strip():
+            return 0
+        return w.pid
+
+    def enum_windows(self):
+        windows, pairs = [], []
+        for hwnd in self.z:
+            pid = self.window_pid_if_listed(hwnd)
+            if pid:
+                windows.append((hwnd, self.windows[hwnd].title))
+                pairs.append((hwnd, pid))
+        process_index.rebuild(pairs)
+        return windows
+
+    def enum_window_table(self, titles=False):
+        return WindowTable.collect(self.z, self.window_pid_if_listed,
+                                   (lambda h: self.windows[h].title) if titles else None)
+
+    def enum_pick_candidates(self):
+        return [(h, self.windows[h].rect) for h in self.z
+                if self.window_pid_if_listed(h) and self.windows[h].show == SW_SHOWNORMAL]
+
+    def is_window(self, hwnd):
+        return hwnd in self.windows
+
+    def is_toplevel(self, hwnd):
+        return hwnd in self.windows
+
+    def hwnd_to_title(self, hwnd):
+        w = self.windows.get(hwnd)
+        return w.title if w is not None else ""
+
+    def get_window_pid(self, hwnd):
+        w = self.windows.get(hwnd)
+        return w.pid if w is not None else 0
+
+    def get_window_class(self, hwnd):
+        w = self.windows.get(hwnd)
+        return w.cls if w is not None else ""
+
+    def query_exe_path(self, pid):
+        return self.exe_by_pid.get(pid, "")
+
+    def extract_exe_icon(self, path, size=32):
+        return None
+
+    def get_foreground_hwnd(self):
+        return self.foreground
+
+    def probe_modifiers(self):
+        return set()
+
+    def get_window_rect(self, hwnd):
+        w = self.windows.get(hwnd)
+        return w.rect if w is not None else None
+
+    def get_exstyle(self, hwnd):
+        w = self.windows.get(hwnd)
+        return w.exstyle if w is not None else 0
+
+    def set_exstyle_bits(self, hwnd, mask, value):
+        w = self.windows.get(hwnd)
+        if w is None:
+            return False
+        w.exstyle = (w.exstyle & ~mask) | (value & mask)
+        return True
+
+    def set_layered_states(self, states):
+        for hwnd, ex_style, alpha in states:
+            w = self.windows.get(hwnd)
+            if w is not None:
+                w.exstyle = ex_style
+                if alpha >= 0:
+                    w.alpha = int(alpha)
+
+    def is_topmost(self, hwnd):
+        return bool(self.get_exstyle(hwnd) & WS_EX_TOPMOST)
+
+    def set_topmost(self, hwnd, on=True):
+        if hwnd not in self.windows:
+            return False
+        self.set_exstyle_bits(hwnd, WS_EX_TOPMOST, WS_EX_TOPMOST if on else 0)
+        if on:
+            self.z.remove(hwnd)
+            self.z.insert(0, hwnd)
+        return True
+
+    def get_window_alpha(self, hwnd):
+        w = self.windows.get(hwnd)
+        return w.alpha if w is not None else 255
+
+    def set_window_opacity(self, hwnd, alpha):
+        w = self.windows.get(hwnd)
+        if w is None:
+            return False
+        w.exstyle |= WS_EX_LAYERED
+        w.alpha = int(alpha)
+        return True
+
+    def set_window_clickthrough(self, hwnd, on=True):
+        return self.set_exstyle_bits(hwnd, WS_EX_TRANSPARENT | WS_EX_LAYERED,
+                                     (WS_EX_TRANSPARENT | WS_EX_LAYERED) if on else WS_EX_LAYERED)
+
+    def minimize_window(self, hwnd):
+        w = self.windows.get(hwnd)
+        if w is None:
+            return False
+        w.show = SW_SHOWMINIMIZED
+        return True
+
+    def restore_window(self, hwnd):
+        w = self.windows.get(hwnd)
+        if w is None:
+            return False
+        w.show = SW_SHOWNORMAL
+        return True
+
+    def focus_window(self, hwnd):
+        if not self.restore_window(hwnd):
+            return False
+        self.activate(hwnd)
+        return True
+
+    def get_window_placement(self, hwnd):
+        w = self.windows.get(hwnd)
+        return (0, w.show, (0, 0), (0, 0), w.rect) if w is not None else None
+
+    def set_window_placement(self, hwnd, show_cmd, normal_rect):
+        w = self.windows.get(hwnd)
+        if w is None:
+            return False
+        w.show = SW_SHOWMINIMIZED if _show_kind(show_cmd) == 'min' else show_cmd
+        w.rect = tuple(normal_rect)
+        return True
+
+    def defer_window_positions(self, moves):
+        for hwnd, after, x, y, cx, cy, flags in moves:
+            w = self.windows.get(hwnd)
+            if w is None:
+                continue
+            if not flags & (SWP_NOMOVE | SWP_NOSIZE):
+                w.rect = (x, y, x + cx, y + cy)
+            if after in (HWND_TOPMOST, HWND_NOTOPMOST):
+                self.set_topmost(hwnd, after == HWND_TOPMOST)
+        return True
+
+
+# ---------------------------
+# Action registry: built-in and plugin hotkey actions
+# ---------------------------
+
+# scope 决定组合键和调用方式:
+#   'window' - Ctrl+Alt+键 / 数字→键；handler(controller, hwnd, **params)，分组时对每个窗口调用一次
+#   'group'  - Ctrl+Alt+键 / 数字→键；handler(controller, gid, **params)，单独按时 gid 为 None（前台窗口所在分组）
+#   'global' - 仅 Ctrl+Alt+键；handler(controller, hwnd, **params)，hwnd 为前台窗口（可能为 0）
+#   'slot'   - Ctrl+Alt+键 再按数字；handler(controller, slot, **params)
+ActionSpec = namedtuple('ActionSpec', 'name key label scope target params source')
+ACTION_SCOPES = ('window', 'group', 'global', 'slot')
+PLUGIN_DIR = 'wm_plugins'
+
+
+class ActionRegistry:
+    """
+    热键动作的元数据（名称、默认键、显示名、作用范围）与实现分离:
+    启动时只登记元数据（插件只读 manifest JSON，不 import），组合键、快捷键设置对话框、分组提示都由它生成；
+    实现在第一次触发时才解析——target 为 "模块:函数" 时按需 import，
+    否则是 Controller 上的方法名（内置动作）。
+    """
+
+    def __init__(self):
+        self._specs = OrderedDict()
+        self._handlers = {}
+        self._paths = []
+        self._lock = threading.Lock()
+
+    def register(self, name, key, label, scope='window', target=None, params=None, source='builtin'):
+        if scope not in ACTION_SCOPES:
+            raise ValueError(f"未知的动作范围: {scope}")
+        if name in self._specs:
+            raise ValueError(f"动作重名: {name}")
+        self._specs[name] = ActionSpec(name, key, label, scope, target or name, params or {}, source)
+
+    def get(self, name):
+        return self._specs.get(name)
+
+    def specs(self, *scopes):
+        return [s for s in self._specs.values() if not scopes or s.scope in scopes]
+
+    def __len__(self):
+        return len(self._specs)
+
+    def default_hotkeys(self):
+        return {s.name: s.key for s in self._specs.values()}
+
+    def key_for(self, name, hotkeys):
+        return hotkeys.get(name) or self._specs[name].key
+
+    def discover(self, directory):
+        """读取插件目录下的 *.json manifest，只登记元数据；返回新登记的动作数"""
+        try:
+            names = sorted(n for n in os.listdir(directory) if n.endswith('.json'))
+        except FileNotFoundError:
+            return 0
+        count = 0
+        for fname in names:
+            path = os.path.join(directory, fname)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                for a in manifest.get('actions', []):
+                    try:
+                        self.register(a['name'], a['key'], a.get('label', a['name']), a.get('scope', 'window'),
+                                      a['target'], a.get('params'), source=path)
+                        count += 1
+                    except (KeyError, ValueError) as e:
+                        print(f"[!] 插件动作无效（{fname}）:", e)
+            except Exception as e:
+                log_error(f"load plugin manifest {path}", e)
+        if count and directory not in self._paths:
+            self._paths.append(directory)
+        return count
+
+    def resolve(self, name):
+        """动作的实现；第一次调用时导入插件模块，之后直接取缓存"""
+        handler = self._handlers.get(name)
+        if handler is not None:
+            return handler
+        spec = self._specs[name]
+        with self._lock:
+            if ':' in spec.target:
+                import importlib
+                for p in self._paths:
+                    if p not in sys.path:
+                        sys.path.append(p)
+                module, _, attr = spec.target.partition(':')
+                handler = importlib.import_module(module)
+                for part in attr.split('.'):
+                    handler = getattr(handler, part)
+            else:
+                handler = getattr(Controller, spec.target)
+            self._handlers[name] = handler
+        return handler
+
+    def stats(self):
+        return {'actions': len(self._specs), 'loaded': len(self._handlers),
+                'plugins': sum(1 for s in self._specs.values() if s.source != 'builtin')}
+
+
+actions = ActionRegistry()
+actions.register('topmost', 't', '置顶窗口', target='toggle_topmost')
+actions.register('show_only', 'm', '仅显示', target='toggle_show_only')
+actions.register('transparent', 'p', '半透明', target='toggle_transparent')
+# 专注模式: 仅显示，并降低被隐藏窗口所属进程的优先级
+actions.register('focus_mode', 'f', '专注模式', target='toggle_focus_mode')
+actions.register('open_group_manager', 'g', '打开分组管理', 'global', target='emit_group_manager')
+# 针对前台程序的全部窗口（Ctrl+Alt+Shift+…）
+actions.register('app_topmost', 'shift+t', '置顶整个程序', 'global', 'toggle_app', {'kind': 'topmost'})
+actions.register('app_show_only', 'shift+m', '仅显示整个程序', 'global', 'toggle_app', {'kind': 'show_only'})
+actions.register('app_transparent', 'shift+p', '整个程序半透明', 'global', 'toggle_app', {'kind': 'transparent'})
+# 按住 Ctrl+Alt: 先按 L，再按数字 1~9/0 切换到第 N 个布局方案
+actions.register('restore_profile', 'l', '切换布局（后接数字）', 'slot', target='restore_profile_slot')
+# 拾取模式: 高亮光标下的窗口，点击加入分组 / 置顶 / 半透明
+actions.register('pick_window', 'w', '拾取窗口', 'global', target='request_pick')
+# 在分组内按最近使用顺序切换窗口（单独按: 前台窗口所在分组；数字后按: 指定分组）
+actions.register('cycle_next', 'n', '分组内下一个窗口', 'group', 'cycle_group', {'step': 1})
+actions.register('cycle_prev', 'b', '分组内上一个窗口', 'group', 'cycle_group', {'step': -1})
+# 撤销 / 重做 最近的窗口和分组操作
+actions.register('undo', 'z', '撤销', 'global', target='undo')
+actions.register('redo', 'y', '重做', 'global', target='redo')
+# 按住期间所有置顶 / 半透明窗口几乎全透明且点击穿透，松开恢复
+actions.register('peek', 'space', '按住透视', 'global', target='peek')
+
+# 内置动作的默认键（插件动作的默认键见 actions.default_hotkeys()）
+DEFAULT_HOTKEYS = actions.default_hotkeys()
+
+
+# ---------------------------
+# Data model: groups, hotkeys
+# ---------------------------
+# 旧版固定的 10 个分组（界面顺序 1~9、0）
+LEGACY_GROUP_ORDER = [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]
+
+DEFAULT_SETTINGS = {
+    # 启动时发现上次异常退出遗留的半透明/置顶窗口: 'reattach' 重新接管并显示控制条，'restore' 直接还原
+    'journal_recovery': 'reattach',
+    # 仅显示的方式: 'minimize' 最小化其它窗口；'dim' 其它窗口不动，用每个显示器一层半透明遮罩盖住
+    'show_only_style': 'minimize',
+    'dim_opacity': 0.6,
+    # 热键后端: 'native' 系统注册热键（只有本程序的组合键进入 Python）；'hook' keyboard 库的低级键盘钩子
+    'hotkey_backend': 'native',
+    # 本地事件订阅端点（NDJSON，POSIX 为配置目录下的 Unix socket，Windows 为命名管道）
+    'event_stream': True,
+    # 专注模式同时裁剪后台进程的工作集（仅 Windows；之后访问这些程序时会有缺页开销）
+    'focus_trim_memory': False,
+}
+
+
+class ModelSnapshot(namedtuple('ModelSnapshot', 'version groups group_names group_parents group_shortcuts '
+                                                'hotkeys name_index')):
+    """
+    某一版本的分组 / 快捷键配置，发布后不再修改。
+    各字段都是只读映射（MappingProxyType），分组成员为 tuple；写入方只替换改动的字段 / 分组，
+    其余部分与上一版本共享，所以热键线程拿到一个快照后可以随意遍历，不需要加锁。
+    """
+    __slots__ = ()
+
+    def find_groups(self, name):
+        """按名称查找分组 id（不区分大小写）；“项目A/显示器1” 形式按路径查找"""
+        parts = [p.strip() for p in name.split('/') if p.strip()]
+        if not parts:
+            return []
+        found = list(self.name_index.get(parts[-1].lower(), ()))
+        if len(parts) > 1:
+            found = [g for g in found if [n.lower() for n in self.group_path(g)[-len(parts):]]
+                     == [p.lower() for p in parts]]
+        return found
+
+    def group_path(self, group_id):
+        path = []
+        gid = group_id
+        while gid is not None and len(path) < 64:
+            path.append(self.group_names.get(gid, f"组 {gid}"))
+            gid = self.group_parents.get(gid)
+        return path[::-1]
+
+    def group_tree(self):
+        """按层级展开的 [(分组 id, 深度), ...]，同级保持创建顺序"""
+        children = {}
+        for gid in self.groups:
+            parent = self.group_parents.get(gid)
+            children.setdefault(parent if parent in self.groups else None, []).append(gid)
+        out = []
+        stack = [(gid, 0) for gid in reversed(children.get(None, []))]
+        while stack:
+            gid, depth = stack.pop()
+            out.append((gid, depth))
+            stack.extend((c, depth + 1) for c in reversed(children.get(gid, [])))
+        return out
+
+    def group_hwnds(self, group_id):
+        """分组及其全部子分组中的窗口（去重，保持顺序）"""
+        ids = {group_id}
+        for gid, _ in self.group_tree():
+            if self.group_parents.get(gid) in ids:
+                ids.add(gid)
+        seen = {}
+        for gid, members in self.groups.items():
+            if gid in ids:
+                for h in members:
+                    seen.setdefault(h, None)
+        return list(seen)
+
+    def group_of(self, hwnd):
+        """hwnd 所在的第一个分组（按显示顺序），不在任何分组中时为 None"""
+        for gid, members in self.groups.items():
+            if hwnd in members:
+                return gid
+        return None
+
+
+def _frozen(mapping):
+    return mapping if isinstance(mapping, MappingProxyType) else MappingProxyType(mapping)
+
+
+def _name_index(group_names):
+    index = {}
+    for gid, name in group_names.items():
+        index.setdefault(name.lower(), []).append(gid)
+    return MappingProxyType({k: tuple(v) for k, v in index.items()})
+
+
+class Model:
+    """
+    分组 / 快捷键保存在不可变的 ModelSnapshot 中（self.snapshot）。
+    读取方（热键线程、事件线程）只读一次 self.snapshot 引用，之后看到的是同一版本的完整状态；
+    写入方在 _write_lock 下基于当前快照构造新快照、原子替换，然后按版本顺序通知 subscribe() 的监听者并保存配置。
+    groups / group_names / hotkeys 等属性返回当前快照的只读映射，修改请调用对应的方法。
+    """
+
+    def __init__(self):
+        # groups: 分组 id -> (hwnd, ...)；id 创建后不变、不复用，顺序即显示顺序
+        # group_parents: 嵌套分组，子分组 id -> 父分组 id（顶层分组不在其中）
+        # group_shortcuts: Ctrl+Alt+数字 选择的分组，'0'~'9' -> 分组 id
+        self.snapshot = ModelSnapshot(0, _frozen({}), _frozen({}), _frozen({}), _frozen({}),
+                                      _frozen(actions.default_hotkeys()), _name_index({}))
+        self.next_group_id = 0
+        self._write_lock = threading.RLock()
+        self._listeners = []
+        # named layout profiles: name -> [window entry, ...]
+        self.profiles = {}
+        # misc options
+        self.settings = DEFAULT_SETTINGS.copy()
+        # 新窗口自动规则（见 RuleIndex）
+        self.rules = []
+        # 按程序覆盖的快捷键（见 HotkeyTables）
+        self.hotkey_profiles = {}
+        self.load()
+        if not self.groups:
+            # 首次运行: 与旧版一样提供 1~9、0 共 10 个分组，数字键对应同名分组
+            self._publish(groups={i: () for i in LEGACY_GROUP_ORDER},
+                          group_names={i: f"组 {i}" for i in LEGACY_GROUP_ORDER},
+                          group_shortcuts={str(i): i for i in LEGACY_GROUP_ORDER})
+            self.next_group_id = 10
+
+    # ---- 当前快照的只读视图 ----
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def groups(self):
+        return self.snapshot.groups
+
+    @property
+    def group_names(self):
+        return self.snapshot.group_names
+
+    @property
+    def group_parents(self):
+        return self.snapshot.group_parents
+
+    @property
+    def group_shortcuts(self):
+        return self.snapshot.group_shortcuts
+
+    @property
+    def hotkeys(self):
+        return self.snapshot.hotkeys
+
+    def subscribe(self, callback):
+        """callback(old, new) 在每次发布新快照后调用（在写入方的线程中，按版本顺序）"""
+        self._listeners.append(callback)
+
+    def _publish(self, **changes):
+        """基于当前快照替换部分字段并发布；未改动的字段与上一版本共享"""
+        with self._write_lock:
+            old = self.snapshot
+            fields = {k: _frozen(v) for k, v in changes.items()}
+            if 'group_names' in fields:
+                fields['name_index'] = _name_index(fields['group_names'])
+            new = old._replace(version=old.version + 1, **fields)
+            self.snapshot = new
+            for callback in list(self._listeners):
+                try:
+                    callback(old, new)
+                except Exception as e:
+                    log_error("model listener", e)
+        return new
+
+    def _commit(self, **changes):
+        with self._write_lock:
+            self._publish(**changes)
+            self.save()
+
+    def load(self):
+        try:
+            with open(PERSIST_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                groups = {int(k): v for k, v in data.get('groups', {}).items()}
+                hotkeys = actions.default_hotkeys()
+                hotkeys.update(data.get('hotkeys', {}))
+                names = {}
+                for i, n in data.get('group_names', {}).items():
+                    try:
+                        names[int(i)] = n
+                    except:
+                        pass
+                parents = {}
+                if 'group_shortcuts' in data:
+                    ids = list(groups)
+                    shortcuts = {str(k): int(v) for k, v in data['group_shortcuts'].items()}
+                    parents = {int(k): int(v) for k, v in data.get('group_parents', {}).items()}
+                else:
+                    # 旧版配置: 固定的 0~9 号分组，数字键即分组号
+                    ids = list(LEGACY_GROUP_ORDER) + sorted((set(groups) | set(names)) - set(range(10)))
+                    shortcuts = {str(i): i for i in range(10)}
+                self._publish(groups={i: tuple(groups.get(i, ())) for i in ids},
+                              group_names={i: names.get(i, f"组 {i}") for i in ids},
+                              group_parents=parents, group_shortcuts=shortcuts, hotkeys=hotkeys)
+                self.next_group_id = max(data.get('next_group_id', 0), max(ids, default=-1) + 1)
+                self.settings.update(data.get('settings', {}))
+                self.profiles = data.get('profiles', {})
+                self.rules = data.get('rules', [])
+                self.hotkey_profiles = data.get('hotkey_profiles', {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_error("load config", e)
+
+    @recorder.span('model:save')
+    def save(self):
+        with self._write_lock:
+            snap = self.snapshot
+            try:
+                data = {'groups': {str(k): list(v) for k, v in snap.groups.items()},
+                        'hotkeys': dict(snap.hotkeys),
+                        'group_names': {str(k): v for k, v in snap.group_names.items()},
+                        'group_parents': {str(k): v for k, v in snap.group_parents.items()},
+                        'group_shortcuts': dict(snap.group_shortcuts),
+                        'next_group_id': self.next_group_id,
+                        'profiles': self.profiles,
+                        'settings': self.settings,
+                        'rules': self.rules,
+                        'hotkey_profiles': self.hotkey_profiles}
+                with open(PERSIST_FILE, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                log_error("save config", e)
+
+    def add_to_group(self, group_id, hwnd):
+        if not is_window(hwnd):
+            return
+        with self._write_lock:
+            members = self.groups.get(group_id)
+            if members is not None and hwnd not in members:
+                self._commit(groups={**self.groups, group_id: members + (hwnd,)})
+
+    def remove_from_group(self, group_id, hwnd):
+        with self._write_lock:
+            members = self.groups.get(group_id)
+            if members is not None and hwnd in members:
+                self._commit(groups={**self.groups, group_id: tuple(h for h in members if h != hwnd)})
+
+    def set_group(self, group_id, hwnd_list):
+        self.set_groups({group_id: hwnd_list})
+
+    def set_groups(self, mapping):
+        """一次写入多个分组的窗口列表（只发布一个版本、只保存一次配置）"""
+        mapping = {gid: tuple(h for h in hwnd_list if is_window(h)) for gid, hwnd_list in mapping.items()}
+        with self._write_lock:
+            groups = dict(self.groups)
+            for group_id, members in mapping.items():
+                if group_id in groups and groups[group_id] != members:
+                    groups[group_id] = members
+            self._commit(groups=groups)
+
+    def set_group_name(self, group_id, name):
+        with self._write_lock:
+            name = self._unique_name(name, self.group_parents.get(group_id), group_id)
+            self._commit(group_names={**self.group_names, group_id: name})
+
+    def set_hotkeys(self, hotkeys):
+        with self._write_lock:
+            self._commit(hotkeys={**self.hotkeys, **hotkeys})
+
+    def apply_changes(self, changes):
+        """撤销 / 重做: changes = {字段: {键: 值}}，值为 ABSENT 时删除该键；所有字段一次发布、一次保存"""
+        with self._write_lock:
+            fields = {}
+            for field, keys in changes.items():
+                mapping = dict(getattr(self.snapshot, field))
+                for k, v in keys.items():
+                    if v is ABSENT:
+                        mapping.pop(k, None)
+                    else:
+                        mapping[k] = v
+                fields[field] = mapping
+            if 'groups' in fields:
+                self.next_group_id = max(self.next_group_id, max(fields['groups'], default=-1) + 1)
+            self._commit(**fields)
+
+    # ---- 分组的增删、嵌套与数字键 ----
+    def _unique_name(self, name, parent, exclude=None):
+        """同一父分组下名称不重复: 重名时追加序号"""
+        snap = self.snapshot
+        siblings = {snap.group_names.get(g, "").lower() for g in snap.groups
+                    if g != exclude and snap.group_parents.get(g) == parent}
+        unique, n = name, 2
+        while unique.lower() in siblings:
+            unique = f"{name} ({n})"
+            n += 1
+        return unique
+
+    def create_group(self, name, parent=None):
+        with self._write_lock:
+            snap = self.snapshot
+            gid = self.next_group_id
+            self.next_group_id += 1
+            parents = snap.group_parents
+            if parent is not None and parent in snap.groups:
+                parents = {**parents, gid: parent}
+            else:
+                parent = None
+            self._commit(groups={**snap.groups, gid: ()},
+                         group_names={**snap.group_names, gid: self._unique_name(name, parent)},
+                         group_parents=parents)
+        return gid
+
+    def delete_group(self, group_id):
+        """删除分组；其子分组上移一级，绑定的数字键一并解除"""
+        with self._write_lock:
+            snap = self.snapshot
+            if group_id not in snap.groups:
+                return
+            parent = snap.group_parents.get(group_id)
+            parents = {}
+            for child, p in snap.group_parents.items():
+                if child == group_id:
+                    continue
+                if p != group_id:
+                    parents[child] = p
+                elif parent is not None:
+                    parents[child] = parent
+            self._commit(groups={g: m for g, m in snap.groups.items() if g != group_id},
+                         group_names={g: n for g, n in snap.group_names.items() if g != group_id},
+                         group_parents=parents,
+                         group_shortcuts={k: v for k, v in snap.group_shortcuts.items() if v != group_id})
+
+    def set_group_parent(self, group_id, parent):
+        """移动分组到 parent 下（None 为顶层）；不允许移到自己的子孙分组下"""
+        with self._write_lock:
+            parents = dict(self.group_parents)
+            p = parent
+            while p is not None:
+                if p == group_id:
+                    return False
+                p = parents.get(p)
+            if parent is None:
+                parents.pop(group_id, None)
+            else:
+                parents[group_id] = parent
+            self._commit(group_parents=parents)
+        return True
+
+    def bind_shortcut(self, digit, group_id):
+        """把数字键绑定到分组（group_id 为 None 时解除该数字键）；每个分组最多一个数字键"""
+        with self._write_lock:
+            shortcuts = {k: v for k, v in self.group_shortcuts.items() if v != group_id and k != digit}
+            if group_id is not None:
+                shortcuts[digit] = group_id
+            self._commit(group_shortcuts=dict(sorted(shortcuts.items())))
+
+    def shortcut_of(self, group_id):
+        for digit, gid in self.group_shortcuts.items():
+            if gid == group_id:
+                return digit
+        return None
+
+    def group_for_digit(self, digit):
+        snap = self.snapshot
+        gid = snap.group_shortcuts.get(str(digit))
+        return gid if gid in snap.groups else None
+
+    def find_groups(self, name):
+        return self.snapshot.find_groups(name)
+
+    def group_path(self, group_id):
+        return self.snapshot.group_path(group_id)
+
+    def group_label(self, group_id):
+        return " / ".join(self.snapshot.group_path(group_id))
+
+    def group_tree(self):
+        return self.snapshot.group_tree()
+
+    def group_hwnds(self, group_id):
+        return self.snapshot.group_hwnds(group_id)
+
+    def reload_rules(self):
+        """只重新读取配置文件中的 rules 和 hotkey_profiles（手工编辑配置后使用）"""
+        try:
+            with open(PERSIST_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.rules = data.get('rules', [])
+            self.hotkey_profiles = data.get('hotkey_profiles', {})
+        except FileNotFoundError:
+            self.rules = []
+        except Exception as e:
+            log_error("load rules", e)
+        return self.rules
+
+    def set_profile(self, name, entries):
+        self.profiles[name] = entries
+        self.save()
+
+    def delete_profile(self, name):
+        if self.profiles.pop(name, None) is not None:
+            self.save()
+
+
+# ---------------------------
+# State journal: crash-safe record of applied window state
+# ---------------------------
+
+JOURNAL_FILE = 'wm_journal.bin'
+
+# journal record kinds; "orig" is the value the window had before we first touched it
+J_TOPMOST = 1  # orig: 0/1 topmost
+J_EXSTYLE = 2  # orig: extended style (layered / transparent bits)
+J_ALPHA = 3  # orig: layered alpha or -1
+J_MINIMIZED = 4  # minimized by show-only
+J_PRIORITY = 5  # focus mode: keyed by pid instead of hwnd; orig/new are scheduling priorities
+J_PEEK = 6  # hold-to-peek in progress: orig is the extended style, new the layered alpha before the fade
+J_OP_SET = 1
+J_OP_CLEAR = 2
+
+
+class StateJournal:
+    """
+    只追加、内存映射的窗口状态变更日志。
+    每次变更是一条固定 32 字节的记录 (op, kind, pid, hwnd, orig, new)，直接写进映射区，
+    追加只是一次 struct 打包加内存拷贝，没有系统调用。
+    文件头中的写入偏移在记录写完后才前移，进程在写入中途被杀最多留下一条被忽略的半截记录。
+    内存中的 live 与日志一致: (hwnd, kind) -> (pid, orig, new)；只有写入成功后才更新。
+    pid 为有符号数: X11 下没有 _NET_WM_PID 的窗口用 -窗口 id 作为 pid。
+    """
+    MAGIC = b'WMJ1'
+    HEADER = struct.Struct('<4sIQ')  # magic, reserved, write offset
+    RECORD = struct.Struct('<BBHiqqq')  # op, kind, pad, pid, hwnd, orig, new
+
+    def __init__(self, path, size=64 * 1024):
+        self.path = path
+        self.size = size
+        self.live = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._mm = None
+        self._offset = self.HEADER.size
+
+    def open(self):
+        """映射日志文件，把上次运行遗留的记录读入 live"""
+        exists = os.path.exists(self.path)
+        self._file = open(self.path, 'r+b' if exists else 'w+b')
+        current = os.path.getsize(self.path)
+        if current < self.size:
+            self._file.truncate(self.size)
+        else:
+            self.size = current
+        self._mm = mmap.mmap(self._file.fileno(), self.size)
+        magic, _, offset = self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC or not (self.HEADER.size <= offset <= self.size):
+            offset = self.HEADER.size
+            self.HEADER.pack_into(self._mm, 0, self.MAGIC, 0, offset)
+        self.live = {}
+        end = offset - (offset - self.HEADER.size) % self.RECORD.size
+        for op, kind, _, pid, hwnd, orig, new in self.RECORD.iter_unpack(self._mm[self.HEADER.size:end]):
+            key = (hwnd, kind)
+            if op == J_OP_SET:
+                prev = self.live.get(key)
+                self.live[key] = (pid, prev[1] if prev else orig, new)
+            elif op == J_OP_CLEAR:
+                self.live.pop(key, None)
+        self._offset = end
+        return dict(self.live)
+
+    def _append(self, op, kind, pid, hwnd, orig, new):
+        if self._mm is None:
+            return
+        if self._offset + self.RECORD.size > self.size:
+            self._compact()
+        self.RECORD.pack_into(self._mm, self._offset, op, kind, 0, pid, hwnd, orig, new)
+        self._offset += self.RECORD.size
+        struct.pack_into('<Q', self._mm, 8, self._offset)
+
+    def _compact(self):
+        """只重写仍有效的记录；有效记录本身已接近占满时扩大映射"""
+        needed = self.HEADER.size + (len(self.live) + 1) * self.RECORD.size
+        if needed * 2 > self.size:
+            self._mm.close()
+            self.size = max(self.size * 2, needed * 2)
+            self._file.truncate(self.size)
+            self._mm = mmap.mmap(self._file.fileno(), self.size)
+        self._offset = self.HEADER.size
+        for (hwnd, kind), (pid, orig, new) in self.live.items():
+            self.RECORD.pack_into(self._mm, self._offset, J_OP_SET, kind, 0, pid, hwnd, orig, new)
+            self._offset += self.RECORD.size
+        struct.pack_into('<Q', self._mm, 8, self._offset)
+
+    def record(self, kind, hwnd, pid, orig, new):
+        """记录已应用的状态；(hwnd, kind) 保留第一次记录的原始值"""
+        with self._lock:
+            prev = self.live.get((hwnd, kind))
+            if prev is not None:
+                orig = prev[1]
+            entry = (int(pid), int(orig), int(new))
+            self._append(J_OP_SET, kind, entry[0], hwnd, entry[1], entry[2])
+            self.live[(hwnd, kind)] = entry
+
+    def original(self, kind, hwnd, default=None):
+        entry = self.live.get((hwnd, kind))
+        return entry[1] if entry else default
+
+    def clear(self, kind, hwnd):
+        with self._lock:
+            if (hwnd, kind) in self.live:
+                self._append(J_OP_CLEAR, kind, 0, hwnd, 0, 0)
+                del self.live[(hwnd, kind)]
+
+    def reset(self):
+        """全部已还原: 清空所有记录"""
+        with self._lock:
+            self.live.clear()
+            if self._mm is not None:
+                self._offset = self.HEADER.size
+                struct.pack_into('<Q', self._mm, 8, self._offset)
+                self._mm.flush()
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+                self._mm.close()
+                self._mm = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# ---------------------------
+# Chord engine: prefix trie over key events
+# ---------------------------
+
+# keyboard 库上报的修饰键名 -> 规范名
+MODIFIER_NAMES = {
+    'ctrl': 'ctrl', 'left ctrl': 'ctrl', 'right ctrl': 'ctrl', 'control': 'ctrl',
+    'alt': 'alt', 'left alt': 'alt', 'right alt': 'alt', 'alt gr': 'alt',
+    'shift': 'shift', 'left shift': 'shift', 'right shift': 'shift',
+    'windows': 'windows', 'left windows': 'windows', 'right windows': 'windows',
+}
+
+CHORD_STEP_TIMEOUT = 4.0  # seconds between two steps of a chord
+
+# 一条绑定: steps 如 ('ctrl+alt+<group>', 'ctrl+alt+t')；<name> 为参数步，匹配 choices[name] 中的任一键
+ChordBinding = namedtuple('ChordBinding', 'steps action params choices timeout')
+ChordBinding.__new__.__defaults__ = (None, None, CHORD_STEP_TIMEOUT)
+
+# 匹配结果作为单个事件投递: action、参数、按下的组合键序列、从按键到分发的耗时
+ChordMatch = namedtuple('ChordMatch', 'action args keys latency_ns')
+
+
+def parse_combo(text):
+    """'ctrl+alt+t' -> (frozenset({'ctrl', 'alt'}), 't')"""
+    parts = [p.strip().lower() for p in text.split('+') if p.strip()]
+    if not parts:
+        raise ValueError(f"empty key combo: {text!r}")
+    mods = frozenset(MODIFIER_NAMES.get(p, p) for p in parts[:-1])
+    return mods, parts[-1]
+
+
+class _ChordNode:
+    __slots__ = ('children', 'wild', 'action', 'params', 'timeout', 'reachable')
+
+    def __init__(self):
+        self.children = {}  # (mods, key) -> node
+        self.wild = {}  # mods -> [(arg_name, choices, node)]
+        self.reachable = set()  # actions reachable from this node (for prompts)
+        self.action = None
+        self.params = None
+        self.timeout = CHORD_STEP_TIMEOUT
+
+
+class ChordEngine:
+    """
+    把全部绑定编译成以 (修饰键, 键) 为步的前缀树，每次按下只走一步，分派耗时只与组合长度有关，与绑定数量无关。
+    匹配结果经 on_match(ChordMatch) 送出一次；组合输入到一半时调用 on_prefix(args, keys, actions)（分组 / 布局提示），
+    组合完成或中途取消时调用 on_cancel()。
+    等待下一步超时，或松开组合开始时按住的修饰键，都会结束当前组合；此时若所在节点本身也是完整绑定则触发它。
+    """
+
+    def __init__(self, on_match, on_prefix=None, on_cancel=None, modifier_probe=None):
+        self.on_match = on_match
+        self.on_prefix = on_prefix
+        self.on_cancel = on_cancel
+        # 可选: 返回当前真实按下的修饰键集合，用于钩子漏掉抬起事件时纠正状态
+        self.modifier_probe = modifier_probe
+        self._root = _ChordNode()
+        self._mods = set()
+        self._down = set()
+        self._reset()
+
+    def _reset(self):
+        self._node = self._root
+        self._keys = []
+        self._args = {}
+        self._chord_mods = frozenset()
+        self._deadline = 0
+
+    def compile(self, bindings):
+        """由绑定重新编译前缀树并启用；有冲突时抛出 ValueError"""
+        self.use(self.build(bindings))
+
+    def use(self, root):
+        """启用 build() 返回的树，丢弃进行中的组合；有变化时返回 True"""
+        if root is self._root:
+            return False
+        self._root = root
+        self._reset()
+        return True
+
+    def build(self, bindings):
+        """由绑定编译前缀树但不启用；有冲突时抛出 ValueError"""
+        root = _ChordNode()
+        for b in bindings:
+            node = root
+            for step in b.steps:
+                mods, key = parse_combo(step)
+                if key.startswith('<') and key.endswith('>'):
+                    name = key[1:-1]
+                    choices = frozenset(str(c).lower() for c in (b.choices or {}).get(name, ()))
+                    slots = node.wild.setdefault(mods, [])
+                    for slot in slots:
+                        if slot[0] == name and slot[1] == choices:
+                            node = slot[2]
+                            break
+                    else:
+                        child = _ChordNode()
+                        slots.append((name, choices, child))
+                        node = child
+                else:
+                    node = node.children.setdefault((mods, key), _ChordNode())
+                node.timeout = b.timeout
+                node.reachable.add(b.action)
+            if node is root:
+                raise ValueError("binding without steps")
+            if node.action is not None and (node.action, node.params) != (b.action, b.params):
+                raise ValueError(f"conflicting bindings for {' , '.join(b.steps)}: {node.action} / {b.action}")
+            node.action = b.action
+            node.params = b.params
+        return root
+
+    @property
+    def pending(self):
+        """是否正处于多步组合的中途"""
+        return self._node is not self._root
+
+    @property
+    def modifiers(self):
+        return frozenset(self._mods)
+
+    def first_steps(self):
+        """根节点接受的全部 (修饰键, 键)，即每个组合的第一步（原生热键后端据此注册）"""
+        root = self._root
+        steps = set(root.children)
+        for mods, slots in root.wild.items():
+            for name, choices, child in slots:
+                steps.update((mods, c) for c in choices)
+        return steps
+
+    def press(self, mods, key, t_ns=None):
+        """原生热键送达: 一次完整的 修饰键+键（没有单独的修饰键事件）"""
+        self._mods = set(mods)
+        self._down.discard(key)
+        match = self.feed('down', key, t_ns)
+        self._down.discard(key)
+        return match
+
+    def expire(self, t_ns=None):
+        """等待下一步超时: 结束当前组合（完整的则触发）；返回是否仍在等待"""
+        if self.pending and (t_ns or time.perf_counter_ns()) > self._deadline:
+            self._abandon(time.perf_counter_ns())
+        return self.pending
+
+    def _lookup(self, node, mods, key):
+        child = node.children.get((mods, key))
+        if child is not None:
+            return child, None
+        for name, choices, child in node.wild.get(mods, ()):
+            if not choices or key in choices:
+                return child, (name, key)
+        return None, None
+
+    def _fire(self, node, t_ns):
+        args = dict(node.params or {})
+        args.update(self._args)
+        match = ChordMatch(node.action, args, tuple(self._keys), time.perf_counter_ns() - t_ns)
+        self._reset()
+        self.on_match(match)
+        return match
+
+    def _abandon(self, t_ns):
+        """进行中的组合没有下一步就结束了: 节点是完整绑定则触发，否则取消"""
+        node = self._node
+        if node.action is not None:
+            return self._fire(node, t_ns)
+        self._reset()
+        if self.on_cancel:
+            self.on_cancel()
+        return None
+
+    def feed(self, event_type, name, t_ns=None):
+        """送入一个按键事件（'down'/'up', 键名），触发了组合时返回 ChordMatch"""
+        if t_ns is None:
+            t_ns = time.perf_counter_ns()
+        if not name:
+            return None
+        name = name.lower()
+        mod = MODIFIER_NAMES.get(name)
+        if event_type == 'up':
+            if mod is not None:
+                self._mods.discard(mod)
+                if self._node is not self._root and mod in self._chord_mods:
+                    return self._abandon(t_ns)
+            else:
+                self._down.discard(name)
+            return None
+
+        if mod is not None:
+            self._mods.add(mod)
+            return None
+        if name in self._down:
+            return None  # 按住不放产生的自动重复
+        self._down.add(name)
+
+        if self._node is not self._root and t_ns > self._deadline:
+            self._abandon(t_ns)
+
+        mods = frozenset(self._mods)
+        child, arg = self._lookup(self._node, mods, name)
+        if child is None and self._node is not self._root:
+            # 当前序列不匹配: 取消后从根重新尝试（该键可能是另一组合的起点）
+            self._reset()
+            if self.on_cancel:
+                self.on_cancel()
+            child, arg = self._lookup(self._root, mods, name)
+        if child is None:
+            return None
+
+        if self._node is self._root and self.modifier_probe is not None:
+            actual = self.modifier_probe()
+            if actual is not None and frozenset(actual) != mods:
+                self._mods = set(actual)
+                child, arg = self._lookup(self._root, frozenset(actual), name)
+                if child is None:
+                    return None
+            self._chord_mods = frozenset(self._mods)
+        elif self._node is self._root:
+            self._chord_mods = mods
+
+        self._keys.append('+'.join(sorted(mods) + [name]))
+        if arg is not None:
+            self._args[arg[0]] = arg[1]
+        self._node = child
+        if not child.children and not child.wild:
+            return self._fire(child, t_ns)
+        self._deadline = t_ns + int(child.timeout * 1e9)
+        if self.on_prefix:
+            self.on_prefix(dict(self._args), tuple(self._keys), frozenset(child.reachable))
+        return None
+
+    def replay(self, events):
+        """测试用: 依次送入 ('down'|'up', 键) 事件，返回 (匹配结果, 每个事件的分派耗时 ns)"""
+        matches = []
+        latencies = []
+        for event_type, name in events:
+            t0 = time.perf_counter_ns()
+            m = self.feed(event_type, name, t0)
+            latencies.append(time.perf_counter_ns() - t0)
+            if m is not None:
+                matches.append(m)
+        return matches, latencies
+
+
+def press_chord(*combos):
+    """把 'ctrl+alt+1', 'ctrl+alt+t' 展开为按键事件序列（修饰键全程按住）"""
+    events = []
+    held = []
+    for combo in combos:
+        mods, key = parse_combo(combo)
+        for m in sorted(mods):
+            if m not in held:
+                held.append(m)
+                events.append(('down', m))
+        for m in list(held):
+            if m not in mods:
+                held.remove(m)
+                events.append(('up', m))
+        events.append(('down', key))
+        events.append(('up', key))
+    for m in reversed(held):
+        events.append(('up', m))
+    return events
+
+
+def build_chord_bindings(hotkeys, registry=None, disabled=()):
+    """由 Model.hotkeys 和动作注册表生成全部组合键绑定；disabled 中的动作不绑定"""
+    registry = registry or actions
+    bindings = []
+    for spec in registry.specs():
+        if spec.name in disabled:
+            continue
+        key = registry.key_for(spec.name, hotkeys)
+        if spec.scope == 'slot':
+            bindings.append(ChordBinding((f'ctrl+alt+{key}', 'ctrl+alt+<slot>'), spec.name,
+                                         choices={'slot': '0123456789'}))
+            continue
+        bindings.append(ChordBinding((f'ctrl+alt+{key}',), spec.name))
+        if spec.scope in ('window', 'group'):
+            # 分组 → 操作: 按住 Ctrl+Alt，先按数字再按字母
+            bindings.append(ChordBinding(('ctrl+alt+<group>', f'ctrl+alt+{key}'), spec.name,
+                                         choices={'group': '0123456789'}))
+    return bindings
+
+
+class HotkeyTables:
+    """
+    按程序区分的快捷键方案（wm_config.json 的 hotkey_profiles），每个方案预先编译成各自的前缀树:
+      {"game.exe": {"topmost": null, "show_only": "shift+m"}, "class:UnrealWindow": {"transparent": ""}}
+    键为 exe 文件名或 "class:窗口类名"（不区分大小写），值覆盖默认快捷键；null 或 "" 表示在该程序中不绑定此动作。
+    只在前台窗口变化时查表并切换引擎使用的树，按键分发本身不变。
+    切换发生在事件线程，lock 与所有喂引擎的线程（原生热键的消息线程 / 钩子线程、keyboard 钩子线程）共用，
+    切换不会插进一次 press / feed 的中间。
+    """
+
+    def __init__(self, engine, lock=None):
+        self.engine = engine
+        self.lock = lock or threading.RLock()  # 可重入: 组合键动作可能在同一线程里引起前台切换
+        self.default = None
+        self.by_exe = {}
+        self.by_class = {}
+        self.active = 'default'
+        self.switches = 0
+
+    def compile(self, hotkeys, profiles):
+        """编译默认方案和全部程序方案，并切换到默认方案；无效的方案跳过并提示"""
+        default = self.engine.build(build_chord_bindings(hotkeys))
+        by_exe, by_class = {}, {}
+        for name, overrides in (profiles or {}).items():
+            try:
+                merged = {**hotkeys, **{a: k for a, k in overrides.items() if k}}
+                disabled = {a for a, k in overrides.items() if not k}
+                table = self.engine.build(build_chord_bindings(merged, disabled=disabled))
+            except (ValueError, AttributeError, KeyError) as e:
+                print(f"程序快捷键方案 {name} 无效:", e)
+                continue
+            name = name.lower()
+            if name.startswith('class:'):
+                by_class[name[len('class:'):]] = table
+            else:
+                by_exe[name] = table
+        with self.lock:
+            self.default, self.by_exe, self.by_class = default, by_exe, by_class
+            self.active = 'default'
+            self.engine.use(default)
+
+    def __len__(self):
+        return len(self.by_exe) + len(self.by_class)
+
+    def select(self, exe, window_class=None):
+        """前台程序变化: 按 exe、窗口类名（可为返回类名的函数，只在有类名方案时调用）选择方案；返回是否切换了"""
+        exe = (exe or '').lower()
+        table, name = self.by_exe.get(exe), exe
+        if table is None and self.by_class:
+            cls = (window_class() if callable(window_class) else window_class or '').lower()
+            table, name = self.by_class.get(cls), f'class:{cls}'
+        if table is None:
+            table, name = self.default, 'default'
+        with self.lock:
+            if not self.engine.use(table):
+                return False
+            self.active = name
+            self.switches += 1
+        return True
+
+    def stats(self):
+        return {'profiles': len(self), 'active': self.active, 'switches': self.switches}
+
+
+# RegisterHotKey 修饰键与虚拟键码
+MOD_ALT, MOD_CONTROL, MOD_SHIFT, MOD_WIN, MOD_NOREPEAT = 0x1, 0x2, 0x4, 0x8, 0x4000
+HOTKEY_MODS = {'alt': MOD_ALT, 'ctrl': MOD_CONTROL, 'shift': MOD_SHIFT, 'windows': MOD_WIN}
+VK_NAMES = {
+    'space': 0x20, 'enter': 0x0D, 'tab': 0x09, 'esc': 0x1B, 'backspace': 0x08, 'delete': 0x2E,
+    'insert': 0x2D, 'home': 0x24, 'end': 0x23, 'page up': 0x21, 'page down': 0x22,
+    'left': 0x25, 'up': 0x26, 'right': 0x27, 'down': 0x28,
+}
+WM_HOTKEY = 0x0312
+WM_QUIT = 0x0012
+HWND_MESSAGE = -3
+WM_HOTKEY_REBIND = WM_APP
+WM_HOTKEY_SYNC = WM_APP + 1
+
+if _user32 is not None:
+    _user32.CreateWindowExW.restype = wintypes.HWND
+    _user32.CreateWindowExW.argtypes = [wintypes.DWORD, wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.DWORD,
+                                        ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, wintypes.HWND,
+                                        wintypes.HMENU, wintypes.HINSTANCE, wintypes.LPVOID]
+    _user32.RegisterHotKey.argtypes = [wintypes.HWND, ctypes.c_int, wintypes.UINT, wintypes.UINT]
+    _user32.UnregisterHotKey.argtypes = [wintypes.HWND, ctypes.c_int]
+    _user32.DestroyWindow.argtypes = [wintypes.HWND]
+    _user32.VkKeyScanW.restype = ctypes.c_short
+
+
+def key_to_vk(key):
+    """keyboard 库的键名 -> 虚拟键码；无法注册的键返回 None"""
+    if len(key) == 1 and key.isascii() and key.isalnum():
+        return ord(key.upper())
+    if key[:1] == 'f' and key[1:].isdigit() and 1 <= int(key[1:]) <= 24:
+        return 0x70 + int(key[1:]) - 1  # VK_F1..VK_F24
+    if key in VK_NAMES:
+        return VK_NAMES[key]
+    if len(key) == 1 and _user32 is not None:
+        scan = _user32.VkKeyScanW(ord(key))
+        if scan != -1:
+            return scan & 0xFF
+    return None
+
+
+class NativeHotkeySource:
+    """
+    用 RegisterHotKey 把每个组合的第一步注册到一个消息专用窗口（HWND_MESSAGE）上，
+    系统只把这些组合键以 WM_HOTKEY 送来，平时的按键完全不经过 Python。
+    只有进入多步组合（如 Ctrl+Alt+数字 之后）时才临时挂一个低级键盘钩子，
+    接收后续步骤中未注册的键和修饰键的抬起；组合结束（匹配、取消或超时）后立即卸下。
+    """
+
+    def __init__(self, engine, install_hook=None, remove_hook=None, lock=None):
+        self.engine = engine
+        self.install_hook = install_hook or keyboard.hook
+        self.remove_hook = remove_hook or keyboard.unhook
+        self._ids = {}  # hotkey id -> (mods, key)
+        self._registered = set()
+        self.failed = []  # 注册失败（被其它程序占用或无法映射）的组合
+        self._hooked = False
+        self._hook_since = 0
+        # 消息线程和钩子线程都会喂组合键引擎；切换快捷键方案时传入 HotkeyTables.lock 共用
+        self._lock = lock or threading.RLock()
+        self._hwnd = None
+        self._tid = 0
+        self._thread = None
+        self._ready = threading.Event()
+        # stats
+        self.hotkeys = 0
+        self.hook_events = 0
+        self.hook_installs = 0
+        self.hook_time_ns = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="wm-hotkeys", daemon=True)
+        self._thread.start()
+        self._ready.wait(2.0)
+
+    def stop(self):
+        if self._tid:
+            _user32.PostThreadMessageW(self._tid, WM_QUIT, 0, 0)
+
+    def rebind(self):
+        """快捷键改动后重新注册（RegisterHotKey 必须在窗口所在线程调用）"""
+        self._post(WM_HOTKEY_REBIND)
+
+    def _post(self, message):
+        if self._tid:
+            _user32.PostThreadMessageW(self._tid, message, 0, 0)
+        elif message == WM_HOTKEY_REBIND:
+            self._register()
+        else:
+            self._sync_hook()
+
+    def _run(self):
+        self._tid = _kernel32.GetCurrentThreadId()
+        self._hwnd = _user32.CreateWindowExW(0, "STATIC", "wm-hotkeys", 0, 0, 0, 0, 0,
+                                             HWND_MESSAGE, None, None, None)
+        self._register()
+        self._ready.set()
+        msg = wintypes.MSG()
+        while _user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+            if msg.message == WM_HOTKEY:
+                self._on_hotkey(msg.wParam, time.perf_counter_ns())
+            elif msg.message == WM_HOTKEY_REBIND:
+                self._register()
+            elif msg.message == WM_HOTKEY_SYNC:
+                self._sync_hook()
+            else:
+                _user32.TranslateMessage(ctypes.byref(msg))
+                _user32.DispatchMessageW(ctypes.byref(msg))
+        self._unregister()
+        self._set_hook(False)
+        _user32.DestroyWindow(self._hwnd)
+
+    def _unregister(self):
+        if self._hwnd:
+            for hotkey_id in self._ids:
+                _user32.UnregisterHotKey(self._hwnd, hotkey_id)
+        self._ids = {}
+        self._registered = set()
+
+    def _register(self):
+        """按引擎当前的前缀树注册: 只注销不再需要的组合、注册新增的组合（切换程序方案时未绑定的键随即还给程序）"""
+        wanted = self.engine.first_steps()
+        ids = {}
+        for hotkey_id, combo in self._ids.items():
+            if combo in wanted:
+                ids[hotkey_id] = combo
+            elif self._hwnd:
+                _user32.UnregisterHotKey(self._hwnd, hotkey_id)
+        failed = []
+        next_id = max(ids, default=0) + 1
+        for mods, key in sorted(wanted - set(ids.values()), key=lambda s: (sorted(s[0]), s[1])):
+            vk = key_to_vk(key)
+            flags = MOD_NOREPEAT
+            for m in mods:
+                flags |= HOTKEY_MODS.get(m, 0)
+            if vk is None or (self._hwnd and not _user32.RegisterHotKey(self._hwnd, next_id, flags, vk)):
+                failed.append('+'.join(sorted(mods) + [key]))
+                continue
+            ids[next_id] = (mods, key)
+            next_id += 1
+        self._ids = ids
+        self._registered = set(ids.values())
+        self.failed = failed
+        if failed:
+            print("[!] 以下快捷键注册失败（可能已被其它程序占用）:", ", ".join(failed))
+
+    def _on_hotkey(self, hotkey_id, t_ns=None):
+        combo = self._ids.get(hotkey_id)
+        if combo is None:
+            return
+        self.hotkeys += 1
+        with self._lock:
+            self.engine.press(combo[0], combo[1], t_ns)
+            pending = self.engine.pending
+        self._set_hook(pending)
+
+    def _on_hook_event(self, event):
+        """临时钩子（keyboard 线程）: 已注册的组合由 WM_HOTKEY 送达，这里跳过以免重复"""
+        self.hook_events += 1
+        name = (event.name or '').lower()
+        with self._lock:
+            engine = self.engine
+            if (event.event_type == 'down' and name not in MODIFIER_NAMES
+                    and (engine.modifiers, name) in self._registered):
+                return
+            engine.feed(event.event_type, name)
+            pending = engine.pending
+        if not pending:
+            # 不在钩子回调里卸下钩子，交给消息线程
+            self._post(WM_HOTKEY_SYNC)
+
+    def _sync_hook(self):
+        with self._lock:
+            pending = self.engine.expire()
+        self._set_hook(pending)
+
+    def _set_hook(self, on):
+        if on == self._hooked:
+            return
+        self._hooked = on
+        if on:
+            self.install_hook(self._on_hook_event)
+            self.hook_installs += 1
+            self._hook_since = time.perf_counter_ns()
+            if self._tid:
+                # 用户一直按着修饰键不动时，超时后也要卸下钩子
+                timer = threading.Timer(CHORD_STEP_TIMEOUT + 0.1, self._post, (WM_HOTKEY_SYNC,))
+                timer.daemon = True
+                timer.start()
+        else:
+            self.remove_hook(self._on_hook_event)
+            self.hook_time_ns += time.perf_counter_ns() - self._hook_since
+
+    def stats(self):
+        return {'registered': len(self._ids), 'failed': self.failed, 'hotkeys': self.hotkeys,
+                'hook_installs': self.hook_installs, 'hook_events': self.hook_events,
+                'hook_active': self._hooked, 'hook_seconds': round(self.hook_time_ns / 1e9, 2)}
+
+
+def synthetic_keystrokes(n, chord_every=200, seed=1):
+    """
+    合成的按键流: 普通打字（偶尔带 Shift），每隔约 chord_every 个键插入一次本程序的组合键
+    （单步或 数字→字母 两步）。返回 [('down'|'up', 键名)]
+    """
+    import random
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz      ,.'
+    chords = [('ctrl+alt+t',), ('ctrl+alt+m',), ('ctrl+alt+3', 'ctrl+alt+p'), ('ctrl+alt+7', 'ctrl+alt+n')]
+    events = []
+    while len(events) < n:
+        if rng.random() < 1.0 / chord_every:
+            events.extend(press_chord(*rng.choice(chords)))
+            continue
+        key = rng.choice(letters)
+        key = 'space' if key == ' ' else key
+        if rng.random() < 0.05:
+            events.extend(press_chord(f'shift+{key}'))
+        else:
+            events.extend((('down', key), ('up', key)))
+    return events[:n]
+
+
+def bench_hotkey_backends(n=200000):
+    """
+    每个按键的开销: 低级钩子后端（每个按键都进入 Python 回调）与原生热键后端
+    （只有已注册的组合键以 WM_HOTKEY 送达，多步组合期间才经过临时钩子）。
+    系统的过滤用按键流模拟: 修饰键状态 + 键 属于已注册集合时才“投递”。
+    """
+    KeyEvent = namedtuple('KeyEvent', 'event_type name')
+    events = [KeyEvent(t, k) for t, k in synthetic_keystrokes(n)]
+    bindings = build_chord_bindings(DEFAULT_HOTKEYS)
+
+    matches = []
+    hook_engine = ChordEngine(on_match=matches.append)
+    hook_engine.compile(bindings)
+    t0 = time.perf_counter_ns()
+    for ev in events:
+        hook_engine.feed(ev.event_type, ev.name)
+    hook_ns = time.perf_counter_ns() - t0
+    hook_matches = len(matches)
+
+    matches.clear()
+    hooked = []
+    native_engine = ChordEngine(on_match=matches.append)
+    native_engine.compile(bindings)
+    source = NativeHotkeySource(native_engine, install_hook=hooked.append, remove_hook=lambda cb: hooked.clear())
+    source._register()
+    combo_ids = {combo: i for i, combo in source._ids.items()}
+    held = set()
+    delivered = 0
+    native_ns = 0  # 只计 Python 侧的处理时间（按键流的过滤在系统中完成）
+    for ev in events:
+        mod = MODIFIER_NAMES.get(ev.name)
+        if mod is not None:
+            (held.add if ev.event_type == 'down' else held.discard)(mod)
+        hotkey_id = combo_ids.get((frozenset(held), ev.name)) if ev.event_type == 'down' else None
+        if not hooked and hotkey_id is None:
+            continue
+        t0 = time.perf_counter_ns()
+        if hooked:
+            delivered += 1
+            source._on_hook_event(ev)
+        if hotkey_id is not None:
+            delivered += 1
+            source._on_hotkey(hotkey_id)
+        native_ns += time.perf_counter_ns() - t0
+
+    print(f"hotkey backends: {len(events)} 个按键事件，其中 {hook_matches} 次组合键")
+    print(f"  低级钩子: 进入 Python {len(events)} 次, 平均 {hook_ns / len(events):.0f} ns/按键"
+          f"（另加每个按键一次跨进程钩子回调与 keyboard 库的事件分发）")
+    print(f"  原生热键: 进入 Python {delivered} 次（{delivered / len(events) * 100:.1f}%）, "
+          f"平均 {native_ns / len(events):.0f} ns/按键, 匹配 {len(matches)} 次, "
+          f"临时钩子安装 {source.hook_installs} 次, 注册 {len(source._ids)} 个组合")
+
+
+def bench_chord_dispatch(rounds=20000):
+    """按键序列回放基准: 打印每个按键事件的分发耗时分布"""
+    engine = ChordEngine(on_match=lambda m: None)
+    engine.compile(build_chord_bindings(DEFAULT_HOTKEYS))
+    script = (press_chord('ctrl+alt+t') + press_chord('ctrl+alt+3', 'ctrl+alt+p')
+              + press_chord('ctrl+alt+7', 'ctrl+alt+m') + [('down', 'a'), ('up', 'a')])
+    matches = 0
+    latencies = []
+    for _ in range(rounds):
+        m, lat = engine.replay(script)
+        matches += len(m)
+        latencies.extend(lat)
+    latencies.sort()
+    n = len(latencies)
+    print(f"chord dispatch: {n} events, {matches} matches")
+    for label, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+        print(f"  {label}: {latencies[int(n * q)] / 1000:.2f} us")
+    print(f"  max: {latencies[-1] / 1000:.2f} us")
+
+
+def bench_action_registry(counts=(10, 100, 1000)):
+    """插件动作登记基准: N 个动作的 manifest 读取 + 组合键编译耗时，以及首次 / 之后解析实现的耗时"""
+    import shutil
+    import tempfile
+    for n in counts:
+        directory = tempfile.mkdtemp(prefix='wm_plugins_')
+        try:
+            per_file = 10
+            for i in range(0, n, per_file):
+                manifest = {'actions': [{'name': f'bench_{j}', 'key': f'f{j % 12 + 1}+{j}', 'label': f'测试 {j}',
+                                         'target': f'wm_bench_plugin_{j // per_file}:run'}
+                                        for j in range(i, min(n, i + per_file))]}
+                with open(os.path.join(directory, f'plugin_{i // per_file}.json'), 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f)
+            with open(os.path.join(directory, 'wm_bench_plugin_0.py'), 'w', encoding='utf-8') as f:
+                f.write("def run(controller, hwnd):\n    pass\n")
+            registry = ActionRegistry()
+            t0 = time.perf_counter()
+            registry.discover(directory)
+            discover = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            ChordEngine(on_match=lambda m: None).compile(build_chord_bindings({}, registry))
+            compile_ = time.perf_counter() - t0
+            imported = sum(1 for name in sys.modules if name.startswith('wm_bench_plugin_'))
+            t0 = time.perf_counter_ns()
+            registry.resolve('bench_0')
+            first = time.perf_counter_ns() - t0
+            t0 = time.perf_counter_ns()
+            registry.resolve('bench_0')
+            cached = time.perf_counter_ns() - t0
+            print(f"{n:5d} 个动作: 读取 manifest {discover * 1000:.2f}ms, 编译组合键 {compile_ * 1000:.2f}ms, "
+                  f"启动时导入的插件模块 {imported} 个; 首次解析 {first / 1000:.0f}us, 再次 {cached / 1000:.1f}us")
+        finally:
+            sys.modules.pop('wm_bench_plugin_0', None)
+            if directory in sys.path:
+                sys.path.remove(directory)
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+# ---------------------------
+# Layout profiles: capture, match and batched restore
+# ---------------------------
+
+def _show_kind(show_cmd):
+    if show_cmd in (SW_SHOWMINIMIZED, SW_MINIMIZE, SW_SHOWMINNOACTIVE):
+        return 'min'
+    if show_cmd == SW_SHOWMAXIMIZED:
+        return 'max'
+    return 'normal'
+
+
+def capture_window_layout(hwnd, window_state):
+    """记录单个窗口的布局: 身份（exe/类名/标题）+ 位置、显示状态、置顶、透明度、点击穿透"""
+    placement = get_window_placement(hwnd)
+    if placement is None:
+        return None
+    pid = process_index.pid_of(hwnd) or get_window_pid(hwnd)
+    state = window_state.transparent(hwnd)
+    return {
+        'exe': process_index.exe_name(pid).lower(),
+        'class': get_window_class(hwnd),
+        'title': hwnd_to_title(hwnd),
+        'hwnd': hwnd,
+        'show': placement[1],
+        'normal': list(placement[4]),
+        'rect': list(get_window_rect(hwnd) or placement[4]),
+        'topmost': is_topmost(hwnd),
+        'alpha': state.alpha if state else None,
+        'clickthrough': bool(state and state.clickthrough),
+    }
+
+
+def match_profile_windows(entries, candidates):
+    """
+    把方案中的条目匹配到当前窗口，每个窗口最多匹配一次:
+    1) 句柄仍有效且 exe/类名一致; 2) exe + 类名 + 标题完全一致; 3) exe + 类名相同、标题最相似。
+    candidates: [{'hwnd', 'exe', 'class', 'title'}]; 返回 [(entry, hwnd)]
+    """
+    by_hwnd = {c['hwnd']: c for c in candidates}
+    used = set()
+    pairs = []
+    pending = []
+    for e in entries:
+        c = by_hwnd.get(e.get('hwnd'))
+        if c is not None and c['exe'] == e['exe'] and c['class'] == e['class']:
+            pairs.append((e, c['hwnd']))
+            used.add(c['hwnd'])
+        else:
+            pending.append(e)
+    by_key = {}
+    for c in candidates:
+        if c['hwnd'] not in used:
+            by_key.setdefault((c['exe'], c['class']), []).append(c)
+    fuzzy = []
+    for e in pending:
+        for c in by_key.get((e['exe'], e['class']), ()):
+            if c['hwnd'] not in used and c['title'] == e['title']:
+                pairs.append((e, c['hwnd']))
+                used.add(c['hwnd'])
+                break
+        else:
+            fuzzy.append(e)
+    for e in fuzzy:
+        best, best_ratio = None, -1.0
+        for c in by_key.get((e['exe'], e['class']), ()):
+            if c['hwnd'] in used:
+                continue
+            ratio = SequenceMatcher(None, e['title'], c['title']).quick_ratio()
+            if ratio > best_ratio:
+                best, best_ratio = c, ratio
+        if best is not None:
+            pairs.append((e, best['hwnd']))
+            used.add(best['hwnd'])
+    return pairs
+
+
+# ---------------------------
+# Window rules: declarative auto-actions for new windows
+# ---------------------------
+
+WindowRule = namedtuple('WindowRule', 'order name exe cls title actions')
+
+RULE_ACTIONS = ('group', 'topmost', 'alpha', 'clickthrough', 'show_only')
+# 按编号引用分组的写法（\1、(?(1)...)）: 合并成交替正则后编号会错位，编译能通过但匹配结果不对
+_GROUP_NUMBER_REF = re.compile(r'\\[1-9]|\(\?\(\d')
+
+
+class RuleIndex:
+    """
+    wm_config.json 中 "rules" 编译后的索引。每条规则可指定 exe（文件名，不区分大小写）、
+    class（窗口类名）和 title（正则），未指定的条件视为任意。
+    查找时先按 exe、class 做哈希查找，只检查这两个桶里的规则；只有 title 条件的规则
+    合并成一个交替正则先整体过滤，整体不匹配（最常见的情况）时一次 search 就结束。
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []
+        self.by_exe = {}
+        self.by_class = {}
+        self.match_all = []
+        self.by_title = []
+        self.title_any = None
+        for i, r in enumerate(rules):
+            try:
+                title = re.compile(r['title'], re.IGNORECASE) if r.get('title') else None
+            except re.error as e:
+                log_error(f"rule {r.get('name', i + 1)}", e)
+                continue
+            actions = {k: v for k, v in r.get('actions', {}).items() if k in RULE_ACTIONS}
+            rule = WindowRule(i, r.get('name') or f"规则 {i + 1}", (r.get('exe') or '').lower(),
+                              r.get('class') or '', title, actions)
+            self.rules.append(rule)
+            if rule.exe:
+                self.by_exe.setdefault(rule.exe, []).append(rule)
+            elif rule.cls:
+                self.by_class.setdefault(rule.cls, []).append(rule)
+            elif title:
+                self.by_title.append(rule)
+            else:
+                self.match_all.append(rule)
+        if self.by_title and not any(_GROUP_NUMBER_REF.search(r.title.pattern) for r in self.by_title):
+            try:
+                self.title_any = re.compile("|".join(f"(?:{r.title.pattern})" for r in self.by_title),
+                                            re.IGNORECASE)
+            except re.error:
+                self.title_any = None  # 个别正则无法合并（如重名的命名分组）: 逐条检查
+
+    def match(self, exe, cls, title):
+        """返回匹配的规则（按配置顺序）"""
+        out = []
+        for rule in self.by_exe.get(exe.lower(), ()):
+            if (not rule.cls or rule.cls == cls) and (rule.title is None or rule.title.search(title)):
+                out.append(rule)
+        for rule in self.by_class.get(cls, ()):
+            if rule.title is None or rule.title.search(title):
+                out.append(rule)
+        if self.by_title and (self.title_any is None or self.title_any.search(title)):
+            out.extend(rule for rule in self.by_title if rule.title.search(title))
+        out.extend(self.match_all)
+        if len(out) > 1:
+            out.sort(key=lambda r: r.order)
+        return out
+
+    def __len__(self):
+        return len(self.rules)
+
+
+def merge_rule_actions(rules):
+    """多条规则同时匹配时按顺序合并动作，后面的覆盖前面的"""
+    actions = {}
+    for rule in rules:
+        actions.update(rule.actions)
+    return actions
+
+
+def bench_rule_matching(counts=(50, 200, 1000), windows=20000):
+    """规则匹配基准: 索引查找与逐条检查的单个窗口耗时"""
+    import random
+    rng = random.Random(7)
+    for n in counts:
+        rules = []
+        for i in range(n):
+            kind = i % 4
+            if kind == 0:
+                rules.append({'exe': f"app{i}.exe", 'actions': {'topmost': True}})
+            elif kind == 1:
+                rules.append({'exe': f"app{i}.exe", 'title': rf"^Report \d+ - {i}$", 'actions': {'alpha': 200}})
+            elif kind == 2:
+                rules.append({'class': f"Class{i}", 'actions': {'group': 'dash'}})
+            else:
+                rules.append({'title': rf"dashboard-{i}\b", 'actions': {'clickthrough': True}})
+        index = RuleIndex(rules)
+        samples = []
+        for _ in range(windows):
+            i = rng.randrange(n * 2)  # 约一半的窗口不匹配任何规则
+            samples.append((f"app{i}.exe", f"Class{i}", f"Report {i} - {i}" if i % 3 else f"dashboard-{i} live"))
+        t0 = time.perf_counter_ns()
+        hits = sum(1 for exe, cls, title in samples if index.match(exe, cls, title))
+        indexed = (time.perf_counter_ns() - t0) / windows
+
+        def linear(exe, cls, title):
+            return [r for r in index.rules
+                    if (not r.exe or r.exe == exe.lower()) and (not r.cls or r.cls == cls)
+                    and (r.title is None or r.title.search(title))]
+        sample = samples[:2000]
+        t0 = time.perf_counter_ns()
+        for exe, cls, title in sample:
+            linear(exe, cls, title)
+        naive = (time.perf_counter_ns() - t0) / len(sample)
+        for exe, cls, title in sample[:500]:
+            assert index.match(exe, cls, title) == linear(exe, cls, title)
+        print(f"rules n={n}: {indexed / 1000:.2f} us/window ({1e9 / indexed:,.0f} windows/s, {hits} hits) "
+              f"vs linear {naive / 1000:.1f} us/window")
+
+
+# ---------------------------
+# Pick mode: grid-bucket rect index for cursor hit-testing
+# ---------------------------
+
+class WindowRectIndex:
+    """
+    屏幕按 2^cell_shift 像素划分格子，每个格子记录与之相交的窗口（按 Z 序，最上层在前）。
+    lookup(x, y) 只取光标所在格子逐个判断，第一个包含该点的就是最上层窗口；
+    某格被整个盖住后不再接收更下层的窗口，因此格子内的列表长度只取决于可见的窗口边缘数。
+    items 需按自顶向下的 Z 序给出；bounds 用于裁掉屏幕外的部分（如最小化到 -32000 的窗口）。
+    """
+
+    def __init__(self, items=(), bounds=None, cell_shift=7):
+        self.shift = cell_shift
+        self.bounds = bounds
+        self.cells = {}
+        self.covered = set()
+        self.hwnds = []
+        self.rects = []
+        self.z_of = {}
+        for hwnd, rect in items:
+            self.add(hwnd, rect)
+
+    def add(self, hwnd, rect):
+        left, top, right, bottom = rect
+        if self.bounds:
+            bl, bt, br, bb = self.bounds
+            left, top, right, bottom = max(left, bl), max(top, bt), min(right, br), min(bottom, bb)
+        if right <= left or bottom <= top or hwnd in self.z_of:
+            return
+        z = len(self.hwnds)
+        self.hwnds.append(hwnd)
+        self.rects.append(rect)
+        self.z_of[hwnd] = z
+        s = self.shift
+        size = 1 << s
+        cells = self.cells
+        covered = self.covered
+        for cy in range(top >> s, ((bottom - 1) >> s) + 1):
+            full_y = top <= cy << s and (cy + 1) << s <= bottom
+            for cx in range(left >> s, ((right - 1) >> s) + 1):
+                key = (cx, cy)
+                if key in covered:
+                    continue  # 整格已被更上层的窗口盖住，下面的窗口永远命中不到
+                bucket = cells.get(key)
+                if bucket is None:
+                    cells[key] = [z]
+                else:
+                    bucket.append(z)
+                if full_y and left <= cx * size and (cx + 1) * size <= right:
+                    covered.add(key)
+
+    def lookup(self, x, y):
+        bucket = self.cells.get((x >> self.shift, y >> self.shift))
+        if bucket:
+            rects = self.rects
+            for z in bucket:
+                left, top, right, bottom = rects[z]
+                if left <= x < right and top <= y < bottom:
+                    return self.hwnds[z]
+        return 0
+
+    def rect_of(self, hwnd):
+        z = self.z_of.get(hwnd)
+        return self.rects[z] if z is not None else None
+
+    def __len__(self):
+        return len(self.hwnds)
+
+
+def bench_pick_lookup(counts=(1000, 5000, 20000), points=200000):
+    """拾取模式命中测试基准: 随机生成窗口（少量最大化），比较格子索引与线性扫描的单次查找耗时"""
+    import random
+    rng = random.Random(1)
+    width, height = 3840, 2160
+    for n in counts:
+        items = []
+        for i in range(n):
+            if rng.random() < 0.02:
+                rect = (0, 0, width, height - 40)
+            else:
+                w, h = rng.randint(200, 1600), rng.randint(150, 1000)
+                x, y = rng.randint(-100, width - 100), rng.randint(-50, height - 100)
+                rect = (x, y, x + w, y + h)
+            items.append((i + 1, rect))
+        t0 = time.perf_counter()
+        index = WindowRectIndex(items, bounds=(0, 0, width, height))
+        build = time.perf_counter() - t0
+        pts = [(rng.randrange(width), rng.randrange(height)) for _ in range(points)]
+        lookup = index.lookup
+        t0 = time.perf_counter_ns()
+        for x, y in pts:
+            lookup(x, y)
+        grid_ns = (time.perf_counter_ns() - t0) / points
+        # 线性扫描对照（只取一小部分点，否则太慢）
+        sample = pts[:2000]
+        t0 = time.perf_counter_ns()
+        for x, y in sample:
+            for hwnd, (left, top, right, bottom) in items:
+                if left <= x < right and top <= y < bottom:
+                    break
+        linear_ns = (time.perf_counter_ns() - t0) / len(sample)
+        # 与线性扫描结果一致性检查
+        for x, y in sample[:200]:
+            expect = next((h for h, (l, t, r, b) in items if l <= x < r and t <= y < b), 0)
+            assert lookup(x, y) == expect
+        print(f"pick n={n}: build {build * 1000:.1f} ms ({len(index.cells)} cells); "
+              f"lookup {grid_ns / 1000:.2f} us vs linear {linear_ns / 1000:.1f} us "
+              f"(budget at 240 Hz: {1e6 / 240:.0f} us)")
+
+
+# ---------------------------
+# Overlay: a small always-on-top PyQt window placed over target window
+# ---------------------------
+
+class OverlayWindow(QtWidgets.QWidget):
+    """
+    Small overlay window that sits on top of target hwnd.
+    Contains a small button; clicking expands a toolbar with slider and checkbox.
     """
 
     def __init__(self, target_hwnd, controller):
@@ -305,27 +4463,672 @@ class OverlayWindow(QtWidgets.QWidget):
             self.toolbar.show()
             self.adjustSize()
 
-    def on_slider(self, val):
-        self.controller.set_transparent_alpha(val)
+    def on_slider(self, val):
+        self.controller.set_transparent_alpha(val)
+
+    def on_checkbox(self, state):
+        # state: 2 checked => interactive (not clickthrough)
+        interactive = (state == QtCore.Qt.Checked)
+        self.controller.set_clickthrough(not interactive)
+
+    def update_position(self):
+        if not is_window(self.target_hwnd):
+            # 目标已关闭（销毁事件可能丢失）: 经 Controller 清理记录并关闭自己
+            self.poll_timer.stop()
+            self.controller.on_window_destroyed(self.target_hwnd, EVENT_OBJECT_DESTROY)
+            return
+        rect = get_window_rect(self.target_hwnd)
+        if not rect:
+            return
+        left, top, right, bottom = rect
+        w = right - left
+        # place overlay top-center of target window
+        self.move(left + max(0, w // 2 - self.width() // 2), top + 6)
+        # ensure always-on-top
+        self.raise_()
+
+
+class PickOverlay(QtWidgets.QWidget):
+    """
+    拾取模式: 覆盖整个虚拟桌面的近乎透明的窗口，高亮光标下的顶层窗口。
+    进入时枚举一次窗口建立 WindowRectIndex，之后每次鼠标移动只做一次格子查找，
+    并且只在高亮目标变化时重绘新旧两个矩形区域。
+    左键: 弹出操作菜单（加入分组 / 置顶 / 半透明）；右键或 Esc: 退出。
+    """
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, model, controller, add_to_group=None):
+        super().__init__(flags=QtCore.Qt.FramelessWindowHint | QtCore.Qt.WindowStaysOnTopHint | QtCore.Qt.Tool)
+        self.setAttribute(QtCore.Qt.WA_TranslucentBackground)
+        self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        self.setMouseTracking(True)
+        self.setCursor(QtCore.Qt.CrossCursor)
+        self.model = model
+        self.controller = controller
+        self.add_to_group = add_to_group or model.add_to_group
+        geo = QtCore.QRect()
+        for screen in QtWidgets.QApplication.screens():
+            geo = geo.united(screen.geometry())
+        self.setGeometry(geo)
+        self.origin = (geo.left(), geo.top())
+        self.index = WindowRectIndex(enum_pick_candidates(),
+                                     bounds=(geo.left(), geo.top(), geo.right() + 1, geo.bottom() + 1))
+        self.hover = 0
+        self.hover_rect = None
+        self.hover_title = ""
+
+    def start(self):
+        self.show()
+        self.activateWindow()
+        self.setFocus()
+        self._hover_at(QtGui.QCursor.pos())
+
+    def _local_rect(self, rect):
+        left, top, right, bottom = rect
+        ox, oy = self.origin
+        return QtCore.QRect(left - ox, top - oy, right - left, bottom - top)
+
+    def _hover_at(self, pos):
+        hwnd = self.index.lookup(pos.x(), pos.y())
+        if hwnd == self.hover:
+            return
+        old = self.hover_rect
+        self.hover = hwnd
+        self.hover_rect = self._local_rect(self.index.rect_of(hwnd)) if hwnd else None
+        self.hover_title = hwnd_to_title(hwnd) if hwnd else ""
+        for r in (old, self.hover_rect):
+            if r is not None:
+                self.update(r.adjusted(-3, -3, 3, 3))
+
+    def mouseMoveEvent(self, event):
+        self._hover_at(event.globalPos())
+
+    def mousePressEvent(self, event):
+        if event.button() == QtCore.Qt.RightButton:
+            self.close()
+        elif event.button() == QtCore.Qt.LeftButton and self.hover:
+            self._show_menu(self.hover, event.globalPos())
+
+    def keyPressEvent(self, event):
+        if event.key() == QtCore.Qt.Key_Escape:
+            self.close()
+
+    def _show_menu(self, hwnd, pos):
+        menu = QtWidgets.QMenu(self)
+        header = menu.addAction(icon_cache.icon_for_hwnd(hwnd), self.hover_title or str(hwnd))
+        header.setEnabled(False)
+        menu.addSeparator()
+        group_menu = menu.addMenu("加入分组")
+        for gid, depth in self.model.group_tree():
+            digit = self.model.shortcut_of(gid)
+            act = group_menu.addAction("    " * depth + self.model.group_names.get(gid, f"组 {gid}")
+                                       + (f"\t{digit}" if digit is not None else ""))
+            act.setData(('group', gid))
+        act = menu.addAction("取消置顶" if is_topmost(hwnd) else "置顶")
+        act.setData(('topmost', None))
+        act = menu.addAction("取消半透明" if self.controller.window_state.transparent(hwnd) else "半透明")
+        act.setData(('transparent', None))
+        chosen = menu.exec_(pos)
+        if chosen is None:
+            return  # 菜单被取消: 继续拾取
+        if chosen.data() is None:
+            return
+        kind, gid = chosen.data()
+        self.close()
+        if kind == 'group':
+            self.add_to_group(gid, hwnd)
+            self.controller.ui.post('message', (f"已将「{self.hover_title}」加入 {self.model.group_label(gid)}",
+                                                hwnd))
+        elif kind == 'topmost':
+            self.controller.toggle_topmost(hwnd)
+        else:
+            self.controller.toggle_transparent(hwnd)
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        # alpha=1 的底色: 肉眼不可见，但能接住鼠标点击
+        painter.fillRect(event.rect(), QtGui.QColor(0, 0, 0, 1))
+        if self.hover_rect is not None and self.hover_rect.intersects(event.rect()):
+            r = self.hover_rect
+            painter.fillRect(r, QtGui.QColor(0, 120, 215, 40))
+            painter.setPen(QtGui.QPen(QtGui.QColor(0, 120, 215), 3))
+            painter.drawRect(r.adjusted(1, 1, -2, -2))
+            title = self.hover_title or str(self.hover)
+            metrics = painter.fontMetrics()
+            label = QtCore.QRect(r.left() + 4, r.top() + 4,
+                                 min(metrics.horizontalAdvance(title) + 16, max(r.width() - 8, 0)),
+                                 metrics.height() + 8)
+            painter.fillRect(label, QtGui.QColor(0, 120, 215, 220))
+            painter.setPen(QtCore.Qt.white)
+            painter.drawText(label, QtCore.Qt.AlignCenter,
+                             metrics.elidedText(title, QtCore.Qt.ElideRight, label.width() - 8))
+        painter.end()
+
+    def closeEvent(self, event):
+        self.finished.emit()
+        super().closeEvent(event)
+
+
+class DimOverlay(QtWidgets.QWidget):
+    """
+    仅显示的“变暗”模式: 每个显示器一个置顶、不接收输入的半透明黑色窗口，
+    窗口区域（setMask）挖掉目标窗口所在的矩形，目标窗口照常可见可操作，其它窗口原地不动。
+    进入 / 退出只是显示 / 隐藏这几个窗口；目标窗口移动时只重设遮罩区域。
+    """
+
+    def __init__(self, screen, opacity=0.6):
+        super().__init__(flags=QtCore.Qt.FramelessWindowHint | QtCore.Qt.WindowStaysOnTopHint | QtCore.Qt.Tool
+                         | QtCore.Qt.WindowTransparentForInput | QtCore.Qt.WindowDoesNotAcceptFocus)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.setAttribute(QtCore.Qt.WA_ShowWithoutActivating)
+        self.screen_ref = screen
+        self.setGeometry(screen.geometry())
+        self.setWindowOpacity(opacity)
+
+    def set_cutouts(self, rects):
+        """rects: 目标窗口的屏幕矩形（物理像素）；整个显示器都被挖空时隐藏"""
+        geo = self.screen_ref.geometry()
+        if self.geometry() != geo:
+            self.setGeometry(geo)
+        dpr = self.screen_ref.devicePixelRatio() or 1.0
+        region = QtGui.QRegion(0, 0, geo.width(), geo.height())
+        for left, top, right, bottom in rects:
+            x, y = int((left - geo.left()) / dpr), int((top - geo.top()) / dpr)
+            w, h = int((right - left) / dpr) + 1, int((bottom - top) / dpr) + 1
+            region = region.subtracted(QtGui.QRegion(x, y, w, h))
+        if region.isEmpty():
+            self.hide()
+            return
+        self.setMask(region)
+        if not self.isVisible():
+            self.show()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(event.rect(), QtCore.Qt.black)
+        painter.end()
+
+
+# ---------------------------
+# UI event bus: cross-thread, coalescing dispatch onto the Qt thread
+# ---------------------------
+
+class UiEventBus(QtCore.QObject):
+    """
+    Producers on any thread call post(kind, payload); it appends to a deque and, only
+    if no drain is already pending, emits one queued wake-up signal. The Qt thread then
+    drains everything queued so far in a single pass, grouping events by kind, so a
+    group action that produces N toasts and N overlays costs one event-loop round.
+
+    Handlers are registered per kind with a coalescing mode:
+      'each' - handler(payload) for every event, in order
+      'last' - handler(payload) once with the newest payload
+      'all'  - handler([payloads]) once with every payload of the drain
+    """
+    _wake = QtCore.pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self._queue = deque()
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._wake.connect(self._drain, QtCore.Qt.QueuedConnection)
+        # stats
+        self.posted = 0
+        self.drains = 0
+        self.max_depth = 0
+        self.latency_total_ns = 0
+        self.latency_max_ns = 0
+
+    def register(self, kind, handler, coalesce='each'):
+        self._handlers[kind] = (handler, coalesce)
+
+    def post(self, kind, payload=None):
+        self._queue.append((kind, payload, time.perf_counter_ns()))
+        if self._scheduled:
+            return
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._wake.emit()
+
+    @recorder.span('ui:drain')
+    def _drain(self):
+        with self._lock:
+            # 先清标记再取队列: 之后入队的事件会触发下一次 drain
+            self._scheduled = False
+        queue = self._queue
+        depth = len(queue)
+        if not depth:
+            return
+        batches = {}
+        now = time.perf_counter_ns()
+        for _ in range(depth):
+            kind, payload, t = queue.popleft()
+            batches.setdefault(kind, []).append(payload)
+            lat = now - t
+            self.latency_total_ns += lat
+            if lat > self.latency_max_ns:
+                self.latency_max_ns = lat
+        self.posted += depth
+        self.drains += 1
+        if depth > self.max_depth:
+            self.max_depth = depth
+        for kind, payloads in batches.items():
+            handler, coalesce = self._handlers.get(kind, (None, None))
+            if handler is None:
+                continue
+            try:
+                if coalesce == 'all':
+                    handler(payloads)
+                elif coalesce == 'last':
+                    handler(payloads[-1])
+                else:
+                    for payload in payloads:
+                        handler(payload)
+            except Exception as e:
+                log_error(f"ui handler {kind}", e)
+
+    def stats(self):
+        return {
+            'queued': len(self._queue),
+            'posted': self.posted,
+            'drains': self.drains,
+            'max_depth': self.max_depth,
+            'avg_latency_us': round(self.latency_total_ns / self.posted / 1000, 1) if self.posted else 0,
+            'max_latency_us': round(self.latency_max_ns / 1000, 1),
+        }
+
+
+# ---------------------------
+# Event stream: NDJSON subscription endpoint for external tools
+# ---------------------------
+
+STREAM_SOCKET = 'wm_events.sock'             # POSIX: 配置目录下的 Unix socket
+STREAM_PIPE = r'\\.\pipe\WindowManagerEvents'  # Windows: 命名管道
+STREAM_BUFFER = 1024  # 每个订阅者最多缓存的事件行数，超出后丢弃并计数
+
+
+class StreamSubscriber:
+    """
+    一个已连接的客户端。发布方只在锁内 append 到有界缓冲区（满了就丢弃并计数），
+    由该订阅者自己的线程负责阻塞写出，慢客户端不会拖慢热键 / 事件线程。
+    """
+
+    def __init__(self, send, types=None, groups=None, capacity=STREAM_BUFFER):
+        self.send = send
+        self.types = types    # None 表示全部类型
+        self.groups = groups  # None 表示不按分组过滤
+        self.capacity = capacity
+        self.buffer = deque()
+        self.dropped = 0
+        self.sent = 0
+        self.closed = False
+        self._reported = 0
+        self._cond = threading.Condition()
+
+    def wants(self, event):
+        if self.types is not None and event['type'] not in self.types:
+            return False
+        return self.groups is None or not self.groups.isdisjoint(event.get('groups', ()))
+
+    def offer(self, line):
+        with self._cond:
+            if len(self.buffer) >= self.capacity:
+                self.dropped += 1
+                return
+            self.buffer.append(line)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def run(self):
+        """写出线程: 每次把缓冲区里的全部行一起写出；有丢弃时先写一行 dropped 通知"""
+        while True:
+            with self._cond:
+                while not self.buffer and not self.closed:
+                    self._cond.wait()
+                if self.closed:
+                    return
+                lines = list(self.buffer)
+                self.buffer.clear()
+                dropped, self._reported = self.dropped - self._reported, self.dropped
+            if dropped:
+                notice = {'type': 'dropped', 'count': dropped, 'total': self.dropped}
+                lines.insert(0, (json.dumps(notice) + '\n').encode('utf-8'))
+            try:
+                self.send(b''.join(lines))
+            except (OSError, EOFError):
+                return
+            self.sent += len(lines)
+
+    def stats(self):
+        return {'types': sorted(self.types) if self.types else None,
+                'groups': sorted(self.groups) if self.groups else None,
+                'queued': len(self.buffer), 'sent': self.sent, 'dropped': self.dropped}
+
+
+class EventStream:
+    """
+    本地订阅端点: 每行一个 JSON 事件（NDJSON）。客户端连接后先发送一行过滤条件，
+    如 {"types": ["topmost", "group"], "groups": [3]}（空对象或 1 秒内不发送表示全部）。
+    事件: group / hotkeys（Model 改动）、topmost / transparent / show_only（Controller 操作）、
+    window（show / close / title / foreground），都带 seq（递增，可据此发现丢失）和 ts。
+    没有订阅者时 publish 只是一次列表判空。
+    """
+
+    def __init__(self):
+        self.subscribers = []  # 写时复制: 发布方不加锁遍历
+        self.address = None
+        self.published = 0
+        self.groups_of = lambda hwnd: ()  # hwnd -> 所在分组（由 Controller 设置）
+        self._listener = None
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, address=None):
+        if sys.platform == 'win32':
+            from multiprocessing.connection import Listener
+            self.address = address or STREAM_PIPE
+            self._listener = Listener(self.address, family='AF_PIPE')
+        else:
+            import socket
+            self.address = address or config_path(STREAM_SOCKET)
+            try:
+                os.unlink(self.address)  # 上次异常退出遗留的 socket 文件
+            except FileNotFoundError:
+                pass
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            # socket 文件在 bind 时就以 0600 创建，不留下先创建后 chmod 之间可被他人连接的空档
+            old_mask = os.umask(0o177)
+            try:
+                sock.bind(self.address)
+            finally:
+                os.umask(old_mask)
+            sock.listen(8)
+            self._listener = sock
+        threading.Thread(target=self._serve, name='wm-event-stream', daemon=True).start()
+        print(f"[+] 事件订阅端点: {self.address}")
+
+    def stop(self):
+        listener, self._listener = self._listener, None
+        if listener is None:
+            return
+        with self._lock:
+            subscribers, self.subscribers = self.subscribers, []
+        for sub in subscribers:
+            sub.close()
+        try:
+            listener.close()
+        except OSError:
+            pass
+        if sys.platform != 'win32':
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+    def _serve(self):
+        listener = self._listener
+        delay = 0.05
+        while self._listener is listener:
+            try:
+                conn = listener.accept()
+            except (OSError, AttributeError) as e:
+                if self._listener is not listener:
+                    break  # stop() 关闭了监听端
+                # 其他错误（如文件描述符耗尽）: 记录后退避，避免空转占满 CPU
+                log_error("event_stream.accept", e)
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+                continue
+            delay = 0.05
+            if isinstance(conn, tuple):  # socket.accept() -> (conn, address)
+                conn = conn[0]
+            threading.Thread(target=self._attach, args=(conn,), daemon=True).start()
+
+    def _read_filter(self, conn):
+        if sys.platform == 'win32':
+            return conn.recv_bytes() if conn.poll(1.0) else b''
+        conn.settimeout(1.0)
+        data = b''
+        try:
+            while b'\n' not in data:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        except OSError:
+            pass
+        conn.settimeout(None)
+        return data.split(b'\n', 1)[0]
 
-    def on_checkbox(self, state):
-        # state: 2 checked => interactive (not clickthrough)
-        interactive = (state == QtCore.Qt.Checked)
-        self.controller.set_clickthrough(not interactive)
+    def _attach(self, conn):
+        """连接线程: 读取过滤条件后成为该订阅者的写出线程"""
+        try:
+            spec = json.loads(self._read_filter(conn) or b'{}')
+        except (ValueError, OSError, EOFError):
+            spec = {}
+        if not isinstance(spec, dict):
+            spec = {}
+        types = set(spec['types']) if spec.get('types') else None
+        groups = {int(g) for g in spec['groups']} if spec.get('groups') else None
+        send = conn.send_bytes if sys.platform == 'win32' else conn.sendall
+        sub = StreamSubscriber(send, types, groups)
+        with self._lock:
+            self.subscribers = self.subscribers + [sub]
+        try:
+            sub.run()
+        finally:
+            with self._lock:
+                self.subscribers = [s for s in self.subscribers if s is not sub]
+            try:
+                conn.close()
+            except OSError:
+                pass
 
-    def update_position(self):
-        if not is_window(self.target_hwnd):
-            self.close()
+    def publish(self, kind, **fields):
+        """任意线程调用；只编码一次，按订阅者的过滤条件分发"""
+        subscribers = self.subscribers
+        if not subscribers:
             return
-        rect = get_window_rect(self.target_hwnd)
-        if not rect:
+        fields['type'] = kind
+        fields['seq'] = next(self._seq)
+        fields['ts'] = round(time.time(), 3)
+        if 'groups' not in fields and 'hwnd' in fields:
+            fields['groups'] = list(self.groups_of(fields['hwnd']))
+        self.published += 1
+        line = None
+        for sub in subscribers:
+            if sub.wants(fields):
+                if line is None:
+                    line = (json.dumps(fields, ensure_ascii=False) + '\n').encode('utf-8')
+                sub.offer(line)
+
+    def model_changed(self, old, new):
+        """Model 发布新快照: 每个改动过的分组一条 group 事件"""
+        if not self.subscribers:
             return
-        left, top, right, bottom = rect
-        w = right - left
-        # place overlay top-center of target window
-        self.move(left + max(0, w // 2 - self.width() // 2), top + 6)
-        # ensure always-on-top
-        self.raise_()
+        if old.hotkeys is not new.hotkeys:
+            self.publish('hotkeys', hotkeys=dict(new.hotkeys))
+        changed = set()
+        for field in ('groups', 'group_names', 'group_parents'):
+            a, b = getattr(old, field), getattr(new, field)
+            if a is not b:
+                changed.update(k for k in a.keys() | b.keys() if a.get(k, ABSENT) is not b.get(k, ABSENT))
+        for gid in sorted(changed):
+            if gid in new.groups:
+                self.publish('group', group=gid, groups=[gid], name=new.group_names.get(gid),
+                             parent=new.group_parents.get(gid), members=list(new.groups[gid]))
+            else:
+                self.publish('group', group=gid, groups=[gid], removed=True)
+
+    def stats(self):
+        return {'address': self.address, 'published': self.published,
+                'subscribers': [s.stats() for s in self.subscribers]}
+
+
+event_stream = EventStream()
+
+
+# ---------------------------
+# Process icons: background extraction, LRU + on-disk cache
+# ---------------------------
+
+ICON_ROLE = QtCore.Qt.UserRole + 1  # 列表项上记录 exe 路径，图标就绪后据此刷新
+
+
+class IconCache(QtCore.QObject):
+    """
+    每个可执行文件一个图标（不是每个窗口）。
+    icon_for_hwnd / icon_for_path 在 UI 线程调用，立即返回：命中内存 LRU 就给真图标，
+    否则给占位图标并把路径交给后台线程。后台线程先查磁盘缓存（按 路径 + mtime 命名的 PNG），
+    没有才从 exe 中提取并写回磁盘；结果成批回到 UI 线程，再通过 icons_ready(路径集合) 通知列表刷新。
+    """
+    icons_ready = QtCore.pyqtSignal(object)
+    _loaded = QtCore.pyqtSignal(object)
+
+    def __init__(self, capacity=512, size=32):
+        super().__init__()
+        self.capacity = capacity
+        self.size = size
+        self._icons = OrderedDict()  # path -> QIcon（LRU 顺序）
+        self._pending = set()
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._placeholder = None
+        self._loaded.connect(self._on_loaded, QtCore.Qt.QueuedConnection)
+        self.hits = self.misses = self.disk_hits = self.extracted = 0
+
+    def cache_dir(self):
+        return config_path('wm_icons')
+
+    def placeholder(self):
+        if self._placeholder is None:
+            pm = QtGui.QPixmap(self.size, self.size)
+            pm.fill(QtCore.Qt.transparent)
+            painter = QtGui.QPainter(pm)
+            painter.setRenderHint(QtGui.QPainter.Antialiasing)
+            painter.setBrush(QtGui.QColor(90, 90, 96))
+            painter.setPen(QtCore.Qt.NoPen)
+            m = self.size // 8
+            painter.drawRoundedRect(m, m, self.size - 2 * m, self.size - 2 * m, m, m)
+            painter.end()
+            self._placeholder = QtGui.QIcon(pm)
+        return self._placeholder
+
+    def exe_for_hwnd(self, hwnd):
+        pid = process_index.pid_of(hwnd) or get_window_pid(hwnd)
+        return process_index.exe_path(pid) if pid and pid > 0 else ""
+
+    def icon_for_hwnd(self, hwnd):
+        return self.icon_for_path(self.exe_for_hwnd(hwnd))
+
+    def icon_for_path(self, path):
+        if not path:
+            return self.placeholder()
+        icon = self._icons.get(path)
+        if icon is not None:
+            self._icons.move_to_end(path)
+            self.hits += 1
+            return icon
+        self.misses += 1
+        if path not in self._pending:
+            self._pending.add(path)
+            self._jobs.put(path)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="wm-icons", daemon=True)
+                self._thread.start()
+        return self.placeholder()
+
+    def _disk_file(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = 0
+        key = hashlib.sha1(f"{os.path.normcase(path)}|{mtime}".encode('utf-8')).hexdigest()[:24]
+        return os.path.join(self.cache_dir(), key + ".png")
+
+    def _load(self, path):
+        """图标线程: 磁盘缓存 → 提取；返回 QImage 或 None（无图标）"""
+        file = self._disk_file(path)
+        if os.path.exists(file):
+            self.disk_hits += 1
+            if os.path.getsize(file) == 0:
+                return None  # 之前提取过但没有图标，不再重试
+            img = QtGui.QImage(file)
+            return None if img.isNull() else img
+        self.extracted += 1
+        res = extract_exe_icon(path, self.size)
+        img = None
+        if res:
+            w, h, pixels = res
+            img = QtGui.QImage(pixels, w, h, w * 4, QtGui.QImage.Format_ARGB32).copy()
+        try:
+            os.makedirs(self.cache_dir(), exist_ok=True)
+            if img is not None:
+                img.save(file, "PNG")
+            else:
+                open(file, 'wb').close()
+        except OSError as e:
+            log_error("icon cache write", e)
+        return img
+
+    def _run(self):
+        batch = []
+        while True:
+            path = self._jobs.get()
+            try:
+                batch.append((path, self._load(path)))
+            except Exception as e:
+                log_error("icon extract", e)
+                batch.append((path, None))
+            # 队列空了或攒够一批再回到 UI 线程，避免每个图标一次事件
+            if self._jobs.empty() or len(batch) >= 32:
+                self._loaded.emit(batch)
+                batch = []
+
+    @recorder.span('ui:icons_loaded')
+    def _on_loaded(self, batch):
+        ready = set()
+        for path, img in batch:
+            self._pending.discard(path)
+            if img is not None:
+                icon = QtGui.QIcon(QtGui.QPixmap.fromImage(img))
+            else:
+                # 没有内嵌图标（或非 Windows）: 按程序名在图标主题中找，找不到就一直用占位图标
+                icon = QtGui.QIcon.fromTheme(os.path.splitext(os.path.basename(path))[0].lower(),
+                                             self.placeholder())
+            self._icons[path] = icon
+            self._icons.move_to_end(path)
+            ready.add(path)
+        while len(self._icons) > self.capacity:
+            self._icons.popitem(last=False)
+        if ready:
+            self.icons_ready.emit(ready)
+
+    def stats(self):
+        return {'cached': len(self._icons), 'pending': len(self._pending), 'hits': self.hits,
+                'misses': self.misses, 'disk_hits': self.disk_hits, 'extracted': self.extracted}
+
+
+icon_cache = IconCache()
+
+
+def window_list_item(hwnd, title=None):
+    """窗口列表行: “标题 (hwnd)” + 程序图标（未就绪时为占位图标）"""
+    if title is None:
+        title = hwnd_to_title(hwnd)
+    path = icon_cache.exe_for_hwnd(hwnd)
+    it = QtWidgets.QListWidgetItem(icon_cache.icon_for_path(path), f"{title} ({hwnd})")
+    it.setData(QtCore.Qt.UserRole, hwnd)
+    it.setData(ICON_ROLE, path)
+    return it
 
 
 # ---------------------------
@@ -338,199 +5141,373 @@ class Controller(QtCore.QObject):
     group_manager_requested = QtCore.pyqtSignal(int)
     hotkey_config_requested = QtCore.pyqtSignal()
 
-    def __init__(self, model):
+    def __init__(self, model, install_hooks=True):
         super().__init__()
         self.model = model
-        self.pending_group = None  # when user pressed group-digit, waiting for letter
-        self.pending_timer = None
-        # hwnd -> OverlayWindow
+        # hwnd -> OverlayWindow（Qt 线程维护）
         self.overlay_windows = {}
-        # mapping overlay window handle (winId) -> target hwnd, to detect focus on overlay
-        self.overlay_winid_map = {}
-        self.topmost_state = {}  # hwnd->bool (tracks manual toggles)
-        # transparent_state: hwnd -> dict(alpha, clickthrough, was_topmost)
-        self.transparent_state = {}
+        # 各窗口的置顶 / 半透明 / “仅显示”最小化 / 控制条 winId，窗口关闭时自动清理
+        self.window_state = WindowStateStore()
         self.current_alpha = 200
         self.current_clickthrough = False
+        self.dim_targets = set()  # 变暗模式“仅显示”的目标窗口
+        self._dim_watching = False  # 是否订阅了窗口移动事件（只在有挖空目标时订阅）
+        self._dim_lock = threading.Lock()
+        self._peek = None  # 按住透视期间: [(hwnd, 原扩展样式, 原 alpha)]
+        self._peek_key = None
+        self._peek_timer = None
+        self._peek_lock = threading.Lock()
+        # 钩子线程 -> Qt 线程 的消息通道（提示、控制条等）
+        self.ui = UiEventBus()
+        # 已应用状态的崩溃安全日志（进程被杀后下次启动可还原）
+        self.journal = StateJournal(config_path(JOURNAL_FILE))
+        try:
+            self._journal_leftover = self.journal.open()
+        except Exception as e:
+            log_error("journal open", e)
+            self._journal_leftover = {}
+        # 专注模式降级的后台进程
+        self.throttle = ProcessThrottle(self.journal)
+
+        # 所有组合键（含 分组→操作 的多步组合）编译进同一棵前缀树
+        self.chord_engine = ChordEngine(on_match=self.on_chord, on_prefix=self.on_chord_prefix,
+                                        on_cancel=self.on_chord_cancel, modifier_probe=probe_modifiers)
+        self._group_prompt = False  # 分组提示是否显示中（由组合键引擎的状态决定开关）
+        # 默认方案 + 按程序的快捷键方案，各自预先编译
+        self.hotkey_tables = HotkeyTables(self.chord_engine)
+        self._checker_started = False
+        # 原生热键后端（Windows 默认）；为 None 时使用 keyboard 库的低级钩子
+        self.hotkey_source = None
+
+        # 前台窗口的最近使用顺序（全局 + 每个分组）
+        self.focus_history = FocusHistory()
+        self.focus_history.sync_groups(self.model.snapshot)
+        # 窗口操作和分组改动的撤销 / 重做历史
+        self.history = ActionHistory()
+        self.model.subscribe(self._on_model_change)
+        event_stream.groups_of = lambda hwnd: self.focus_history.member_of.get(hwnd, ())
+
+        # 新窗口自动规则: hwnd -> 已应用过的规则序号
+        self.rule_index = RuleIndex(self.model.rules)
+        self._rules_applied = {}
+
+        # 订阅端点的窗口事件（先于进程索引处理，关闭时还能查到 pid）
+        for event in (EVENT_OBJECT_SHOW, EVENT_OBJECT_NAMECHANGE, EVENT_OBJECT_DESTROY, EVENT_SYSTEM_FOREGROUND):
+            win_events.subscribe(event, self.on_stream_window_event)
+        # pid -> 窗口 索引: 先完整枚举一次，之后靠窗口事件增量维护
+        process_index.attach(win_events)
+        win_events.subscribe(EVENT_OBJECT_SHOW, self.window_state.on_window_event)
+        win_events.subscribe(EVENT_OBJECT_DESTROY, self.on_window_destroyed)
+        for event in (EVENT_OBJECT_SHOW, EVENT_OBJECT_NAMECHANGE, EVENT_OBJECT_DESTROY):
+            win_events.subscribe(event, self.on_rule_event)
+        win_events.subscribe(EVENT_SYSTEM_FOREGROUND, self.on_foreground)
+        win_events.subscribe(EVENT_OBJECT_DESTROY, lambda hwnd, event: self.focus_history.forget(hwnd))
+        win_events.subscribe(EVENT_OBJECT_DESTROY, lambda hwnd, event: self.throttle.on_window_closed(hwnd))
+        win_events.subscribe(EVENT_OBJECT_DESTROY, self.on_dim_target_event)
+        session_tape.attach(win_events)
+        win_events.start()
+        enum_window_table()
+
+        # Start keyboard hooks（重放会话时由回放器直接调用 on_chord，不挂钩子）
+        if install_hooks:
+            self.register_hotkeys()
+        else:
+            self._compile_hotkeys()
 
-        # Start keyboard hooks in separate thread
-        self.register_hotkeys()
+    def _on_model_change(self, old, new):
+        """Model 发布了新快照（写入方线程）"""
+        self.focus_history.sync_groups(new)
+        if old.hotkeys is not new.hotkeys:
+            self._compile_hotkeys()
+        self.history.record_model(old, new)
+        event_stream.model_changed(old, new)
 
     # -----------------------
     # Hotkey handling
     # -----------------------
+    def _compile_hotkeys(self):
+        """重新编译默认和各程序的快捷键方案，并按当前前台窗口选择"""
+        self.hotkey_tables.compile(self.model.hotkeys, self.model.hotkey_profiles)
+        self._select_hotkey_table(get_foreground_hwnd() or 0)
+        if self.hotkey_source is not None:
+            self.hotkey_source.rebind()
+
+    def _select_hotkey_table(self, hwnd):
+        """前台窗口变化时切换快捷键方案；原生热键随之注销 / 注册，未绑定的键直接交给该程序"""
+        if not len(self.hotkey_tables):
+            return
+        pid = process_index.pid_of(hwnd) or (get_window_pid(hwnd) if hwnd else 0)
+        exe = process_index.exe_name(pid) if pid and pid > 0 else ''
+        if self.hotkey_tables.select(exe, lambda: get_window_class(hwnd)) and self.hotkey_source is not None:
+            self.hotkey_source.rebind()
+
     def register_hotkeys(self):
-        """注册快捷键并启动守护线程"""
+        """编译组合键并注册: 原生热键（RegisterHotKey），或安装 keyboard 低级钩子"""
+        if _user32 is not None and self.model.settings.get('hotkey_backend') == 'native':
+            try:
+                self._compile_hotkeys()
+                if self.hotkey_source is None:
+                    self.hotkey_source = NativeHotkeySource(self.chord_engine, lock=self.hotkey_tables.lock)
+                    self.hotkey_source.start()
+                print("[+] 热键已注册完成（原生热键）")
+            except Exception as e:
+                print("注册热键时出错:", e)
+            return
+
         try:
             keyboard.unhook_all()
         except Exception:
             pass
 
-        # 启动热键线程
-        self.hotkey_thread = threading.Thread(target=self._keyboard_thread, daemon=True)
-        self.hotkey_thread.start()
+        try:
+            self._compile_hotkeys()
+            keyboard.hook(self._on_key_event)
+            print("[+] 热键已注册完成")
+        except Exception as e:
+            print("注册热键时出错:", e)
 
         # 启动定时检查线程，防止挂钩失效
-        self._schedule_hotkey_check()
+        if not self._checker_started:
+            self._checker_started = True
+            self._schedule_hotkey_check()
 
     def _schedule_hotkey_check(self):
         """周期性检测 keyboard 钩子是否仍在运行"""
         def checker():
             while True:
                 try:
-                    # 若热键列表异常少（说明被清空或挂钩失效）
-                    hooks = getattr(keyboard, "_hotkeys", None)
-                    if not hooks or len(hooks) < 3:
+                    # 钩子被清空或挂钩失效
+                    hooks = getattr(keyboard, "_hooks", None)
+                    if not hooks or self._on_key_event not in hooks:
                         print("[!] 检测到快捷键挂钩失效，正在重新注册...")
                         self.register_hotkeys()
-                        return  # 退出当前检测循环
                 except Exception as e:
                     print("热键检测异常:", e)
                     self.register_hotkeys()
-                    return
                 time.sleep(60)  # 每 60 秒检测一次
 
         threading.Thread(target=checker, daemon=True).start()
 
-    def _keyboard_thread(self):
-        """注册所有热键（独立线程运行）"""
-        try:
-            # 注册数字键 0~9（Ctrl+Alt+数字）
-            for d in '0123456789':
-                keyboard.add_hotkey(f'ctrl+alt+{d}', lambda dd=d: self.on_group_digit(dd))
-
-            # 注册操作快捷键
-            hk = self.model.hotkeys
-            keyboard.add_hotkey(f'ctrl+alt+{hk.get("topmost", "t")}',
-                                lambda: self.on_action_trigger('topmost'))
-            keyboard.add_hotkey(f'ctrl+alt+{hk.get("show_only", "m")}',
-                                lambda: self.on_action_trigger('show_only'))
-            keyboard.add_hotkey(f'ctrl+alt+{hk.get("transparent", "p")}',
-                                lambda: self.on_action_trigger('transparent'))
-            keyboard.add_hotkey(f'ctrl+alt+{hk.get("open_group_manager", "g")}',
-                                lambda: self.emit_group_manager())
-
-            print("[+] 热键已注册完成")
-        except Exception as e:
-            print("注册热键时出错:", e)
-
-        # 用非阻塞循环替代 keyboard.wait()
-        # 避免钩子挂起时阻塞线程
-        while True:
-            time.sleep(1)
-
-    def emit_group_manager(self):
-        hwnd = get_foreground_hwnd()
+    def _on_key_event(self, event):
+        """键盘钩子回调（钩子线程）：只把事件喂给组合键引擎（与快捷键方案切换互斥）"""
+        with self.hotkey_tables.lock:
+            self.chord_engine.feed(event.event_type, event.name)
+
+    @recorder.span('hotkey:chord')
+    def on_chord(self, match):
+        """组合键引擎匹配成功"""
+        session_tape.hotkey(match)
+        self.on_chord_cancel()
+        group = match.args.get('group')
+        if 'slot' in match.args:
+            self.on_action_trigger(match.action, slot=match.args['slot'])
+        elif group is None:
+            self.on_action_trigger(match.action)
+        else:
+            gid = self.model.group_for_digit(group)
+            if gid is None:
+                self.ui.post('message', f"数字键 {group} 未绑定分组（分组管理中右键分组名可绑定）")
+            else:
+                self.on_action_trigger(match.action, gid)
+
+    def on_chord_prefix(self, args, keys, actions):
+        """组合键输入了一半（如 Ctrl+Alt+数字），提示用户继续输入"""
+        if 'restore_profile' in actions:
+            names = list(self.model.profiles)[:10]
+            if not names:
+                text = "还没有保存任何布局方案（托盘 → 布局方案 → 保存当前布局）"
+            else:
+                text = "切换布局: " + "  ".join(f"{(i + 1) % 10}.{n}" for i, n in enumerate(names))
+            self.ui.post('message', text)
+        elif 'group' in args:
+            gid = self.model.group_for_digit(args['group'])
+            if gid is not None:
+                self._group_prompt = True
+                self.ui.post('group_prompt', gid)
+
+    def on_chord_cancel(self):
+        """组合键完成或中途取消: 关闭分组提示（提示本身不接收按键，字母键由组合键引擎处理）"""
+        if self._group_prompt:
+            self._group_prompt = False
+            self.ui.post('group_prompt', None)
+
+    def emit_group_manager(self, hwnd=None):
+        if hwnd is None:
+            hwnd = get_foreground_hwnd()
         if hwnd is None: hwnd = 0
         self.group_manager_requested.emit(int(hwnd))
 
-    def on_group_digit(self, digit):
+    def request_pick(self, hwnd=None):
+        self.ui.post('pick')
+
+    def _action_handler(self, action):
+        """动作的实现（插件动作第一次触发时才导入）；未知或加载失败时提示并返回 None"""
+        if actions.get(action) is None:
+            return None
         try:
-            gid = int(digit)
-        except:
-            return
-        self.pending_group = gid
-        if self.pending_timer and self.pending_timer.is_alive():
-            self.pending_timer.cancel()
-        self.pending_timer = threading.Timer(4.0, self.clear_pending_group)
-        self.pending_timer.daemon = True
-        self.pending_timer.start()
-        QtCore.QMetaObject.invokeMethod(app_window, "show_group_prompt", QtCore.Qt.QueuedConnection,
-                                        QtCore.Q_ARG(int, gid))
-
-    def clear_pending_group(self):
-        self.pending_group = None
-
-    def on_action_trigger(self, action):
+            return actions.resolve(action)
+        except Exception as e:
+            log_error(f"load action {action}", e)
+            self.ui.post('message', f"动作 {action} 加载失败: {e}")
+            return None
+
+    @recorder.span('controller:on_action_trigger')
+    def on_action_trigger(self, action, gid=None, slot=None):
         """
-        If pending_group is set, then perform action on that group.
+        If gid is given, then perform action on that group.
         Otherwise operate on current foreground window.
         Special: if foreground hwnd corresponds to an overlay window, map to its target hwnd
+        slot: 'slot' 类动作（如 Ctrl+Alt+L 后按数字）的数字
         """
-        target_hwnds = []
-        if self.pending_group is not None:
-            gid = self.pending_group
-            self.pending_group = None
-            if gid in self.model.groups:
-                target_hwnds = [h for h in self.model.groups.get(gid, []) if is_window(h)]
+        handler = self._action_handler(action)
+        if handler is None:
+            return
+        spec = actions.get(action)
+        # 一次操作（含整组操作）在撤销历史中只占一个条目
+        with self.history.transaction(spec.label):
+            if spec.scope == 'slot':
+                handler(self, slot, **spec.params)
             else:
-                QtCore.QMetaObject.invokeMethod(app_window, "show_message", QtCore.Qt.QueuedConnection,
-                                                QtCore.Q_ARG(str, f"分组 {gid} 为空"))
+                self._dispatch_action(handler, spec, gid)
+
+    def _dispatch_action(self, handler, spec, gid):
+        if spec.scope == 'group':
+            handler(self, gid, **spec.params)
+            return
+        target_hwnds = []
+        if gid is not None:
+            # 包含子分组中的窗口
+            target_hwnds = [h for h in self.model.group_hwnds(gid) if is_window(h)]
+            if not target_hwnds:
+                self.ui.post('message', f"{self.model.group_label(gid)} 为空")
                 return
         else:
-            hwnd = get_foreground_hwnd()
-            if not hwnd:
-                return
+            hwnd = get_foreground_hwnd() or 0
             # if the foreground hwnd is actually one of our overlays, map it to the target window
-            mapped = self.overlay_winid_map.get(int(hwnd))
+            mapped = self.window_state.overlay_target(hwnd)
             if mapped and is_window(mapped):
                 hwnd = mapped
+            if spec.scope == 'global':
+                handler(self, hwnd, **spec.params)
+                return
+            if not hwnd:
+                return
             target_hwnds = [hwnd]
 
-        if action == 'topmost':
-            for h in target_hwnds:
-                self.toggle_topmost(h)
-        elif action == 'show_only':
-            for h in target_hwnds:
-                self.toggle_show_only(h)
-        elif action == 'transparent':
-            for h in target_hwnds:
-                self.toggle_transparent(h)
+        # 分组操作的所有窗口请求合并提交（X11 下只需一次往返）
+        with window_batch():
+            for h in (target_hwnds if spec.scope == 'window' else target_hwnds[:1]):
+                handler(self, h, **spec.params)
 
     # -----------------------
     # Action implementations
     # -----------------------
-    def toggle_topmost(self, hwnd):
-        prev = self.topmost_state.get(hwnd, False)
-        new = not prev
+    def app_windows(self, hwnd):
+        """hwnd 所属进程的全部窗口（查索引，不重新枚举）"""
+        pid = process_index.pid_of(hwnd) or get_window_pid(hwnd)
+        hwnds = process_index.hwnds_for_pid(pid)
+        if hwnd not in hwnds:
+            hwnds.append(hwnd)
+        return pid, hwnds
+
+    def toggle_app(self, hwnd, kind):
+        """对前台程序的所有窗口执行 topmost / transparent / show_only，以前台窗口的状态为准统一切换"""
+        if not hwnd:
+            return
+        pid, hwnds = self.app_windows(hwnd)
+        exe = process_index.exe_name(pid) or hwnd_to_title(hwnd)
+        if kind == 'show_only':
+            self.toggle_show_only(hwnd, targets=hwnds)
+            return
+        if kind == 'topmost':
+            on = not self.window_state.is_topmost(hwnd)
+            for h in hwnds:
+                if self.window_state.is_topmost(h) != on:
+                    self.toggle_topmost(h, notify=False)
+            text = f"{exe} 全部窗口{'设置' if on else '取消'}置顶（{len(hwnds)} 个）"
+        else:
+            on = self.window_state.transparent(hwnd) is None
+            for h in hwnds:
+                if (self.window_state.transparent(h) is None) == on:
+                    self.toggle_transparent(h, notify=False)
+            text = f"{exe} 全部窗口{'设置' if on else '取消'}半透明（{len(hwnds)} 个）"
+        self.ui.post('message', text)
+
+    def toggle_topmost(self, hwnd, notify=True):
         if not is_window(hwnd):
             return
+        rec = self.window_state.checked(hwnd)
+        prev = rec is not None and rec.topmost
+        new = not prev
+        if new:
+            self.journal.record(J_TOPMOST, hwnd, get_window_pid(hwnd), is_topmost(hwnd), 1)
         set_topmost(hwnd, new)
-        self.topmost_state[hwnd] = new
+        self.window_state.set_topmost(hwnd, new)
+        self.history.record(('topmost', hwnd, prev, new), "置顶窗口")
+        event_stream.publish('topmost', hwnd=hwnd, on=new)
+        if not new and self.window_state.transparent(hwnd) is None:
+            self.journal.clear(J_TOPMOST, hwnd)
+        if not notify:
+            return
         if new:
-            QtCore.QMetaObject.invokeMethod(app_window, "show_message", QtCore.Qt.QueuedConnection,
-                                            QtCore.Q_ARG(str, f"{hwnd_to_title(hwnd)} 设置置顶"))
+            self.ui.post('message', (f"{hwnd_to_title(hwnd)} 设置置顶", hwnd))
         else:
-            QtCore.QMetaObject.invokeMethod(app_window, "show_message", QtCore.Qt.QueuedConnection,
-                                            QtCore.Q_ARG(str, f"{hwnd_to_title(hwnd)} 取消置顶"))
+            self.ui.post('message', (f"{hwnd_to_title(hwnd)} 取消置顶", hwnd))
 
-    def toggle_show_only(self, hwnd):
+    def toggle_focus_mode(self, hwnd):
+        self.toggle_show_only(hwnd, focus=True)
+
+    def toggle_show_only(self, hwnd, targets=None, focus=False):
+        """focus=True 为专注模式: 另外降低被最小化窗口所属进程的优先级（退出仅显示时还原）"""
         already_only = getattr(self, 'only_shown_hwnd', None) == hwnd
         if already_only:
-            to_restore = getattr(self, 'minimized_by_only', [])
+            to_restore = self.window_state.clear_minimized()
             for h in to_restore:
                 if is_window(h):
                     restore_window(h)
+                self.journal.clear(J_MINIMIZED, h)
             self.only_shown_hwnd = None
-            self.minimized_by_only = []
-            QtCore.QMetaObject.invokeMethod(app_window, "show_message", QtCore.Qt.QueuedConnection,
-                                            QtCore.Q_ARG(str, "恢复所有窗口"))
+            self._set_dim_targets(())
+            self.history.record(('show_only', hwnd) + getattr(self, '_show_only_args', (None, False)) + (False,),
+                                "恢复所有窗口")
+            event_stream.publish('show_only', hwnd=hwnd, on=False, restored=len(to_restore))
+            restored = self.throttle.restore_all()
+            self.ui.post('message', f"恢复所有窗口（{restored} 个程序恢复原优先级）" if restored else "恢复所有窗口")
             return
 
         # 判断是否是分组操作
         group_hwnds = []
-        for gid, hwnds in self.model.groups.items():
-            if hwnd in hwnds:
-                group_hwnds = [h for h in hwnds if is_window(h)]
-                break
-
-        if group_hwnds:
+        if targets is None:
+            snap = self.model.snapshot
+            gid = snap.group_of(hwnd)
+            if gid is not None:
+                group_hwnds = [h for h in snap.groups[gid] if is_window(h)]
+
+        if targets is not None:
+            target_hwnds = [h for h in targets if is_window(h)]
+        elif group_hwnds:
             target_hwnds = group_hwnds
         else:
             target_hwnds = [hwnd]
 
-        all_windows = enum_windows()
         minimized = []
-        for h, title in all_windows:
+        if self.model.settings.get('show_only_style') == 'dim':
+            # 变暗模式: 其它窗口原地不动，每个显示器一层遮罩挖空目标窗口（不枚举、不逐个最小化）
+            self._set_dim_targets(target_hwnds)
+            all_windows = ()
+        else:
+            self._set_dim_targets(())
+            all_windows = enum_window_table().hwnds
+        for h in all_windows:
             if h in target_hwnds:
                 continue
-            if self.topmost_state.get(h, False):
+            if self.window_state.is_topmost(h):
                 continue
-            try:
-                win32gui.ShowWindow(h, win32con.SW_MINIMIZE)
+            self.journal.record(J_MINIMIZED, h, get_window_pid(h), 0, 1)
+            if minimize_window(h):
                 minimized.append(h)
-            except Exception:
-                pass
+            else:
+                self.journal.clear(J_MINIMIZED, h)
 
         # 恢复目标分组窗口
         for h in target_hwnds:
@@ -538,80 +5515,586 @@ class Controller(QtCore.QObject):
                 restore_window(h)
             except Exception:
                 pass
+        if len(target_hwnds) > 1:
+            # 整组显示时把最近使用的那个窗口放到前台
+            recent = self.focus_history.most_recent(target_hwnds)
+            if recent:
+                focus_window(recent)
 
         self.only_shown_hwnd = hwnd
-        self.minimized_by_only = minimized
-        QtCore.QMetaObject.invokeMethod(app_window, "show_message", QtCore.Qt.QueuedConnection,
-                                        QtCore.Q_ARG(str,
-                                                     f"仅显示: {', '.join(hwnd_to_title(h) for h in target_hwnds)}"))
+        self.window_state.set_minimized(minimized)
+        self._show_only_args = (tuple(targets) if targets is not None else None, focus)
+        self.history.record(('show_only', hwnd) + self._show_only_args + (True,), "仅显示")
+        if event_stream.subscribers:
+            groups = {g for h in target_hwnds for g in event_stream.groups_of(h)}
+            event_stream.publish('show_only', hwnd=hwnd, on=True, targets=target_hwnds, focus=focus,
+                                 minimized=len(minimized), groups=sorted(groups))
+        text = f"仅显示: {', '.join(hwnd_to_title(h) for h in target_hwnds)}"
+        if focus:
+            hidden = minimized or [h for h in list(process_index.hwnd_pid)
+                                   if h not in target_hwnds and not self.window_state.is_topmost(h)]
+            n = self.throttle.throttle(hidden, keep=target_hwnds,
+                                       trim=self.model.settings.get('focus_trim_memory', False))
+            text = f"专注模式（{n} 个后台程序已降低优先级）: " + text[len("仅显示: "):]
+        self.ui.post('message', text)
+
+    def _set_dim_targets(self, hwnds):
+        """变暗遮罩的挖空窗口；空集合时隐藏遮罩。遮罩本身属于 Qt 线程，经 UI 事件总线更新"""
+        if not hwnds and not self.dim_targets:
+            return
+        self.dim_targets = set(hwnds)
+        self._watch_dim_targets()
+        self.ui.post('dim', tuple(hwnds))
+
+    def _watch_dim_targets(self):
+        """
+        有挖空目标时才订阅窗口移动事件: 这是系统级钩子，鼠标移动、光标闪烁都会触发，
+        没有遮罩时不应为它进入 Python
+        """
+        with self._dim_lock:
+            want = bool(self.dim_targets)
+            if want == self._dim_watching:
+                return
+            self._dim_watching = want
+            if want:
+                win_events.subscribe(EVENT_OBJECT_LOCATIONCHANGE, self.on_dim_target_event)
+            else:
+                win_events.unsubscribe(EVENT_OBJECT_LOCATIONCHANGE, self.on_dim_target_event)
 
-    def toggle_transparent(self, hwnd):
+    def on_window_destroyed(self, hwnd, event):
+        """窗口关闭（事件线程）: 删除它的状态记录，有控制条时一并关闭"""
+        rec = self.window_state.forget(hwnd)
+        if rec is not None and (rec.overlay or rec.alpha >= 0):
+            self._close_overlay(hwnd)
+
+    def on_dim_target_event(self, hwnd, event):
+        """挖空的目标窗口移动 / 关闭（事件线程）: 让遮罩跟随"""
+        if hwnd not in self.dim_targets:
+            return
+        if event == EVENT_OBJECT_DESTROY:
+            self.dim_targets.discard(hwnd)
+            if not self.dim_targets:
+                self.only_shown_hwnd = None
+                self._watch_dim_targets()
+        self.ui.post('dim', tuple(self.dim_targets))
+
+    def toggle_transparent(self, hwnd, notify=True):
         # if already transparent -> cancel (restore)
-        state = self.transparent_state.get(hwnd, None)
+        self.window_state.checked(hwnd)
+        state = self.window_state.clear_transparent(hwnd)
         if state is not None:
+            alpha, clickthrough, was_topmost = state
             try:
-                set_window_opacity(hwnd, 255)
-                set_window_clickthrough(hwnd, False)
-                was_top = state.get('was_topmost', False)
-                set_topmost(hwnd, was_top)
+                self._restore_transparent(hwnd, was_topmost)
             except Exception:
                 pass
 
-            self.transparent_state.pop(hwnd, None)
-
-            # --- 修复闪退关键 ---
-            if hwnd in self.overlay_windows:
-                try:
-                    ov = self.overlay_windows.pop(hwnd)
-                    wid = int(ov.winId())
-                    if wid in self.overlay_winid_map:
-                        self.overlay_winid_map.pop(wid, None)
-                    # 先停止计时器再安全关闭
-                    if hasattr(ov, "poll_timer"):
-                        ov.poll_timer.stop()
-                        ov.poll_timer.deleteLater()
-                    ov.deleteLater()  # 使用 Qt 安全删除
-                except Exception as e:
-                    print("overlay close error:", e)
+            self._close_overlay(hwnd)
+            self.history.record(('transparent', hwnd, (alpha, clickthrough), None), "半透明")
+            event_stream.publish('transparent', hwnd=hwnd, on=False)
 
-            QtCore.QMetaObject.invokeMethod(
-                app_window, "show_message", QtCore.Qt.QueuedConnection,
-                QtCore.Q_ARG(str, f"{hwnd_to_title(hwnd)} 取消半透明")
-            )
+            if notify:
+                self.ui.post('message', (f"{hwnd_to_title(hwnd)} 取消半透明", hwnd))
             return
 
         # Apply semi-transparent + topmost + overlay
-        was_topmost = bool(self.topmost_state.get(hwnd, False))
+        self._apply_transparent(hwnd, self.current_alpha, self.current_clickthrough)
+        self.history.record(('transparent', hwnd, None, (self.current_alpha, self.current_clickthrough)), "半透明")
+        if notify:
+            self.ui.post('message', (f"{hwnd_to_title(hwnd)} 设置半透明", hwnd))
+
+    def _apply_transparent(self, hwnd, alpha, clickthrough):
+        was_topmost = self.window_state.is_topmost(hwnd)
+        pid = get_window_pid(hwnd)
+        self.journal.record(J_EXSTYLE, hwnd, pid, get_exstyle(hwnd), 0)
+        self.journal.record(J_ALPHA, hwnd, pid, get_window_alpha(hwnd), alpha)
+        self.journal.record(J_TOPMOST, hwnd, pid, is_topmost(hwnd), 1)
         set_topmost(hwnd, True)
-        alpha = self.current_alpha
         set_window_opacity(hwnd, alpha)
-        set_window_clickthrough(hwnd, self.current_clickthrough)
-        self.transparent_state[hwnd] = {
-            'alpha': alpha, 'clickthrough': self.current_clickthrough, 'was_topmost': was_topmost
-        }
+        set_window_clickthrough(hwnd, clickthrough)
+        self.journal.record(J_EXSTYLE, hwnd, pid, 0, get_exstyle(hwnd))
+        self.window_state.set_transparent(hwnd, alpha, clickthrough, was_topmost)
+        event_stream.publish('transparent', hwnd=hwnd, on=True, alpha=alpha, clickthrough=clickthrough)
 
-        QtCore.QMetaObject.invokeMethod(
-            app_window, "_create_overlay_for_hwnd", QtCore.Qt.QueuedConnection,
-            QtCore.Q_ARG(int, hwnd)
-        )
-        QtCore.QMetaObject.invokeMethod(
-            app_window, "show_message", QtCore.Qt.QueuedConnection,
-            QtCore.Q_ARG(str, f"{hwnd_to_title(hwnd)} 设置半透明")
-        )
+        self.ui.post('overlay', (hwnd, True))
+
+    # -----------------------
+    # Undo / redo
+    # -----------------------
+    def undo(self, hwnd=None):
+        self._step_history(redo=False)
+
+    def redo(self, hwnd=None):
+        self._step_history(redo=True)
+
+    @recorder.span('controller:undo')
+    def _step_history(self, redo):
+        """撤销（逆序应用各增量的“之前”）或重做；窗口请求合并提交，分组改动合并为一次发布"""
+        entry = self.history.pop(redo)
+        if entry is None:
+            self.ui.post('message', "没有可重做的操作" if redo else "没有可撤销的操作")
+            return
+        label, deltas = entry
+        changes = {}
+        with self.history.suspended(), window_batch():
+            for delta in (deltas if redo else reversed(deltas)):
+                try:
+                    self._apply_delta(delta, redo, changes)
+                except Exception as e:
+                    log_error(f"undo {delta[0]}", e, delta[1] if delta[0] != 'model' else 0)
+            if changes:
+                self.model.apply_changes(changes)
+        self.history.done(entry, redo)
+        count = f"（{len(deltas)} 项）" if len(deltas) > 1 else ""
+        self.ui.post('message', f"{'重做' if redo else '撤销'}: {label}{count}")
+
+    def _apply_delta(self, delta, forward, changes):
+        """把窗口恢复到增量的“之后”（forward）或“之前”状态；已经是该状态的窗口不动"""
+        kind, hwnd = delta[0], delta[1]
+        if kind == 'model':
+            for field, keys in delta[1].items():
+                target = changes.setdefault(field, {})
+                for k, (old, new) in keys.items():
+                    target[k] = new if forward else old
+            return
+        if not is_window(hwnd):
+            return
+        if kind == 'topmost':
+            want = delta[3] if forward else delta[2]
+            if self.window_state.is_topmost(hwnd) != want:
+                self.toggle_topmost(hwnd, notify=False)
+        elif kind == 'transparent':
+            want = delta[3] if forward else delta[2]
+            state = self.window_state.transparent(hwnd)
+            if want is None and state is not None:
+                self.toggle_transparent(hwnd, notify=False)
+            elif want is not None and state is None:
+                self._apply_transparent(hwnd, *want)
+        elif kind == 'layout':
+            moves = []
+            self._apply_layout(hwnd, delta[3] if forward else delta[2], moves)
+            defer_window_positions(moves)
+        elif kind == 'show_only':
+            targets, focus, entered = delta[2:]
+            shown = entered if forward else not entered
+            if shown != (getattr(self, 'only_shown_hwnd', None) == hwnd):
+                self.toggle_show_only(hwnd, targets=targets if shown else None, focus=focus)
+
+    # -----------------------
+    # Hold-to-peek
+    # -----------------------
+    PEEK_ALPHA = 16
+    PEEK_MAX_SECONDS = 30  # 漏掉松开事件时的兜底
+
+    def peek(self, hwnd=None):
+        """按住快捷键期间: 所有置顶 / 半透明窗口几乎全透明且点击穿透；松开后恢复（都是一次批量设置）"""
+        with self._peek_lock:
+            if self._peek is not None:
+                return
+            managed = set(self.window_state.transparent_hwnds()) | set(self.window_state.topmost_hwnds())
+            saved = []
+            for h in managed:
+                if not is_window(h):
+                    continue
+                ex_style, alpha = get_exstyle(h), get_window_alpha(h)
+                if ex_style & WS_EX_LAYERED and alpha < 0:
+                    continue  # 逐像素透明的分层窗口，设置整体透明度后无法原样恢复
+                saved.append((h, ex_style, alpha))
+            if not saved:
+                self.ui.post('message', "没有置顶或半透明的窗口")
+                return
+            for h, ex_style, alpha in saved:
+                self.journal.record(J_PEEK, h, process_index.pid_of(h) or get_window_pid(h), ex_style, alpha)
+            self._peek = saved
+            self._peek_key = parse_combo(f"ctrl+alt+{actions.key_for('peek', self.model.hotkeys)}")
+            # 先监听抬起再淡出: 淡出期间就松开的按键也能收到，end_peek 会等这里放开锁后再恢复
+            # （原生热键只报告按下，这里临时监听抬起）
+            keyboard.hook(self._on_peek_key)
+            # 兜底定时器只结束创建它的这一次透视
+            timer = self._peek_timer = threading.Timer(self.PEEK_MAX_SECONDS, self.end_peek, args=(saved,))
+            timer.daemon = True
+            timer.start()
+            with window_batch():
+                set_layered_states([(h, ex_style | WS_EX_LAYERED | WS_EX_TRANSPARENT, self.PEEK_ALPHA)
+                                    for h, ex_style, _ in saved])
+            # 仍在锁内通知，保证排在同一次 end_peek 的通知之前
+            self.ui.post('peek', True)
+            event_stream.publish('peek', on=True, windows=[h for h, _, _ in saved])
+
+    def _on_peek_key(self, event):
+        if event.event_type != 'up' or self._peek_key is None:
+            return
+        name = (event.name or '').lower()
+        mods, key = self._peek_key
+        if name == key or MODIFIER_NAMES.get(name) in mods:
+            self.end_peek()
+
+    def end_peek(self, peek=None):
+        """结束透视；peek 不为 None 时仅当它仍是当前这一次透视才结束（兜底定时器）"""
+        with self._peek_lock:
+            saved = self._peek
+            if saved is None or (peek is not None and peek is not saved):
+                return
+            self._peek = None
+            timer, self._peek_timer = self._peek_timer, None
+            if timer is not None:
+                timer.cancel()
+            with window_batch():
+                set_layered_states([entry for entry in saved if is_window(entry[0])])
+            for h, _, _ in saved:
+                self.journal.clear(J_PEEK, h)
+        self.ui.post('peek', False)
+        event_stream.publish('peek', on=False)
+        # 不在钩子回调中卸下钩子（会让同一事件跳过其它钩子）
+        threading.Thread(target=keyboard.unhook, args=(self._on_peek_key,), daemon=True).start()
+
+    # -----------------------
+    # Event stream
+    # -----------------------
+    STREAM_WINDOW_EVENTS = {EVENT_OBJECT_SHOW: 'show', EVENT_OBJECT_NAMECHANGE: 'title',
+                            EVENT_OBJECT_DESTROY: 'close', EVENT_SYSTEM_FOREGROUND: 'foreground'}
+
+    def on_stream_window_event(self, hwnd, event):
+        """窗口生命周期（事件线程）: 只转发列表中的窗口；没有订阅者时直接返回"""
+        if not event_stream.subscribers:
+            return
+        pid = process_index.pid_of(hwnd)
+        if not pid and event != EVENT_OBJECT_DESTROY:
+            pid = window_pid_if_listed(hwnd)
+        if not pid:
+            return
+        name = self.STREAM_WINDOW_EVENTS[event]
+        title = hwnd_to_title(hwnd) if name in ('show', 'title') else None
+        event_stream.publish('window', event=name, hwnd=hwnd, pid=pid, title=title)
+
+    # -----------------------
+    # Focus history / group cycling
+    # -----------------------
+    def on_foreground(self, hwnd, event):
+        """前台窗口变化（事件线程）: 只记录列表中的窗口，忽略本程序的提示、控制条等"""
+        hwnd = self.window_state.overlay_target(hwnd, hwnd)
+        self._select_hotkey_table(hwnd)
+        if process_index.pid_of(hwnd) or window_pid_if_listed(hwnd):
+            self.focus_history.touch(hwnd)
+            self.throttle.on_foreground(hwnd)
+
+    @recorder.span('controller:cycle_group')
+    def cycle_group(self, gid, step):
+        """在分组内按最近使用顺序切换；gid 为 None 时使用前台窗口所在的分组"""
+        history = self.focus_history
+        current = get_foreground_hwnd()
+        current = self.window_state.overlay_target(current, current)
+        if gid is None:
+            groups = history.member_of.get(current)
+            if not groups:
+                self.ui.post('message', "当前窗口不在任何分组中")
+                return
+            gid = groups[0]
+        for _ in range(len(history.rings.get(gid, ()))):
+            hwnd = history.cycle(gid, current, step)
+            if is_window(hwnd):
+                focus_window(hwnd)
+                return
+            history.drop(gid, hwnd)
+        self.ui.post('message', f"{self.model.group_label(gid)} 为空")
+
+    # -----------------------
+    # Window rules
+    # -----------------------
+    def on_rule_event(self, hwnd, event):
+        """窗口出现 / 标题变化时匹配规则（事件线程）；同一窗口的同一规则只应用一次"""
+        if event == EVENT_OBJECT_DESTROY:
+            self._rules_applied.pop(hwnd, None)
+            return
+        if self.rule_index.rules:
+            self.apply_rules(hwnd)
+
+    @recorder.span('controller:apply_rules')
+    def apply_rules(self, hwnd, force=False):
+        pid = window_pid_if_listed(hwnd)
+        if not pid:
+            return 0
+        title = hwnd_to_title(hwnd)
+        matched = self.rule_index.match(process_index.exe_name(pid) if pid > 0 else "",
+                                        get_window_class(hwnd), title)
+        applied = self._rules_applied.get(hwnd, ())
+        new = [r for r in matched if force or r.order not in applied]
+        if not new:
+            return 0
+        self._rules_applied[hwnd] = set(applied) | {r.order for r in new}
+        actions = merge_rule_actions(new)
+        with window_batch(), self.history.suspended():
+            group = actions.get('group')
+            if group is not None:
+                gid = self._rule_group(group)
+                self.model.add_to_group(gid, hwnd)
+            if 'alpha' in actions or 'clickthrough' in actions:
+                if self.window_state.transparent(hwnd) is None:
+                    self._apply_transparent(hwnd, int(actions.get('alpha', self.current_alpha)),
+                                            bool(actions.get('clickthrough', self.current_clickthrough)))
+            elif actions.get('topmost') and not self.window_state.is_topmost(hwnd):
+                self.toggle_topmost(hwnd, notify=False)
+            if actions.get('show_only') and getattr(self, 'only_shown_hwnd', None) != hwnd:
+                self.toggle_show_only(hwnd)
+        self.ui.post('message', (f"规则「{'、'.join(r.name for r in new)}」: {title}", hwnd))
+        return len(new)
+
+    def _rule_group(self, group):
+        """规则里的分组可写 id 或名称（“项目A/子分组”）；按名称找不到时自动创建"""
+        if isinstance(group, int):
+            return group
+        found = self.model.find_groups(str(group))
+        if found:
+            return found[0]
+        parent = None
+        for name in [p.strip() for p in str(group).split('/') if p.strip()]:
+            found = [g for g in self.model.find_groups(name) if self.model.group_parents.get(g) == parent]
+            parent = found[0] if found else self.model.create_group(name, parent)
+        return parent
+
+    def reload_rules(self):
+        """重新读取规则并应用到当前所有窗口"""
+        self.rule_index = RuleIndex(self.model.reload_rules())
+        self._compile_hotkeys()
+        self._rules_applied.clear()
+        count = 0
+        for hwnd in list(process_index.hwnd_pid):
+            count += bool(self.apply_rules(hwnd))
+        self.ui.post('message', f"已加载 {len(self.rule_index)} 条窗口规则，应用到 {count} 个窗口；"
+                                f"{len(self.hotkey_tables)} 个程序快捷键方案")
+
+    # -----------------------
+    # Layout profiles
+    # -----------------------
+    def _layout_candidates(self):
+        """当前可匹配的窗口（取自进程索引，不重新枚举）"""
+        out = []
+        for hwnd, pid in list(process_index.hwnd_pid.items()):
+            out.append({'hwnd': hwnd, 'exe': process_index.exe_name(pid).lower(),
+                        'class': get_window_class(hwnd), 'title': hwnd_to_title(hwnd)})
+        return out
+
+    @recorder.span('controller:capture_profile')
+    def capture_profile(self, name):
+        entries = []
+        for hwnd, title in enum_windows():
+            entry = capture_window_layout(hwnd, self.window_state)
+            if entry is not None:
+                entries.append(entry)
+        self.model.set_profile(name, entries)
+        return len(entries)
+
+    def restore_profile_slot(self, slot):
+        """Ctrl+Alt+L 后按数字: 第 N 个布局方案（0 为第 10 个）"""
+        names = list(self.model.profiles)
+        idx = (int(slot) - 1) % 10
+        if idx < len(names):
+            self.restore_profile(names[idx])
+
+    @recorder.span('controller:restore_profile')
+    def restore_profile(self, name):
+        """
+        计算方案与当前状态的差异，只改有变化的部分；全部窗口的改动在一个批处理中提交:
+        显示状态用 SetWindowPlacement，位置/大小/置顶合并进一次 DeferWindowPos。
+        每个被调整的窗口记录一条布局增量（改动前后的布局），整次切换撤销时一起还原。
+        """
+        t0 = time.perf_counter()
+        entries = self.model.profiles.get(name)
+        if entries is None:
+            return
+        pairs = match_profile_windows(entries, self._layout_candidates())
+        before = {hwnd: capture_window_layout(hwnd, self.window_state) for _, hwnd in pairs}
+        moves = []
+        changed = []
+        with self.history.transaction(f"切换布局「{name}」"):
+            with self.history.suspended(), window_batch():
+                for e, hwnd in pairs:
+                    if before[hwnd] is not None and self._apply_layout(hwnd, e, moves):
+                        changed.append((e, hwnd))
+                defer_window_positions(moves)
+            for e, hwnd in changed:
+                self.history.record(('layout', hwnd, before[hwnd], e))
+        ms = (time.perf_counter() - t0) * 1000
+        self.ui.post('message', f"布局「{name}」: 匹配 {len(pairs)}/{len(entries)} 个窗口，"
+                                f"调整 {len(changed)} 个（{ms:.0f} ms）")
+
+    def _apply_layout(self, hwnd, e, moves):
+        """把一个窗口调整到布局条目 e；位置 / 置顶追加到 moves 由调用方一次提交。返回是否有改动"""
+        placement = get_window_placement(hwnd)
+        if placement is None:
+            return False
+        dirty = False
+        want_kind = _show_kind(e['show'])
+        if _show_kind(placement[1]) != want_kind or (want_kind != 'normal' and
+                                                     list(placement[4]) != e['normal']):
+            show_cmd = SW_SHOWNORMAL if want_kind == 'normal' else e['show']
+            dirty = set_window_placement(hwnd, show_cmd, e['normal'])
+        after = None
+        want_top = bool(e['topmost']) or e['alpha'] is not None
+        if is_topmost(hwnd) != want_top:
+            after = HWND_TOPMOST if want_top else HWND_NOTOPMOST
+            self.window_state.set_topmost(hwnd, want_top)
+            if want_top:
+                self.journal.record(J_TOPMOST, hwnd, get_window_pid(hwnd), not want_top, 1)
+            else:
+                self.journal.clear(J_TOPMOST, hwnd)
+        flags = 0
+        rect = get_window_rect(hwnd)
+        if want_kind == 'normal' and rect is not None and list(rect) != e['rect']:
+            l, t, r, b = e['rect']
+        elif after is not None:
+            l = t = r = b = 0
+            flags = SWP_NOMOVE | SWP_NOSIZE
+        else:
+            l = None
+        if l is not None:
+            moves.append((hwnd, after, l, t, r - l, b - t, flags))
+            dirty = True
+        state = self.window_state.transparent(hwnd)
+        if e['alpha'] is None and state is not None:
+            self.toggle_transparent(hwnd, notify=False)
+            dirty = True
+        elif e['alpha'] is not None and (state is None or state.alpha != e['alpha']
+                                         or state.clickthrough != e['clickthrough']):
+            if state is None:
+                self._apply_transparent(hwnd, e['alpha'], e['clickthrough'])
+            else:
+                set_window_opacity(hwnd, e['alpha'])
+                set_window_clickthrough(hwnd, e['clickthrough'])
+                self.window_state.set_transparent(hwnd, e['alpha'], e['clickthrough'])
+            dirty = True
+        return dirty
 
     def set_transparent_alpha(self, alpha):
         self.current_alpha = alpha
-        for hwnd in list(self.transparent_state.keys()):
-            if is_window(hwnd):
+        for hwnd in self.window_state.transparent_hwnds():
+            state = self.window_state.transparent(hwnd)
+            if state is not None and is_window(hwnd):
                 set_window_opacity(hwnd, alpha)
-                self.transparent_state[hwnd]['alpha'] = alpha
+                state.alpha = alpha
+                self.journal.record(J_ALPHA, hwnd, get_window_pid(hwnd), -1, alpha)
 
     def set_clickthrough(self, on):
         self.current_clickthrough = on
-        for hwnd in list(self.transparent_state.keys()):
-            if is_window(hwnd):
+        for hwnd in self.window_state.transparent_hwnds():
+            state = self.window_state.transparent(hwnd)
+            if state is not None and is_window(hwnd):
                 set_window_clickthrough(hwnd, on)
-                self.transparent_state[hwnd]['clickthrough'] = on
+                state.clickthrough = on
+                self.journal.record(J_EXSTYLE, hwnd, get_window_pid(hwnd), 0, get_exstyle(hwnd))
+
+    def _restore_transparent(self, hwnd, was_top):
+        """按日志中记录的原始值还原透明度、点击穿透和置顶"""
+        orig_alpha = self.journal.original(J_ALPHA, hwnd, -1)
+        orig_ex = self.journal.original(J_EXSTYLE, hwnd)
+        set_window_opacity(hwnd, orig_alpha if orig_alpha >= 0 else 255)
+        if orig_ex is None:
+            set_window_clickthrough(hwnd, False)
+        else:
+            set_exstyle_bits(hwnd, WS_EX_LAYERED | WS_EX_TRANSPARENT, orig_ex)
+        set_topmost(hwnd, was_top)
+        self.journal.clear(J_EXSTYLE, hwnd)
+        self.journal.clear(J_ALPHA, hwnd)
+        if not was_top:
+            self.journal.clear(J_TOPMOST, hwnd)
+
+    def _close_overlay(self, hwnd):
+        # 控制条属于 Qt 线程，交给 UI 事件总线处理
+        self.ui.post('overlay', (hwnd, False))
+
+    def stats(self):
+        """运行统计（托盘 → 运行统计）"""
+        return {
+            'ui_bus': self.ui.stats(),
+            'process_index': process_index.stats(),
+            'icon_cache': icon_cache.stats(),
+            'focus_history': self.focus_history.stats(),
+            'focus_mode': self.throttle.stats(),
+            'actions': actions.stats(),
+            'undo_history': self.history.stats(),
+            'hotkeys': self.hotkey_source.stats() if self.hotkey_source else 'keyboard hook',
+            'hotkey_profiles': self.hotkey_tables.stats(),
+            'event_stream': event_stream.stats(),
+            'journal_entries': len(self.journal.live),
+            'overlays': len(self.overlay_windows),
+            'window_state': self.window_state.stats(),
+            'flight_recorder_events': min(recorder._written, recorder.capacity),
+        }
+
+    # -----------------------
+    # Journal recovery / rollback
+    # -----------------------
+    @recorder.span('controller:recover_from_journal')
+    def recover_from_journal(self):
+        """
+        上次进程异常退出时遗留的状态: 被置顶/半透明/最小化的窗口。
+        journal_recovery == 'reattach' 时重新接管半透明和置顶窗口（恢复控制条），否则直接还原原始值。
+        """
+        leftover = self._journal_leftover
+        self._journal_leftover = {}
+        if not leftover:
+            return 0
+        # 专注模式降级的进程（以 pid 记录）直接还原
+        handled = self.throttle.recover(leftover)
+        by_hwnd = {}
+        for (hwnd, kind), (pid, orig, new) in leftover.items():
+            if kind != J_PRIORITY:
+                by_hwnd.setdefault(hwnd, {})[kind] = (pid, orig, new)
+        reattach = self.model.settings.get('journal_recovery') == 'reattach'
+        for hwnd, kinds in by_hwnd.items():
+            pid = next(iter(kinds.values()))[0]
+            if not is_window(hwnd) or get_window_pid(hwnd) != pid:
+                # 窗口已关闭，或句柄已被其它进程复用
+                for kind in kinds:
+                    self.journal.clear(kind, hwnd)
+                continue
+            handled += 1
+            if J_PEEK in kinds:
+                # 按住透视时被结束: 先恢复透视前的样式和透明度
+                _, ex_style, alpha = kinds.pop(J_PEEK)
+                set_layered_states([(hwnd, ex_style, alpha)])
+                self.journal.clear(J_PEEK, hwnd)
+            if J_MINIMIZED in kinds:
+                restore_window(hwnd)
+                self.journal.clear(J_MINIMIZED, hwnd)
+            transparent = J_ALPHA in kinds or J_EXSTYLE in kinds
+            if reattach and transparent:
+                ex = get_exstyle(hwnd)
+                alpha = kinds.get(J_ALPHA, (0, -1, self.current_alpha))[2]
+                was_top = bool(kinds.get(J_TOPMOST, (0, 0, 0))[1])
+                self.window_state.set_transparent(hwnd, alpha, ex & WS_EX_TRANSPARENT, was_top)
+                self.ui.post('overlay', (hwnd, True))
+            elif transparent:
+                self._restore_transparent(hwnd, bool(kinds.get(J_TOPMOST, (0, 0, 0))[1]))
+            elif J_TOPMOST in kinds:
+                if reattach:
+                    self.window_state.set_topmost(hwnd, True)
+                else:
+                    set_topmost(hwnd, bool(kinds[J_TOPMOST][1]))
+                    self.journal.clear(J_TOPMOST, hwnd)
+        return handled
+
+    @recorder.span('controller:rollback_all')
+    def rollback_all(self):
+        """退出前还原所有被修改过的窗口"""
+        self.end_peek()
+        for hwnd in self.window_state.transparent_hwnds():
+            state = self.window_state.clear_transparent(hwnd)
+            if state is not None and is_window(hwnd):
+                self._restore_transparent(hwnd, state[2])
+            self._close_overlay(hwnd)
+        self.throttle.restore_all()
+        for (hwnd, kind), (pid, orig, new) in list(self.journal.live.items()):
+            if not is_window(hwnd) or get_window_pid(hwnd) != pid:
+                continue
+            if kind == J_TOPMOST:
+                set_topmost(hwnd, bool(orig))
+            elif kind == J_MINIMIZED:
+                restore_window(hwnd)
+        self.window_state.clear()
+        self.only_shown_hwnd = None
+        self._set_dim_targets(())
+        self.journal.reset()
 
 
 # ---------------------------
@@ -637,6 +6120,17 @@ class AppWindow(QtWidgets.QMainWindow):
         self.status_label = QtWidgets.QLabel("运行中，托盘可用。Ctrl+Alt+T/M/P/G 等", self)
         self.setCentralWidget(self.status_label)
         self.prompt = None
+        self.install_dump_signal()
+        # 控制器（可能在钩子线程中）发来的 UI 事件，每轮事件循环合并处理一次
+        bus = self.controller.ui
+        bus.register('message', self._show_messages, coalesce='all')
+        bus.register('group_prompt', self.show_group_prompt, coalesce='last')
+        bus.register('overlay', self._sync_overlays, coalesce='all')
+        bus.register('pick', lambda _: self.start_pick_mode(), coalesce='last')
+        bus.register('dim', self._sync_dim, coalesce='last')
+        bus.register('peek', self._peek_overlays, coalesce='last')
+        self.picker = None
+        self.dim_overlays = {}  # QScreen -> DimOverlay
 
     def create_tray_menu(self):
         menu = QtWidgets.QMenu()
@@ -681,14 +6175,71 @@ class AppWindow(QtWidgets.QMainWindow):
 
         open_groups_action = menu.addAction("打开分组管理")
         open_groups_action.triggered.connect(self.open_group_manager)
+        self.profile_menu = menu.addMenu("布局方案")
+        self.profile_menu.aboutToShow.connect(self._populate_profile_menu)
+        self.dim_action = menu.addAction("仅显示时变暗其它窗口（不最小化）")
+        self.dim_action.setCheckable(True)
+        self.dim_action.setChecked(self.model.settings.get('show_only_style') == 'dim')
+        self.dim_action.toggled.connect(self.set_dim_style)
+        rules_action = menu.addAction("重新加载窗口规则和程序快捷键")
+        rules_action.triggered.connect(self.controller.reload_rules)
         hotkey_action = menu.addAction("修改快捷键")
         hotkey_action.triggered.connect(self.open_hotkey_config)
+        stats_action = menu.addAction("运行统计")
+        stats_action.triggered.connect(self.show_stats)
+        self.session_action = menu.addAction("录制会话")
+        self.session_action.triggered.connect(self.toggle_session_recording)
+        self.profile_tools_menu = menu.addMenu("性能分析")
+        self.profile_tools_menu.aboutToShow.connect(self._populate_profiler_menu)
+        trace_action = menu.addAction("导出运行记录")
+        trace_action.triggered.connect(self.dump_trace)
         about_action = menu.addAction("关于")
         about_action.triggered.connect(self.show_about)
         exit_action = menu.addAction("退出")
         exit_action.triggered.connect(self.quit_app)
         self.tray.setContextMenu(menu)
 
+    def _populate_profile_menu(self):
+        """托盘“布局方案”子菜单: 每次展开时按当前方案重建"""
+        menu = self.profile_menu
+        menu.clear()
+        save_action = menu.addAction("保存当前布局…")
+        save_action.triggered.connect(self.save_profile)
+        names = list(self.model.profiles)
+        if names:
+            menu.addSeparator()
+            key = actions.key_for('restore_profile', self.model.hotkeys).upper()
+            for i, name in enumerate(names):
+                label = f"{name}\tCtrl+Alt+{key}, {(i + 1) % 10}" if i < 10 else name
+                act = menu.addAction(label)
+                act.triggered.connect(lambda checked=False, n=name: self.controller.restore_profile(n))
+            delete_menu = menu.addMenu("删除布局")
+            for name in names:
+                act = delete_menu.addAction(name)
+                act.triggered.connect(lambda checked=False, n=name: self.model.delete_profile(n))
+
+    def set_dim_style(self, on):
+        self.model.settings['show_only_style'] = 'dim' if on else 'minimize'
+        self.model.save()
+
+    @QtCore.pyqtSlot()
+    def save_profile(self):
+        name, ok = QtWidgets.QInputDialog.getText(None, "保存布局", "布局名称（如 coding / meeting）：")
+        name = name.strip()
+        if ok and name:
+            n = self.controller.capture_profile(name)
+            self.show_message(f"已保存布局「{name}」（{n} 个窗口）")
+
+    def start_pick_mode(self):
+        if self.picker is not None:
+            return
+        self.picker = PickOverlay(self.model, self.controller)
+        self.picker.finished.connect(self._on_pick_finished)
+        self.picker.start()
+
+    def _on_pick_finished(self):
+        self.picker = None
+
     @QtCore.pyqtSlot()
     def open_group_manager(self):
         # fallback when invoked from menu: no selected hwnd
@@ -811,42 +6362,115 @@ class AppWindow(QtWidgets.QMainWindow):
         about_widget.mousePressEvent = mousePressEvent
         about_widget.mouseMoveEvent = mouseMoveEvent
 
+    @QtCore.pyqtSlot()
+    def show_stats(self):
+        stats = self.controller.stats()
+        lines = []
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                lines.append(f"{key}: " + ", ".join(f"{k}={v}" for k, v in value.items()))
+            else:
+                lines.append(f"{key}: {value}")
+        QtWidgets.QMessageBox.information(None, "运行统计", "\n".join(lines))
+
+    @QtCore.pyqtSlot()
+    def dump_trace(self):
+        """把运行记录导出为 Chrome Trace JSON（可在 chrome://tracing 或 Perfetto 中打开）"""
+        try:
+            path = recorder.dump_chrome_trace()
+            self.show_message(f"运行记录已导出: {path}")
+        except Exception as e:
+            log_error("dump_trace", e)
+
+    def _populate_profiler_menu(self):
+        menu = self.profile_tools_menu
+        menu.clear()
+        if profiler.running:
+            stop_action = menu.addAction(f"停止并保存（已采样 {profiler.samples} 次）")
+            stop_action.triggered.connect(self.stop_profiler)
+        else:
+            start_action = menu.addAction("开始采样")
+            start_action.triggered.connect(lambda checked=False: self.start_profiler(False))
+            alloc_action = menu.addAction("开始采样 + 内存分配跟踪")
+            alloc_action.triggered.connect(lambda checked=False: self.start_profiler(True))
+
+    def start_profiler(self, track_allocations):
+        profiler.start(track_allocations)
+        self.show_message("性能分析已开始（托盘 → 性能分析 → 停止并保存）")
+
+    @QtCore.pyqtSlot()
+    def stop_profiler(self):
+        try:
+            paths = profiler.stop()
+            if paths:
+                self.show_message(f"性能分析已保存: {paths[0]}")
+        except Exception as e:
+            log_error("profiler", e)
+
+    @QtCore.pyqtSlot()
+    def toggle_session_recording(self):
+        """开始 / 停止录制窗口与热键事件（python main.py --replay <文件> 可在任意平台重放）"""
+        try:
+            if session_tape.active:
+                count = session_tape.count
+                path = session_tape.stop()
+                self.session_action.setText("录制会话")
+                self.show_message(f"会话已保存（{count} 条事件）: {path}")
+            else:
+                session_tape.start(self.model)
+                self.session_action.setText("停止录制会话")
+                self.show_message("开始录制会话（托盘 → 停止录制会话）")
+        except Exception as e:
+            log_error("session recording", e)
+
+    def install_dump_signal(self):
+        """Ctrl+Break（Windows）或 SIGUSR1（其它平台）触发导出运行记录"""
+        sig = getattr(signal, 'SIGBREAK', None) or getattr(signal, 'SIGUSR1', None)
+        if sig is None:
+            return
+        try:
+            signal.signal(sig, lambda *_: self.dump_trace())
+        except (ValueError, OSError) as e:
+            log_error("install_dump_signal", e)
+            return
+        # Qt 事件循环阻塞在 C++ 中，定时让出给 Python 以便处理信号
+        self._signal_timer = QtCore.QTimer(self)
+        self._signal_timer.timeout.connect(lambda: None)
+        self._signal_timer.start(500)
+
     @QtCore.pyqtSlot()
     def quit_app(self):
+        if profiler.running:
+            self.stop_profiler()
+        session_tape.stop()
+        event_stream.stop()
+        if self.controller.hotkey_source is not None:
+            self.controller.hotkey_source.stop()
+        try:
+            self.controller.rollback_all()
+            self.controller.journal.close()
+        except Exception as e:
+            log_error("rollback", e)
         QtWidgets.QApplication.quit()
 
-    # @QtCore.pyqtSlot(int)
-    # def show_group_prompt(self, gid):
-    #     # show a small non-modal prompt telling user to press a letter for action
-    #     if self.prompt:
-    #         try:
-    #             self.prompt.close()
-    #         except:
-    #             pass
-    #     self.prompt = QtWidgets.QWidget(
-    #         flags=QtCore.Qt.Tool | QtCore.Qt.WindowStaysOnTopHint | QtCore.Qt.FramelessWindowHint)
-    #     self.prompt.setLayout(QtWidgets.QVBoxLayout())
-    #     self.prompt.layout().addWidget(
-    #         QtWidgets.QLabel(f"分组 {gid} - 请输入一个字母执行操作（T:置顶, M:仅显示, P:半透明）"))
-    #     self.prompt.adjustSize()
-    #     cursor_pos = QtGui.QCursor.pos()
-    #     self.prompt.move(cursor_pos.x(), cursor_pos.y())
-    #     self.prompt.show()
-    #     self._group_prompt_gid = gid
-    #     self.prompt.keyPressEvent = lambda ev: self._on_prompt_key(ev)
-    #     QtCore.QTimer.singleShot(4000, lambda: (self.prompt.close() if self.prompt else None))
-    @QtCore.pyqtSlot(int)
     def show_group_prompt(self, gid):
-        # show a small non-modal prompt telling user to press a letter for action
+        # show a small non-modal prompt telling user to press a letter for action; gid 为 None 时关闭
         if self.prompt:
             try:
                 self.prompt.close()
             except:
                 pass
+            self.prompt = None
+        if gid is None:
+            return
         self.prompt = QtWidgets.QWidget(
             flags=QtCore.Qt.Tool | QtCore.Qt.WindowStaysOnTopHint | QtCore.Qt.FramelessWindowHint)
+        # 只显示，不抢焦点: 后续字母键由全局组合键引擎处理
+        self.prompt.setAttribute(QtCore.Qt.WA_ShowWithoutActivating)
         self.prompt.setLayout(QtWidgets.QVBoxLayout())
-        label = QtWidgets.QLabel(f"分组 {gid} - 请输入一个字母执行操作（T:置顶, M:仅显示, P:半透明）")
+        keys = ", ".join(f"{actions.key_for(s.name, self.model.hotkeys).upper()}:{s.label}"
+                         for s in actions.specs('window', 'group'))
+        label = QtWidgets.QLabel(f"{self.model.group_label(gid)} - 请输入一个字母执行操作（{keys}）")
         label.setAlignment(QtCore.Qt.AlignCenter)
         self.prompt.layout().addWidget(label)
         self.prompt.adjustSize()
@@ -868,23 +6492,9 @@ class AppWindow(QtWidgets.QMainWindow):
         cursor_pos = QtGui.QCursor.pos()
         self.prompt.move(cursor_pos.x(), cursor_pos.y())
         self.prompt.show()
-        self._group_prompt_gid = gid
-        self.prompt.keyPressEvent = lambda ev: self._on_prompt_key(ev)
-        QtCore.QTimer.singleShot(4000, lambda: (self.prompt.close() if self.prompt else None))
-
-
-
-
-    def _on_prompt_key(self, ev):
-        ch = ev.text().lower()
-        gid = getattr(self, '_group_prompt_gid', None)
-        if not gid:
-            return
-        action_map = {'t': 'topmost', 'm': 'show_only', 'p': 'transparent'}
-        if ch in action_map:
-            self.prompt.close()
-            self.controller.pending_group = gid
-            self.controller.on_action_trigger(action_map[ch])
+        prompt = self.prompt
+        QtCore.QTimer.singleShot(int(CHORD_STEP_TIMEOUT * 1000),
+                                 lambda: prompt.close() if self.prompt is prompt else None)
 
     # @QtCore.pyqtSlot(str)
     # def show_message(self, text):
@@ -894,7 +6504,8 @@ class AppWindow(QtWidgets.QMainWindow):
     #         pass
     #     self.status_label.setText(text)
     @QtCore.pyqtSlot(str)
-    def show_message(self, text):
+    @recorder.span('ui:toast')
+    def show_message(self, text, icon=None):
         # 更新状态栏文字
         self.status_label.setText(text)
 
@@ -938,8 +6549,13 @@ class AppWindow(QtWidgets.QMainWindow):
 
         label = QtWidgets.QLabel(text, popup)
         label.setWordWrap(True)
-        layout = QtWidgets.QVBoxLayout(popup)
-        layout.addWidget(label)
+        layout = QtWidgets.QHBoxLayout(popup)
+        if icon is not None:
+            icon_label = QtWidgets.QLabel(popup)
+            icon_label.setPixmap(icon.pixmap(font_size + 4, font_size + 4))
+            icon_label.setStyleSheet("padding: 0px; background: transparent;")
+            layout.addWidget(icon_label)
+        layout.addWidget(label, 1)
         popup.adjustSize()
 
         # 定位到屏幕右下角
@@ -966,23 +6582,81 @@ class AppWindow(QtWidgets.QMainWindow):
         QtCore.QTimer.singleShot(500, start_fade)  # 0.5 秒后开始淡出
         QtCore.QTimer.singleShot(1500, close_popup)  # 1.5 秒后关闭
 
+    def _show_messages(self, payloads):
+        """同一轮中的多条提示合并成一个弹窗；提示可以是 文本 或 (文本, hwnd)，后者带程序图标"""
+        texts = [p[0] if isinstance(p, tuple) else p for p in payloads]
+        if len(payloads) == 1:
+            p = payloads[0]
+            self.show_message(texts[0], icon=icon_cache.icon_for_hwnd(p[1]) if isinstance(p, tuple) else None)
+            return
+        unique = list(dict.fromkeys(texts))
+        shown = unique[-4:]
+        if len(unique) > len(shown):
+            shown.insert(0, f"…等 {len(texts)} 条")
+        self.show_message("\n".join(shown))
+
+    @recorder.span('ui:sync_overlays')
+    def _sync_overlays(self, changes):
+        """一次处理本轮所有控制条的创建 / 关闭，同一窗口只取最后状态"""
+        final = {}
+        for hwnd, on in changes:
+            final[hwnd] = on
+        for hwnd, on in final.items():
+            if on:
+                self._create_overlay_for_hwnd(hwnd)
+            else:
+                self._close_overlay_for_hwnd(hwnd)
+
+    def _peek_overlays(self, on):
+        """按住透视期间把半透明窗口的控制条也隐去"""
+        for ov in self.controller.overlay_windows.values():
+            ov.setWindowOpacity(0.0 if on else 0.95)
+
+    @recorder.span('ui:dim')
+    def _sync_dim(self, targets):
+        """变暗遮罩: targets 为空时隐藏；否则每个显示器一层，挖空目标窗口的当前位置"""
+        if not targets:
+            for ov in self.dim_overlays.values():
+                ov.hide()
+            return
+        screens = QtWidgets.QApplication.screens()
+        for screen in [s for s in self.dim_overlays if s not in screens]:
+            self.dim_overlays.pop(screen).deleteLater()
+        rects = [r for r in (get_window_rect(h) for h in targets) if r]
+        for screen in screens:
+            ov = self.dim_overlays.get(screen)
+            if ov is None:
+                ov = self.dim_overlays[screen] = DimOverlay(screen, self.model.settings.get('dim_opacity', 0.6))
+            ov.set_cutouts(rects)
+
+    def _close_overlay_for_hwnd(self, hwnd):
+        # --- 修复闪退关键 ---
+        overlays = self.controller.overlay_windows
+        if hwnd in overlays:
+            try:
+                ov = overlays.pop(hwnd)
+                self.controller.window_state.unmap_overlay(int(ov.winId()))
+                # 先停止计时器再安全关闭
+                if hasattr(ov, "poll_timer"):
+                    ov.poll_timer.stop()
+                    ov.poll_timer.deleteLater()
+                ov.deleteLater()  # 使用 Qt 安全删除
+            except Exception as e:
+                log_error("overlay close", e, hwnd)
+
     @QtCore.pyqtSlot(int)
+    @recorder.span('ui:create_overlay')
     def _create_overlay_for_hwnd(self, hwnd):
         if not is_window(hwnd):
             return
         # recreate if exists
-        if hwnd in self.controller.overlay_windows:
-            try:
-                self.controller.overlay_windows[hwnd].close()
-            except:
-                pass
+        self._close_overlay_for_hwnd(hwnd)
         ov = OverlayWindow(hwnd, self.controller)
         ov.show()
         self.controller.overlay_windows[hwnd] = ov
         # map overlay window id -> target hwnd (so we can detect focus being on overlay)
         try:
-            wid = int(ov.winId())
-            self.controller.overlay_winid_map[wid] = hwnd
+            self.controller.window_state.map_overlay(int(ov.winId()), hwnd)
         except Exception:
             pass
 
@@ -1006,6 +6680,14 @@ class DragList(QtWidgets.QListWidget):
         super().__init__(*args, **kwargs)
         self.setDragEnabled(True)
         self.setDefaultDropAction(QtCore.Qt.MoveAction)
+        icon_cache.icons_ready.connect(self.on_icons_ready)
+
+    def on_icons_ready(self, paths):
+        for i in range(self.count()):
+            it = self.item(i)
+            path = it.data(ICON_ROLE)
+            if path in paths:
+                it.setIcon(icon_cache.icon_for_path(path))
 
     def startDrag(self, supportedActions):
         items = self.selectedItems()
@@ -1057,10 +6739,7 @@ class DropList(DragList):
                 except:
                     continue
                 if is_window(h):
-                    title = hwnd_to_title(h)
-                    it = QtWidgets.QListWidgetItem(f"{title} ({h})")
-                    it.setData(QtCore.Qt.UserRole, h)
-                    self.addItem(it)
+                    self.addItem(window_list_item(h))
                     added.append(h)
         else:
             # fallback to text parse
@@ -1070,10 +6749,7 @@ class DropList(DragList):
                     try:
                         h = int(line.split('(')[-1][:-1])
                         if is_window(h):
-                            title = hwnd_to_title(h)
-                            it = QtWidgets.QListWidgetItem(f"{title} ({h})")
-                            it.setData(QtCore.Qt.UserRole, h)
-                            self.addItem(it)
+                            self.addItem(window_list_item(h))
                             added.append(h)
                     except:
                         pass
@@ -1156,34 +6832,46 @@ class GroupManager(QtWidgets.QDialog):
         right_box = QtWidgets.QVBoxLayout()
         header_layout = QtWidgets.QHBoxLayout()
         header_layout.addWidget(QtWidgets.QLabel("分组"))
+        self.group_filter = QtWidgets.QLineEdit()
+        self.group_filter.setPlaceholderText("搜索分组（名称或 项目/子分组）")
+        self.group_filter.textChanged.connect(lambda _: self.reload_group_order())
+        header_layout.addWidget(self.group_filter, 1)
+        btn_new_group = QtWidgets.QPushButton("新建分组")
+        btn_new_group.clicked.connect(lambda: self.new_group())
+        header_layout.addWidget(btn_new_group)
         btn_edit_names = QtWidgets.QPushButton("编辑分组名")
         btn_edit_names.clicked.connect(self.edit_group_names)
         header_layout.addWidget(btn_edit_names)
+        btn_pick = QtWidgets.QPushButton("拾取窗口")
+        btn_pick.setToolTip("点选屏幕上的窗口加入分组（右键 / Esc 退出）")
+        btn_pick.clicked.connect(self.start_pick)
+        header_layout.addWidget(btn_pick)
         right_box.addLayout(header_layout)
 
+        # 分组卡片（名称 + 窗口列表）只为当前页创建，创建后缓存到对话框关闭
         self.group_lists = {}
-        group_grid = QtWidgets.QGridLayout()
-        for i in [1, 2, 3, 4, 5, 6, 7, 8, 9, 0]:
-            if i in [1, 2, 3, 4, 5, 6, 7, 8, 9]:
-                j = i - 1
-            else:
-                j = 9
-            # label that supports double-click rename
-            lbl = QtWidgets.QLabel(self.model.group_names.get(i, f"组 {i}"))
-            lbl.setObjectName(f"group_label_{i}")
-            lbl.setAlignment(QtCore.Qt.AlignCenter)
-            lbl.setFrameStyle(QtWidgets.QFrame.Panel | QtWidgets.QFrame.Raised)
-            lbl.mouseDoubleClickEvent = partial(self.rename_group_label, i, lbl)
-            group_grid.addWidget(lbl, j // 5 * 2, j % 5)
-
-            w = DropList()
-            w.setObjectName(f"group_{i}")
-            # Track drag start to identify source group
-            w.startDrag = partial(self.on_group_drag_start, i, w.startDrag)
-
-            group_grid.addWidget(w, j // 5 * 2 + 1, j % 5)
-            self.group_lists[i] = w
-        right_box.addLayout(group_grid)
+        self.group_labels = {}
+        self.group_cards = {}
+        self.group_order = []
+        self.page = 0
+        self.group_grid = QtWidgets.QGridLayout()
+        grid_host = QtWidgets.QWidget()
+        grid_host.setLayout(self.group_grid)
+        scroll = QtWidgets.QScrollArea()
+        scroll.setWidgetResizable(True)
+        scroll.setWidget(grid_host)
+        right_box.addWidget(scroll, 1)
+        pager = QtWidgets.QHBoxLayout()
+        self.btn_prev_page = QtWidgets.QPushButton("◀ 上一页")
+        self.btn_prev_page.clicked.connect(lambda: self.show_page(self.page - 1))
+        self.page_label = QtWidgets.QLabel()
+        self.page_label.setAlignment(QtCore.Qt.AlignCenter)
+        self.btn_next_page = QtWidgets.QPushButton("下一页 ▶")
+        self.btn_next_page.clicked.connect(lambda: self.show_page(self.page + 1))
+        pager.addWidget(self.btn_prev_page)
+        pager.addWidget(self.page_label, 1)
+        pager.addWidget(self.btn_next_page)
+        right_box.addLayout(pager)
 
         # Add delete zone
         delete_label = QtWidgets.QLabel("删除区")
@@ -1204,7 +6892,7 @@ class GroupManager(QtWidgets.QDialog):
         layout.addLayout(right_box, 2)
 
         self.refresh_all_windows()
-        self.load_groups()
+        self.reload_group_order()
         # if select_hwnd provided, select it
         if select_hwnd:
             self.select_left_hwnd(select_hwnd)
@@ -1296,33 +6984,167 @@ class GroupManager(QtWidgets.QDialog):
     def refresh_all_windows(self):
         self.all_list.clear()
         for hwnd, title in enum_windows():
-            item = QtWidgets.QListWidgetItem(f"{title} ({hwnd})")
-            item.setData(QtCore.Qt.UserRole, hwnd)
-            self.all_list.addItem(item)
+            self.all_list.addItem(window_list_item(hwnd, title))
+
+    def start_pick(self):
+        # 对话框处于 exec_() 中，hide() 会结束对话框，这里只最小化让出屏幕
+        self.showMinimized()
+        picker = PickOverlay(self.model, self.controller, add_to_group=self.add_picked)
+        picker.finished.connect(self.showNormal)
+        picker.start()
+
+    def add_picked(self, group_id, hwnd):
+        """拾取到的窗口先加到分组列表，与拖拽一样点“保存分组”后生效"""
+        self._group_card(group_id)
+        w = self.group_lists[group_id]
+        for idx in range(w.count()):
+            if w.item(idx).data(QtCore.Qt.UserRole) == hwnd:
+                return
+        w.addItem(window_list_item(hwnd))
+
+    GROUP_PAGE_SIZE = 10
+    GROUP_COLUMNS = 5
+
+    def _group_title(self, gid):
+        digit = self.model.shortcut_of(gid)
+        title = self.model.group_label(gid)
+        return f"{title}  [{digit}]" if digit is not None else title
+
+    def _group_card(self, gid):
+        """按需创建一个分组卡片并载入其窗口"""
+        card = self.group_cards.get(gid)
+        if card is not None:
+            return card
+        card = QtWidgets.QWidget()
+        box = QtWidgets.QVBoxLayout(card)
+        box.setContentsMargins(0, 0, 0, 0)
+        # label that supports double-click rename
+        lbl = QtWidgets.QLabel(self._group_title(gid))
+        lbl.setObjectName(f"group_label_{gid}")
+        lbl.setAlignment(QtCore.Qt.AlignCenter)
+        lbl.setFrameStyle(QtWidgets.QFrame.Panel | QtWidgets.QFrame.Raised)
+        lbl.mouseDoubleClickEvent = partial(self.rename_group_label, gid, lbl)
+        lbl.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
+        lbl.customContextMenuRequested.connect(partial(self.group_context_menu, gid, lbl))
+        box.addWidget(lbl)
+        w = DropList()
+        w.setObjectName(f"group_{gid}")
+        w.setMinimumHeight(120)
+        # Track drag start to identify source group
+        w.startDrag = partial(self.on_group_drag_start, gid, w.startDrag)
+        for hwnd in self.model.groups.get(gid, []):
+            if is_window(hwnd):
+                w.addItem(window_list_item(hwnd))
+        box.addWidget(w)
+        self.group_cards[gid] = card
+        self.group_labels[gid] = lbl
+        self.group_lists[gid] = w
+        return card
+
+    def reload_group_order(self):
+        """按层级顺序（可按名称过滤）重新计算分页，停留在当前页附近"""
+        text = self.group_filter.text().strip().lower()
+        order = [gid for gid, _ in self.model.group_tree()]
+        if text:
+            exact = set(self.model.find_groups(text))
+            order = [gid for gid in order
+                     if gid in exact or text in self.model.group_label(gid).lower()]
+        self.group_order = order
+        for gid in [g for g in self.group_cards if g not in self.model.groups]:
+            # 已删除的分组
+            self.group_cards.pop(gid).deleteLater()
+            self.group_labels.pop(gid, None)
+            self.group_lists.pop(gid, None)
+        for gid, lbl in self.group_labels.items():
+            lbl.setText(self._group_title(gid))
+        self.show_page(self.page)
+
+    def show_page(self, page):
+        size = self.GROUP_PAGE_SIZE
+        pages = max(1, (len(self.group_order) + size - 1) // size)
+        self.page = max(0, min(page, pages - 1))
+        while self.group_grid.count():
+            item = self.group_grid.takeAt(0)
+            if item.widget():
+                item.widget().hide()
+        for n, gid in enumerate(self.group_order[self.page * size:(self.page + 1) * size]):
+            card = self._group_card(gid)
+            self.group_grid.addWidget(card, n // self.GROUP_COLUMNS, n % self.GROUP_COLUMNS)
+            card.show()
+        self.page_label.setText(f"第 {self.page + 1}/{pages} 页（{len(self.group_order)} 个分组）")
+        self.btn_prev_page.setEnabled(self.page > 0)
+        self.btn_next_page.setEnabled(self.page < pages - 1)
+
+    def new_group(self, parent=None):
+        prompt = f"在「{self.model.group_label(parent)}」下新建子分组：" if parent is not None else "分组名称："
+        text, ok = QtWidgets.QInputDialog.getText(self, "新建分组", prompt)
+        if ok and text.strip():
+            gid = self.model.create_group(text.strip(), parent)
+            self.reload_group_order()
+            if gid in self.group_order:
+                self.show_page(self.group_order.index(gid) // self.GROUP_PAGE_SIZE)
+
+    def group_context_menu(self, gid, label_widget, pos):
+        menu = QtWidgets.QMenu(self)
+        menu.addAction("重命名", lambda: self.rename_group_label(gid, label_widget, None))
+        menu.addAction("新建子分组", lambda: self.new_group(gid))
+        move_menu = menu.addMenu("移动到")
+        move_menu.addAction("（顶层）", lambda: self._move_group(gid, None))
+        for other, depth in self.model.group_tree():
+            if other != gid:
+                move_menu.addAction("    " * depth + self.model.group_names.get(other, f"组 {other}"),
+                                    lambda o=other: self._move_group(gid, o))
+        digit_menu = menu.addMenu("绑定数字键")
+        current = self.model.shortcut_of(gid)
+        for d in "1234567890":
+            owner = self.model.group_for_digit(d)
+            label = f"Ctrl+Alt+{d}" + (f"（当前: {self.model.group_label(owner)}）" if owner not in (None, gid) else "")
+            act = digit_menu.addAction(label, lambda d=d: self._bind_digit(d, gid))
+            act.setCheckable(True)
+            act.setChecked(d == current)
+        if current is not None:
+            digit_menu.addSeparator()
+            digit_menu.addAction("解除绑定", lambda: self._bind_digit(current, None))
+        menu.addSeparator()
+        menu.addAction("删除分组", lambda: self._delete_group(gid))
+        menu.exec_(label_widget.mapToGlobal(pos))
+
+    def _move_group(self, gid, parent):
+        if not self.model.set_group_parent(gid, parent):
+            QtWidgets.QMessageBox.warning(self, "移动分组", "不能移动到自己的子分组下")
+        self.reload_group_order()
+
+    def _bind_digit(self, digit, gid):
+        self.model.bind_shortcut(digit, gid)
+        self.reload_group_order()
+
+    def _delete_group(self, gid):
+        ret = QtWidgets.QMessageBox.question(self, "删除分组",
+                                             f"删除「{self.model.group_label(gid)}」？（子分组会上移一级）")
+        if ret == QtWidgets.QMessageBox.Yes:
+            self.model.delete_group(gid)
+            self.reload_group_order()
 
     def load_groups(self):
-        for i, w in self.group_lists.items():
+        """重新载入已创建的分组卡片（未打开过的页在显示时再载入）"""
+        for gid, w in self.group_lists.items():
             w.clear()
-            for hwnd in self.model.groups.get(i, []):
+            for hwnd in self.model.groups.get(gid, []):
                 if is_window(hwnd):
-                    title = hwnd_to_title(hwnd)
-                    it = QtWidgets.QListWidgetItem(f"{title} ({hwnd})")
-                    it.setData(QtCore.Qt.UserRole, hwnd)
-                    w.addItem(it)
-            # update label text in case name changed
-            lbl = self.findChild(QtWidgets.QLabel, f"group_label_{i}")
-            if lbl:
-                lbl.setText(self.model.group_names.get(i, f"组 {i}"))
+                    w.addItem(window_list_item(hwnd))
+        self.reload_group_order()
 
     def save_groups(self):
-        for i, w in self.group_lists.items():
+        mapping = {}
+        for gid, w in self.group_lists.items():
             hwnds = []
             for idx in range(w.count()):
                 item = w.item(idx)
                 hwnd = item.data(QtCore.Qt.UserRole)
                 if is_window(hwnd):
                     hwnds.append(hwnd)
-            self.model.set_group(i, hwnds)
+            mapping[gid] = hwnds
+        self.model.set_groups(mapping)
         QtWidgets.QMessageBox.information(self, "保存", "已保存分组到配置文件")
         self.accept()
 
@@ -1340,27 +7162,30 @@ class GroupManager(QtWidgets.QDialog):
                                                   text=self.model.group_names.get(group_id, f"组 {group_id}"))
         if ok and text.strip():
             self.model.set_group_name(group_id, text.strip())
-            label_widget.setText(text.strip())
+            self.reload_group_order()
 
     def edit_group_names(self):
+        """批量编辑当前页分组的名称"""
         dlg = QtWidgets.QDialog(self)
         dlg.setWindowTitle("编辑分组名")
         layout = QtWidgets.QFormLayout(dlg)
         edits = {}
-        for i in range(10):
+        size = self.GROUP_PAGE_SIZE
+        for i in self.group_order[self.page * size:(self.page + 1) * size]:
             e = QtWidgets.QLineEdit(self.model.group_names.get(i, f"组 {i}"))
             edits[i] = e
-            layout.addRow(f"组 {i}:", e)
+            digit = self.model.shortcut_of(i)
+            layout.addRow(f"[{digit}]:" if digit is not None else "—:", e)
         btn = QtWidgets.QPushButton("保存")
         btn.clicked.connect(lambda: (self._save_group_names(edits), dlg.accept()))
         layout.addRow(btn)
         dlg.exec_()
-        self.load_groups()
+        self.reload_group_order()
 
     def _save_group_names(self, edits):
         for i, e in edits.items():
             val = e.text().strip()
-            if val:
+            if val and val != self.model.group_names.get(i):
                 self.model.set_group_name(i, val)
 
 
@@ -1379,19 +7204,11 @@ class HotkeyConfigDialog(QtWidgets.QDialog):
         self.resize(400, 200)
         layout = QtWidgets.QFormLayout(self)
         self.inputs = {}
-        # === 动作名称映射（显示为中文） ===
-        action_labels = {
-            'topmost': '置顶窗口',
-            'show_only': '仅显示',
-            'transparent': '半透明',
-            'open_group_manager': '打开分组管理',
-        }
-
-        for action in ['topmost', 'show_only', 'transparent', 'open_group_manager']:
-            label_text = action_labels.get(action, action)
-            inp = QtWidgets.QLineEdit(self.model.hotkeys.get(action, ''))
-            layout.addRow(label_text + "：", inp)
-            self.inputs[action] = inp
+        # 动作列表与显示名来自动作注册表（含插件动作）
+        for spec in actions.specs():
+            inp = QtWidgets.QLineEdit(actions.key_for(spec.name, self.model.hotkeys))
+            layout.addRow(spec.label + "：", inp)
+            self.inputs[spec.name] = inp
         btn = QtWidgets.QPushButton("保存")
         btn.clicked.connect(self.save_and_close)
         layout.addRow(btn)
@@ -1443,27 +7260,277 @@ class HotkeyConfigDialog(QtWidgets.QDialog):
 
 
     def save_and_close(self):
+        hotkeys = {}
         for action, inp in self.inputs.items():
             val = inp.text().strip().lower()
             if not val:
                 QtWidgets.QMessageBox.warning(self, "错误", f"{action} 不能为空")
                 return
-            self.model.hotkeys[action] = val
-        self.model.save()
+            hotkeys[action] = val
+        self.model.set_hotkeys(hotkeys)
         self.accept()
 
 
+# ---------------------------
+# Session replay (headless load generator)
+# ---------------------------
+
+def _percentiles(values):
+    if not values:
+        return (0, 0, 0, 0)
+    values = sorted(values)
+    n = len(values)
+    return tuple(values[min(n - 1, int(n * q))] for q in (0.5, 0.9, 0.99)) + (values[-1],)
+
+
+def _resident_bytes():
+    """当前进程常驻内存（Linux 读 /proc，其它平台返回 0）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def generate_session(path, windows=200, events=20000, seed=1):
+    """生成合成会话: windows 个初始窗口，随后 events 条前台切换 / 标题 / 移动 / 开关窗口 / 热键事件"""
+    import gzip
+    import random
+    rng = random.Random(seed)
+    exes = [f"C:\\Apps\\app{i}.exe" for i in range(max(4, windows // 6))]
+    alive = []
+    next_hwnd = [0x10000]
+
+    def open_window(f, dt):
+        hwnd = next_hwnd[0]
+        next_hwnd[0] += 0x10
+        pid = rng.randrange(len(exes)) + 1000
+        x, y = rng.randint(0, 2400), rng.randint(0, 1200)
+        write_tape_record(f, dt, T_WINDOW, hwnd, pid, (exes[pid - 1000], f"Class{pid % 7}", f"窗口 {hwnd:x}",
+                                                       x, y, x + rng.randint(300, 1400), y + rng.randint(200, 900)))
+        alive.append(hwnd)
+
+    hotkeys = (['topmost', 'show_only', 'transparent'] * 4 + ['focus_mode', 'app_topmost', 'app_show_only',
+               'cycle_next', 'cycle_prev', 'group:show_only', 'group:topmost', 'group:transparent',
+               'group:cycle_next', 'open_group_manager', 'pick_window'])
+    with gzip.open(path, 'wb', compresslevel=6) as f:
+        f.write(TAPE_MAGIC + struct.pack('<Q', time.time_ns()))
+        for _ in range(windows):
+            open_window(f, 0)
+        for hwnd in rng.sample(alive, min(len(alive), 40)):
+            gid = rng.randint(1, 5)
+            write_tape_record(f, 0, T_GROUP, hwnd, gid, (f"组 {gid}",))
+        for _ in range(events):
+            dt = int(rng.expovariate(1 / 20000))  # 平均 20ms 一条
+            r = rng.random()
+            if r < 0.05 or len(alive) < windows // 2:
+                open_window(f, dt)
+            elif r < 0.10:
+                hwnd = alive.pop(rng.randrange(len(alive)))
+                write_tape_record(f, dt, T_DESTROY, hwnd, 0)
+            elif r < 0.55:
+                write_tape_record(f, dt, T_FOREGROUND, rng.choice(alive), 0)
+            elif r < 0.75:
+                write_tape_record(f, dt, T_TITLE, rng.choice(alive), 0, (f"文档 {rng.randrange(10000)} - 编辑器",))
+            elif r < 0.90:
+                x, y = rng.randint(0, 2400), rng.randint(0, 1200)
+                write_tape_record(f, dt, T_MOVE, rng.choice(alive), 0, (x, y, x + 800, y + 600))
+            else:
+                action = rng.choice(hotkeys)
+                group = ''
+                if action.startswith('group:'):
+                    action, group = action[6:], str(rng.randint(1, 5))
+                write_tape_record(f, dt, T_HOTKEY, 0, 0, (action, group, ''))
+    return path
+
+
+def replay_session(path, speed=0.0, trace_memory=False):
+    """
+    在模拟后端上重放录制的会话，驱动真实的 Model / Controller / AppWindow（Qt offscreen 平台，可在无桌面的 Linux 上运行）。
+    speed: 0 为尽快重放，1 为原速，2 为两倍速……
+    每条事件计时“处理（事件回调 / 热键动作）”和“含 UI（再跑一轮 Qt 事件循环，包括提示、控制条、分组管理窗口）”，
+    结束后打印各类事件的 p50/p90/p99/max、内存增长和各状态表的大小。
+    """
+    import shutil
+    import tempfile
+    import tracemalloc
+    global PERSIST_FILE
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    old_persist = PERSIST_FILE
+    workdir = tempfile.mkdtemp(prefix='wm_replay_')
+    PERSIST_FILE = os.path.join(workdir, 'wm_config.json')
+    sim = SimBackend()
+    install_backend(sim)
+    qt_app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([sys.argv[0]])
+    model = Model()
+    controller = Controller(model, install_hooks=False)
+    window = AppWindow(model, controller)
+    handle_ns = {}
+    total_ns = {}
+
+    # 分组管理是模态对话框，重放时改为非模态创建 + 显示一帧后关闭，单独计时
+    def open_group_manager(hwnd):
+        t0 = time.perf_counter_ns()
+        gm = GroupManager(model, controller, select_hwnd=hwnd)
+        gm.show()
+        qt_app.processEvents()
+        gm.close()
+        gm.deleteLater()
+        total_ns.setdefault('group_manager', []).append(time.perf_counter_ns() - t0)
+    controller.group_manager_requested.disconnect()
+    controller.group_manager_requested.connect(open_group_manager)
+
+    if trace_memory:
+        tracemalloc.start()
+    mem = (lambda: tracemalloc.get_traced_memory()[0]) if trace_memory else _resident_bytes
+    mem_start = mem_peak = mem()
+    mem_samples = []
+    count = 0
+    wall0 = time.perf_counter()
+    try:
+        for t_us, kind, hwnd, pid, fields in read_tape(path):
+            if speed > 0:
+                delay = wall0 + t_us / 1e6 / speed - time.perf_counter()
+                while delay > 0:
+                    qt_app.processEvents()
+                    time.sleep(min(delay, 0.005))
+                    delay = wall0 + t_us / 1e6 / speed - time.perf_counter()
+            name = TAPE_KIND_NAMES.get(kind, str(kind))
+            t0 = time.perf_counter_ns()
+            if kind == T_WINDOW:
+                sim.open_window(hwnd, pid, fields[0], fields[1], fields[2], tuple(int(v) for v in fields[3:7]))
+            elif kind == T_DESTROY:
+                sim.close_window(hwnd)
+            elif kind == T_HIDE:
+                sim.hide_window(hwnd)
+            elif kind == T_TITLE:
+                sim.retitle(hwnd, fields[0] if fields else "")
+            elif kind == T_MOVE:
+                sim.move(hwnd, tuple(int(v) for v in fields[:4]))
+            elif kind == T_FOREGROUND:
+                sim.activate(hwnd)
+            elif kind == T_GROUP:
+                gid = pid if pid in model.groups else (model.find_groups(fields[0]) or
+                                                      [model.create_group(fields[0])])[0]
+                model.add_to_group(gid, hwnd)
+            elif kind == T_HOTKEY:
+                action, group, slot = (fields + ['', '', ''])[:3]
+                name = 'hotkey:' + action + (':group' if group else '')
+                args = {}
+                if group:
+                    args['group'] = group
+                if slot:
+                    args['slot'] = slot
+                controller.on_chord(ChordMatch(action, args, (), 0))
+            t1 = time.perf_counter_ns()
+            qt_app.processEvents()
+            if window.picker is not None:
+                window.picker.close()
+            t2 = time.perf_counter_ns()
+            handle_ns.setdefault(name, []).append(t1 - t0)
+            total_ns.setdefault(name, []).append(t2 - t0)
+            count += 1
+            if count % 1000 == 0:
+                m = mem()
+                mem_peak = max(mem_peak, m)
+                mem_samples.append(m)
+    finally:
+        elapsed = time.perf_counter() - wall0
+        mem_end = mem()
+        if trace_memory:
+            mem_peak = max(mem_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        sizes = {
+            'windows': len(sim.windows),
+            'process_index': process_index.stats(),
+            'focus_history': controller.focus_history.stats(),
+            'group_members': sum(len(v) for v in model.groups.values()),
+            'rules_applied': len(controller._rules_applied),
+            'overlays': len(controller.overlay_windows),
+            'window_state': controller.window_state.stats(),
+            'journal_entries': len(controller.journal.live),
+            'throttled_processes': len(controller.throttle.throttled),
+        }
+        controller.rollback_all()
+        controller.journal.close()
+        window.tray.hide()
+        PERSIST_FILE = old_persist
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"重放 {count} 条事件，用时 {elapsed:.2f}s（{count / max(elapsed, 1e-9):,.0f} 条/秒）")
+    print(f"{'事件':<28}{'次数':>7}  {'处理 p50/p90/p99/max (µs)':>30}  {'含 UI p50/p90/p99/max (µs)':>30}")
+    for name in sorted(total_ns):
+        total = "/".join(f"{v / 1000:.0f}" for v in _percentiles(total_ns[name]))
+        handle = "/".join(f"{v / 1000:.0f}" for v in _percentiles(handle_ns[name])) if name in handle_ns else "-"
+        print(f"{name:<28}{len(total_ns[name]):>7}  {handle:>30}  {total:>30}")
+    unit = "tracemalloc" if trace_memory else "RSS"
+    growth = [f"{(m - mem_start) / 1024:.0f}" for m in mem_samples[::max(1, len(mem_samples) // 10)]]
+    print(f"内存（{unit}）: 开始 {mem_start / 1024:.0f} KiB, 结束 {mem_end / 1024:.0f} KiB, "
+          f"峰值 {mem_peak / 1024:.0f} KiB；每千条增长(KiB): {' '.join(growth)}")
+    print("状态: " + ", ".join(f"{k}={v}" for k, v in sizes.items()))
+    return total_ns
+
+
+def bench_session_replay(windows=200, events=20000):
+    """合成一段会话并在模拟后端上尽快重放"""
+    import tempfile
+    fd, path = tempfile.mkstemp(suffix='.wmrec')
+    os.close(fd)
+    try:
+        generate_session(path, windows=windows, events=events)
+        print(f"合成会话: {windows} 个窗口, {events} 条事件, {os.path.getsize(path)} 字节")
+        replay_session(path)
+    finally:
+        os.remove(path)
+
+
 # ---------------------------
 # Main entry
 # ---------------------------
 
+BENCHMARKS = {
+    'chord': bench_chord_dispatch,
+    'x11': bench_x11_backend,
+    'pick': bench_pick_lookup,
+    'rules': bench_rule_matching,
+    'replay': bench_session_replay,
+    'actions': bench_action_registry,
+    'hotkeys': bench_hotkey_backends,
+    'enum': bench_enum_windows,
+}
+
+
+def run_benchmark(name):
+    bench = BENCHMARKS.get(name)
+    if bench is None:
+        print("可用基准:", ", ".join(sorted(BENCHMARKS)))
+        return 1
+    bench()
+    return 0
+
+
 def main():
-    global app, app_window
+    global app
+    if len(sys.argv) >= 2 and sys.argv[1] == '--bench':
+        sys.exit(run_benchmark(sys.argv[2] if len(sys.argv) > 2 else ''))
+    if len(sys.argv) >= 3 and sys.argv[1] == '--replay':
+        replay_session(sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 0.0)
+        sys.exit(0)
+    select_backend()
+    actions.discover(config_path(PLUGIN_DIR))
     model = Model()
     controller = Controller(model)
+    if model.settings.get('event_stream'):
+        try:
+            event_stream.start()
+        except Exception as e:
+            log_error("event stream", e)
     app = QtWidgets.QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(False)
     app_window = AppWindow(model, controller)
+    recovered = controller.recover_from_journal()
+    if recovered:
+        app_window.show_message(f"已恢复上次遗留的 {recovered} 个窗口状态")
     # app_window.show()
     sys.exit(app.exec_())
 
@@ -0,0 +1,12 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def main():
+    # main.py 在导入时需要 PyQt5 和 keyboard
+    return pytest.importorskip('main')
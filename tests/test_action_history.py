@@ -0,0 +1,114 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+def topmost(hwnd, before=False, after=True):
+    return ('topmost', hwnd, before, after)
+
+
+def test_record_outside_transaction_is_one_entry_each(main):
+    history = main.ActionHistory()
+    history.record(topmost(1), "置顶")
+    history.record(topmost(2))
+    assert [label for label, _ in history.undo_stack] == ["置顶", 'topmost']
+    assert history.size == 2
+
+
+def test_nested_transaction_merges_into_outermost(main):
+    history = main.ActionHistory()
+    with history.transaction("分组置顶"):
+        history.record(topmost(1))
+        with history.transaction("内层"):
+            history.record(topmost(2))
+    with history.transaction("空操作"):
+        pass
+    assert list(history.undo_stack) == [("分组置顶", [topmost(1), topmost(2)])]
+
+
+def test_suspended_records_nothing(main):
+    history = main.ActionHistory()
+    with history.transaction("撤销"), history.suspended():
+        history.record(topmost(1))
+    assert not history.undo_stack and history.size == 0
+
+
+def test_pop_done_and_new_action_clears_redo(main):
+    history = main.ActionHistory()
+    history.record(topmost(1))
+    history.record(topmost(2))
+    entry = history.pop()
+    history.done(entry)
+    assert history.stats()['undo'] == 1 and history.stats()['redo'] == 1
+    assert history.pop(redo=True) == entry
+    history.done(entry, redo=True)
+    history.done(history.pop())
+    history.record(topmost(3))
+    assert history.stats() == {'undo': 2, 'redo': 0, 'deltas': 2, 'budget': main.UNDO_BUDGET, 'dropped': 0}
+    assert history.pop(redo=True) is None
+
+
+def test_budget_drops_oldest_but_keeps_newest(main):
+    history = main.ActionHistory(budget=5)
+    for i in range(10):
+        history.record(topmost(i))
+    assert history.size == 5 and history.dropped == 5
+    assert [deltas[0][1] for _, deltas in history.undo_stack] == [5, 6, 7, 8, 9]
+    with history.transaction("大批量"):
+        for i in range(8):
+            history.record(topmost(100 + i))
+    assert len(history.undo_stack) == 1 and history.size == 8  # 单个条目超出预算也保留
+
+
+def test_record_model_diffs_changed_keys_only(main):
+    history = main.ActionHistory()
+    hotkeys, parents = {'topmost': 't'}, {}  # 未替换的字段与旧快照是同一对象
+    old = SimpleNamespace(groups={1: (10,), 2: (20,)}, group_names={1: '工作'}, group_parents=parents,
+                          group_shortcuts={}, hotkeys=hotkeys)
+    new = SimpleNamespace(groups={1: (10, 11), 3: (30,)}, group_names={1: '工作'}, group_parents=parents,
+                          group_shortcuts={}, hotkeys=hotkeys)
+    history.record_model(old, new)
+    (label, [(kind, changes)]), = history.undo_stack
+    assert label == "分组修改" and kind == 'model'
+    assert changes == {'groups': {1: ((10,), (10, 11)), 2: ((20,), main.ABSENT), 3: (main.ABSENT, (30,))}}
+
+
+@pytest.fixture
+def sim_controller(main, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'PERSIST_FILE', str(tmp_path / 'wm_config.json'))
+    sim = main.SimBackend()
+    main.install_backend(sim)
+    for i in range(1, 5):
+        sim.open_window(i * 16, 100 + i, f'/app{i}', 'C', f'窗口 {i}', (i, i, i + 300, i + 200))
+    model = main.Model()
+    controller = main.Controller(model, install_hooks=False)
+    yield sim, model, controller
+    controller.journal.close()
+
+
+def test_group_action_undoes_and_redoes_as_one_step(main, sim_controller):
+    sim, model, controller = sim_controller
+    gid = model.create_group('工作')
+    model.set_group(gid, [16, 32, 48])
+    controller.on_action_trigger('topmost', gid)
+    assert set(controller.window_state.topmost_hwnds()) == {16, 32, 48}
+    label, deltas = controller.history.undo_stack[-1]
+    assert len(deltas) == 3
+
+    controller.undo()
+    assert not controller.window_state.topmost_hwnds()
+    assert all(not sim.is_topmost(h) for h in (16, 32, 48))
+    controller.redo()
+    assert set(controller.window_state.topmost_hwnds()) == {16, 32, 48}
+    assert controller.history.stats()['redo'] == 0
+
+
+def test_model_change_is_undoable(main, sim_controller):
+    _, model, controller = sim_controller
+    gid = model.create_group('工作')
+    model.set_group(gid, [16, 32])
+    model.remove_from_group(gid, 32)
+    controller.undo()
+    assert model.groups[gid] == (16, 32)
+    controller.redo()
+    assert model.groups[gid] == (16,)
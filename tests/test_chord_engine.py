@@ -0,0 +1,106 @@
+import pytest
+
+
+def make_engine(main, bindings, **kwargs):
+    matches, prefixes, cancels = [], [], []
+    engine = main.ChordEngine(on_match=matches.append,
+                              on_prefix=lambda args, keys, acts: prefixes.append((args, acts)),
+                              on_cancel=lambda: cancels.append(1), **kwargs)
+    engine.compile(bindings)
+    return engine, matches, prefixes, cancels
+
+
+def group_bindings(main):
+    B = main.ChordBinding
+    return [
+        B(('ctrl+alt+t',), 'topmost'),
+        B(('ctrl+alt+m',), 'show_only'),
+        B(('ctrl+alt+<group>', 'ctrl+alt+t'), 'topmost', choices={'group': '0123456789'}),
+        B(('ctrl+alt+<group>', 'ctrl+alt+m'), 'show_only', choices={'group': '0123456789'}),
+    ]
+
+
+def test_single_step_chord(main):
+    engine, matches, _, _ = make_engine(main, group_bindings(main))
+    found, latencies = engine.replay(main.press_chord('ctrl+alt+t'))
+    assert [m.action for m in found] == ['topmost']
+    assert matches == found
+    assert len(latencies) == len(main.press_chord('ctrl+alt+t'))
+
+
+def test_group_then_action(main):
+    engine, matches, prefixes, cancels = make_engine(main, group_bindings(main))
+    found, _ = engine.replay(main.press_chord('ctrl+alt+3', 'ctrl+alt+m'))
+    assert [(m.action, m.args) for m in found] == [('show_only', {'group': '3'})]
+    assert prefixes == [({'group': '3'}, frozenset({'topmost', 'show_only'}))]
+    assert not engine.pending
+
+
+def test_releasing_modifier_cancels_prompt(main):
+    engine, matches, prefixes, cancels = make_engine(main, group_bindings(main))
+    events = main.press_chord('ctrl+alt+3') + [('down', 't'), ('up', 't')]
+    found, _ = engine.replay(events)
+    assert found == []
+    assert len(prefixes) == 1 and cancels == [1]
+    # 之后单独按 T 不会再触发分组操作
+    assert engine.replay([('down', 't'), ('up', 't')])[0] == []
+
+
+def test_step_timeout_restarts_from_root(main):
+    engine, matches, _, cancels = make_engine(main, group_bindings(main))
+    t = 10 ** 9
+    for event in (('down', 'ctrl'), ('down', 'alt'), ('down', '2'), ('up', '2')):
+        engine.feed(*event, t_ns=t)
+    assert engine.pending
+    late = t + int((main.CHORD_STEP_TIMEOUT + 1) * 1e9)
+    match = engine.feed('down', 't', t_ns=late)
+    assert match.action == 'topmost' and 'group' not in match.args
+    assert cancels == [1]
+
+
+def test_prefix_that_is_also_complete_fires_on_release(main):
+    B = main.ChordBinding
+    engine, matches, _, _ = make_engine(main, [B(('ctrl+alt+p',), 'peek'),
+                                                B(('ctrl+alt+p', 'ctrl+alt+x'), 'other')])
+    found, _ = engine.replay(main.press_chord('ctrl+alt+p'))
+    assert [m.action for m in found] == ['peek']
+    found, _ = engine.replay(main.press_chord('ctrl+alt+p', 'ctrl+alt+x'))
+    assert [m.action for m in found] == ['other']
+
+
+def test_autorepeat_does_not_refire(main):
+    engine, matches, _, _ = make_engine(main, group_bindings(main))
+    events = [('down', 'ctrl'), ('down', 'alt'), ('down', 't'), ('down', 't'), ('down', 't'),
+              ('up', 't'), ('up', 'alt'), ('up', 'ctrl')]
+    assert len(engine.replay(events)[0]) == 1
+
+
+def test_wildcard_only_accepts_choices(main):
+    engine, matches, prefixes, _ = make_engine(main, group_bindings(main))
+    assert engine.replay(main.press_chord('ctrl+alt+q', 'ctrl+alt+t'))[0][0].args == {}
+    assert prefixes == []
+
+
+def test_conflicting_bindings_raise(main):
+    B = main.ChordBinding
+    engine = main.ChordEngine(on_match=lambda m: None)
+    with pytest.raises(ValueError):
+        engine.compile([B(('ctrl+alt+t',), 'topmost'), B(('ctrl+alt+t',), 'transparent')])
+
+
+def test_use_drops_pending_chord(main):
+    engine, matches, _, _ = make_engine(main, group_bindings(main))
+    other = engine.build([main.ChordBinding(('ctrl+alt+t',), 'transparent')])
+    engine.replay([('down', 'ctrl'), ('down', 'alt'), ('down', '1'), ('up', '1')])
+    assert engine.pending
+    assert engine.use(other) and not engine.pending
+    assert not engine.use(other)
+    assert engine.replay([('down', 't'), ('up', 't')])[0][0].action == 'transparent'
+
+
+def test_default_bindings_cover_every_group_action(main):
+    engine, matches, _, _ = make_engine(main, main.build_chord_bindings({}))
+    for spec in main.actions.specs('window', 'group'):
+        key = main.actions.key_for(spec.name, {})
+        found, _ = engine.replay(main.press_chord('ctrl+alt+5', f'ctrl+alt+{key}'))
+        assert [(m.action, m.args.get('group')) for m in found] == [(spec.name, '5')]
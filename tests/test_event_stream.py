@@ -0,0 +1,60 @@
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+import time
+
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='Unix socket 端点')
+
+
+def serve_threads():
+    return [t for t in threading.enumerate() if t.name == 'wm-event-stream']
+
+
+def wait_for(cond, timeout=2.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return cond()
+
+
+def test_socket_is_private_from_bind(main, tmp_path):
+    stream = main.EventStream()
+    stream.start(str(tmp_path / 'events.sock'))
+    try:
+        assert stat.S_IMODE(os.stat(stream.address).st_mode) == 0o600
+    finally:
+        stream.stop()
+
+
+def test_stop_ends_accept_loop(main, tmp_path):
+    before = len(serve_threads())
+    stream = main.EventStream()
+    stream.start(str(tmp_path / 'events.sock'))
+    stream.stop()
+    assert wait_for(lambda: len(serve_threads()) <= before)
+    assert not os.path.exists(str(tmp_path / 'events.sock'))
+
+
+def test_subscriber_receives_filtered_events(main, tmp_path):
+    stream = main.EventStream()
+    stream.start(str(tmp_path / 'events.sock'))
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(stream.address)
+        client.sendall(b'{"types": ["topmost"]}\n')
+        assert wait_for(lambda: stream.subscribers)
+        stream.publish('transparent', hwnd=1, alpha=128)
+        stream.publish('topmost', hwnd=2, on=True)
+        client.settimeout(2.0)
+        event = json.loads(client.makefile('rb').readline())
+        assert event['type'] == 'topmost' and event['hwnd'] == 2
+    finally:
+        client.close()
+        stream.stop()
@@ -0,0 +1,46 @@
+import threading
+
+
+def make_tables(main):
+    engine = main.ChordEngine(on_match=lambda match: None)
+    tables = main.HotkeyTables(engine)
+    tables.compile(main.DEFAULT_HOTKEYS, {
+        'game.exe': {'topmost': None},
+        'class:UnrealWindow': {'transparent': ''},
+    })
+    return engine, tables
+
+
+def test_select_by_exe_then_class_then_default(main):
+    _, tables = make_tables(main)
+    assert len(tables) == 2
+    assert tables.select('Game.exe')
+    assert tables.active == 'game.exe'
+    assert not tables.select('game.exe')  # 方案未变
+    assert tables.select('editor.exe', lambda: 'UnrealWindow')
+    assert tables.active == 'class:unrealwindow'
+    assert tables.select('notepad.exe', 'Notepad')
+    assert tables.active == 'default'
+    assert tables.switches == 3
+
+
+def test_disabled_action_is_not_bound(main):
+    engine, tables = make_tables(main)
+    combo = main.parse_combo(f"ctrl+alt+{main.actions.key_for('topmost', main.DEFAULT_HOTKEYS)}")
+    assert combo in engine.first_steps()
+    tables.select('game.exe')
+    assert combo not in engine.first_steps()
+
+
+def test_switch_waits_for_engine_lock(main):
+    engine, tables = make_tables(main)
+    source = main.NativeHotkeySource(engine, install_hook=lambda cb: None, remove_hook=lambda cb: None,
+                                     lock=tables.lock)
+    done = threading.Event()
+    with source._lock:  # 模拟消息线程正在喂引擎
+        worker = threading.Thread(target=lambda: (tables.select('game.exe'), done.set()))
+        worker.start()
+        assert not done.wait(0.1)
+        assert tables.active == 'default'
+    worker.join(2.0)
+    assert done.is_set() and tables.active == 'game.exe'
@@ -0,0 +1,79 @@
+import random
+
+
+def linear(index, exe, cls, title):
+    """逐条检查的参考实现"""
+    return [r for r in index.rules
+            if (not r.exe or r.exe == exe.lower()) and (not r.cls or r.cls == cls)
+            and (r.title is None or r.title.search(title))]
+
+
+def test_buckets_and_config_order(main):
+    index = main.RuleIndex([
+        {'name': '全部', 'actions': {'alpha': 240}},
+        {'exe': 'Code.EXE', 'actions': {'group': 'dev'}},
+        {'class': 'ConsoleWindowClass', 'actions': {'topmost': True}},
+        {'title': r'^Report \d+', 'actions': {'clickthrough': True}},
+        {'exe': 'code.exe', 'class': 'Chrome_WidgetWin_1', 'title': 'README', 'actions': {'show_only': True}},
+    ])
+    assert len(index) == 5
+    names = [r.name for r in index.match('code.exe', 'Chrome_WidgetWin_1', 'README.md - Code')]
+    assert names == ['全部', '规则 2', '规则 5']
+    assert [r.order for r in index.match('cmd.exe', 'ConsoleWindowClass', 'Report 7')] == [0, 2, 3]
+    assert [r.order for r in index.match('other.exe', 'X', 'report 1')] == [0, 3]  # 标题不区分大小写
+
+
+def test_invalid_rules_and_actions_are_dropped(main):
+    index = main.RuleIndex([
+        {'title': '([', 'actions': {'topmost': True}},
+        {'exe': 'a.exe', 'actions': {'topmost': True, 'explode': 1}},
+    ])
+    assert len(index) == 1
+    (rule,) = index.match('A.exe', '', '')
+    assert rule.actions == {'topmost': True}
+
+
+def test_unmergeable_title_patterns_fall_back_to_each_rule(main):
+    # 合并后第二个正则的 \1 会指向第一个正则的分组
+    index = main.RuleIndex([{'title': r'(a)\1', 'actions': {}}, {'title': r'(b)\1', 'actions': {}}])
+    assert index.title_any is None
+    assert [r.order for r in index.match('', '', 'xbb')] == [1]
+    # 重名的命名分组无法编译成一个正则
+    index = main.RuleIndex([{'title': r'(?P<n>a)', 'actions': {}}, {'title': r'(?P<n>b)', 'actions': {}}])
+    assert index.title_any is None
+    assert [r.order for r in index.match('', '', 'b')] == [1]
+    # 普通分组照常合并
+    index = main.RuleIndex([{'title': r'(foo|bar) log', 'actions': {}}, {'title': r'baz', 'actions': {}}])
+    assert index.title_any is not None
+    assert [r.order for r in index.match('', '', 'bar log')] == [0]
+
+
+def test_merge_rule_actions_later_rules_win(main):
+    index = main.RuleIndex([
+        {'actions': {'alpha': 200, 'topmost': True}},
+        {'exe': 'x.exe', 'actions': {'alpha': 120}},
+    ])
+    assert main.merge_rule_actions(index.match('x.exe', '', '')) == {'alpha': 120, 'topmost': True}
+
+
+def test_matches_linear_scan(main):
+    rng = random.Random(3)
+    rules = []
+    for i in range(200):
+        kind = i % 5
+        if kind == 0:
+            rules.append({'exe': f"app{i % 17}.exe", 'actions': {'topmost': True}})
+        elif kind == 1:
+            rules.append({'exe': f"app{i % 17}.exe", 'title': rf"^Report \d+ - {i % 7}$", 'actions': {}})
+        elif kind == 2:
+            rules.append({'class': f"Class{i % 11}", 'title': 'live' if i % 2 else None, 'actions': {}})
+        elif kind == 3:
+            rules.append({'title': rf"dashboard-{i % 13}\b", 'actions': {}})
+        else:
+            rules.append({'exe': f"APP{i % 17}.exe", 'class': f"Class{i % 11}", 'actions': {}})
+    index = main.RuleIndex(rules)
+    for _ in range(2000):
+        i = rng.randrange(40)
+        exe, cls = f"app{i % 20}.exe", f"Class{i % 12}"
+        title = rng.choice([f"Report {i} - {i % 8}", f"dashboard-{i % 15} live", "untitled"])
+        assert index.match(exe, cls, title) == linear(index, exe, cls, title)
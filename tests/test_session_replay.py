@@ -0,0 +1,72 @@
+import pytest
+
+
+@pytest.fixture
+def sim_controller(main, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'PERSIST_FILE', str(tmp_path / 'wm_config.json'))
+    sim = main.SimBackend()
+    main.install_backend(sim)
+    model = main.Model()
+    controller = main.Controller(model, install_hooks=False)
+    main.session_tape.attach(sim.listener)
+    yield sim, model, controller
+    main.session_tape.stop()
+    controller.journal.close()
+
+
+def test_tape_record_round_trip(main, tmp_path):
+    import gzip
+    path = str(tmp_path / 't.wmrec')
+    with gzip.open(path, 'wb') as f:
+        f.write(main.TAPE_MAGIC + bytes(8))
+        main.write_tape_record(f, 1500, main.T_WINDOW, 0x1400007, -0x1400007,
+                               ('/usr/bin/编辑器', 'Code', '标题 · 1', 0, 0, 800, 600))
+        main.write_tape_record(f, 250, main.T_DESTROY, 0x1400007, 0)
+        main.write_tape_record(f, 10, main.T_TITLE, 16, 0, ('',))
+    assert list(main.read_tape(path)) == [
+        (1500, main.T_WINDOW, 0x1400007, -0x1400007, ['/usr/bin/编辑器', 'Code', '标题 · 1', '0', '0', '800', '600']),
+        (1750, main.T_DESTROY, 0x1400007, 0, []),
+        (1760, main.T_TITLE, 16, 0, []),  # 空标题不占字节，重放时按空字符串处理
+    ]
+
+
+def test_read_tape_rejects_other_files(main, tmp_path):
+    import gzip
+    path = str(tmp_path / 'x.wmrec')
+    with gzip.open(path, 'wb') as f:
+        f.write(b'JUNK' + bytes(8))
+    with pytest.raises(ValueError):
+        list(main.read_tape(path))
+
+
+def test_recorder_captures_sim_session(main, tmp_path, sim_controller):
+    sim, model, controller = sim_controller
+    sim.open_window(0x10, 101, '/a', 'A', '编辑器', (0, 0, 400, 300))
+    gid = model.create_group('工作')
+    model.add_to_group(gid, 0x10)
+    path = main.session_tape.start(model, str(tmp_path / 's.wmrec'))
+    sim.open_window(0x20, 102, '/b', 'B', '终端', (10, 10, 500, 400))
+    sim.retitle(0x20, '终端 - 2')
+    sim.move(0x10, (5, 5, 405, 305))
+    sim.activate(0x20)
+    sim.close_window(0x20)
+    assert main.session_tape.stop() == path
+    assert main.EVENT_OBJECT_LOCATIONCHANGE not in sim.listener._subs  # 停止录制后不再订阅窗口移动
+
+    tape = [(kind, hwnd, pid, fields) for _, kind, hwnd, pid, fields in main.read_tape(path)]
+    assert tape[:2] == [(main.T_WINDOW, 0x10, 101, ['/a', 'A', '编辑器', '0', '0', '400', '300']),
+                        (main.T_GROUP, 0x10, gid, ['工作'])]
+    assert [(kind, hwnd) for kind, hwnd, _, _ in tape[2:]] == [
+        (main.T_WINDOW, 0x20), (main.T_TITLE, 0x20), (main.T_MOVE, 0x10),
+        (main.T_FOREGROUND, 0x20), (main.T_DESTROY, 0x20)]
+    assert tape[3][3] == ['终端 - 2'] and tape[4][3] == ['5', '5', '405', '305']
+
+
+def test_replay_generated_session(main, tmp_path, monkeypatch):
+    monkeypatch.setenv('QT_QPA_PLATFORM', 'offscreen')
+    path = str(tmp_path / 'g.wmrec')
+    main.generate_session(path, windows=20, events=300)
+    records = list(main.read_tape(path))
+    timings = main.replay_session(path)
+    assert sum(len(v) for name, v in timings.items() if name != 'group_manager') == len(records)
+    assert {'window', 'foreground', 'title', 'move'} <= set(timings)
@@ -0,0 +1,96 @@
+import os
+
+
+def reopen(main, path, **kwargs):
+    journal = main.StateJournal(path, **kwargs)
+    leftover = journal.open()
+    return journal, leftover
+
+
+def test_round_trip_keeps_first_original(main, tmp_path):
+    path = str(tmp_path / 'j.bin')
+    journal, leftover = reopen(main, path)
+    assert leftover == {}
+    journal.record(main.J_TOPMOST, 100, 42, 0, 1)
+    journal.record(main.J_ALPHA, 100, 42, -1, 200)
+    journal.record(main.J_ALPHA, 100, 42, 200, 120)  # 原始值仍为 -1
+    journal.record(main.J_MINIMIZED, 200, 43, 0, 1)
+    journal.clear(main.J_MINIMIZED, 200)
+    journal.close()
+
+    journal, leftover = reopen(main, path)
+    assert leftover == {(100, main.J_TOPMOST): (42, 0, 1), (100, main.J_ALPHA): (42, -1, 120)}
+    assert journal.original(main.J_ALPHA, 100) == -1
+    journal.close()
+
+
+def test_negative_pid_is_stored(main, tmp_path):
+    # X11 下没有 _NET_WM_PID 的窗口以 -窗口 id 作为 pid
+    path = str(tmp_path / 'j.bin')
+    journal, _ = reopen(main, path)
+    journal.record(main.J_PEEK, 0x1400007, -0x1400007, 0, 255)
+    journal.close()
+    journal, leftover = reopen(main, path)
+    assert leftover == {(0x1400007, main.J_PEEK): (-0x1400007, 0, 255)}
+    journal.close()
+
+
+def test_failed_write_leaves_live_unchanged(main, tmp_path):
+    journal, _ = reopen(main, str(tmp_path / 'j.bin'))
+    try:
+        journal.record(main.J_TOPMOST, 100, 2 ** 40, 0, 1)
+    except Exception:
+        pass
+    assert journal.live == {}
+    journal.close()
+
+
+def test_compaction_keeps_only_live_records(main, tmp_path):
+    path = str(tmp_path / 'j.bin')
+    size = 4096
+    journal, _ = reopen(main, path, size=size)
+    for i in range(1000):
+        journal.record(main.J_TOPMOST, 1000 + i % 10, 7, 0, 1)
+        journal.clear(main.J_TOPMOST, 1000 + i % 10)
+    journal.record(main.J_TOPMOST, 5, 7, 0, 1)
+    assert journal.size == size
+    assert os.path.getsize(path) == size
+    journal.close()
+    journal, leftover = reopen(main, path, size=size)
+    assert leftover == {(5, main.J_TOPMOST): (7, 0, 1)}
+    journal.close()
+
+
+def test_grows_when_live_records_fill_the_file(main, tmp_path):
+    path = str(tmp_path / 'j.bin')
+    journal, _ = reopen(main, path, size=1024)
+    for hwnd in range(500):
+        journal.record(main.J_MINIMIZED, hwnd, 9, 0, 1)
+    assert journal.size > 1024
+    journal.close()
+    journal, leftover = reopen(main, path)
+    assert len(leftover) == 500
+    journal.close()
+
+
+def test_partial_record_is_ignored(main, tmp_path):
+    path = str(tmp_path / 'j.bin')
+    journal, _ = reopen(main, path)
+    journal.record(main.J_TOPMOST, 1, 2, 0, 1)
+    journal.record(main.J_TOPMOST, 3, 4, 0, 1)
+    # 模拟第二条写到一半时进程被杀: 偏移停在记录中间
+    offset = journal.HEADER.size + journal.RECORD.size + 5
+    main.struct.pack_into('<Q', journal._mm, 8, offset)
+    journal.close()
+    journal, leftover = reopen(main, path)
+    assert leftover == {(1, main.J_TOPMOST): (2, 0, 1)}
+    journal.close()
+
+
+def test_reset_forgets_everything(main, tmp_path):
+    path = str(tmp_path / 'j.bin')
+    journal, _ = reopen(main, path)
+    journal.record(main.J_TOPMOST, 1, 2, 0, 1)
+    journal.reset()
+    journal.close()
+    assert reopen(main, path)[1] == {}
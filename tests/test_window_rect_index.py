@@ -0,0 +1,52 @@
+import random
+
+
+def topmost_at(items, x, y):
+    return next((h for h, (l, t, r, b) in items if l <= x < r and t <= y < b), 0)
+
+
+def test_topmost_window_wins(main):
+    # 自顶向下: 1 在 2 之上，3 有一部分露在 2 的右下方
+    items = [(1, (100, 100, 300, 300)), (2, (0, 0, 1000, 800)), (3, (900, 700, 1100, 900))]
+    index = main.WindowRectIndex(items)
+    assert index.lookup(150, 150) == 1
+    assert index.lookup(350, 350) == 2
+    assert index.lookup(950, 750) == 2
+    assert index.lookup(1050, 850) == 3
+    assert index.lookup(1200, 50) == 0
+    assert index.rect_of(3) == (900, 700, 1100, 900) and index.rect_of(9) is None
+
+
+def test_edges_are_half_open(main):
+    index = main.WindowRectIndex([(1, (0, 0, 128, 128)), (2, (128, 0, 256, 128))])
+    assert index.lookup(127, 0) == 1
+    assert index.lookup(128, 0) == 2
+    assert index.lookup(0, 128) == 0
+
+
+def test_bounds_drop_offscreen_and_duplicates(main):
+    index = main.WindowRectIndex([(1, (-32000, -32000, -31840, -31972)), (2, (-50, -50, 100, 100)),
+                                  (2, (500, 500, 600, 600))], bounds=(0, 0, 1920, 1080))
+    assert len(index) == 1  # 最小化的窗口被裁掉，重复的 hwnd 只取最上层那次
+    assert index.lookup(0, 0) == 2
+    assert index.lookup(550, 550) == 0
+
+
+def test_covered_cells_stop_collecting(main):
+    index = main.WindowRectIndex([(1, (0, 0, 1024, 1024))] + [(i, (10, 10, 900, 900)) for i in range(2, 50)])
+    assert all(bucket == [0] for bucket in index.cells.values())
+    assert index.lookup(500, 500) == 1
+
+
+def test_matches_linear_scan(main):
+    rng = random.Random(5)
+    width, height = 2560, 1440
+    items = []
+    for i in range(400):
+        w, h = rng.randint(50, 1400), rng.randint(40, 900)
+        x, y = rng.randint(-200, width), rng.randint(-200, height)
+        items.append((i + 1, (x, y, x + w, y + h)))
+    index = main.WindowRectIndex(items, bounds=(0, 0, width, height), cell_shift=6)
+    for _ in range(3000):
+        x, y = rng.randrange(width), rng.randrange(height)
+        assert index.lookup(x, y) == topmost_at(items, x, y)
@@ -0,0 +1,30 @@
+def sim_with_windows(main):
+    sim = main.SimBackend()
+    sim.open_window(0x10, 1001, 'a.exe', 'A', '编辑器', (0, 0, 800, 600))
+    sim.open_window(0x20, 1002, 'b.exe', 'B', '   ', (0, 0, 300, 200))  # 标题全是空白
+    sim.open_window(0x30, 1003, 'c.exe', 'C', '终端', (100, 100, 600, 400))
+    sim.open_window(0x40, 1004, 'd.exe', 'D', '隐藏', (0, 0, 100, 100))
+    sim.hide_window(0x40)
+    return sim
+
+
+def test_both_modes_list_the_same_windows(main):
+    sim = sim_with_windows(main)
+    bare = sim.enum_window_table(titles=False)
+    full = sim.enum_window_table(titles=True)
+    assert bare.titles is None
+    assert list(bare.hwnds) == list(full.hwnds) == [0x30, 0x10]
+    assert list(bare.pids) == list(full.pids) == [1003, 1001]
+    assert full.titles == ['终端', '编辑器']
+
+
+def test_table_matches_enum_windows(main):
+    sim = sim_with_windows(main)
+    assert sim.enum_window_table(titles=True).pairs() == sim.enum_windows()
+
+
+def test_collect_rebuilds_process_index(main):
+    sim = sim_with_windows(main)
+    sim.enum_window_table()
+    assert main.process_index.pid_hwnds == {1001: {0x10}, 1003: {0x30}}
+    assert main.process_index.pid_of(0x20) is None